@@ -0,0 +1,76 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+"""
+jxi, the json/xml hybrid. The things most programs need are here:
+
+	parse(text [, tagclass=Entity, ...])   -> list of top-level elements
+	dumps(elem [, buffer=None, ...])       -> jxi text
+	iterparse(chunks [, tagclass=Entity])  -> parse events, a chunk at a time
+	Entity, freeze, thaw, JXIParseError, JXILimitError, Limits
+
+Nothing is imported until it's first used, so `import jxi` costs next to
+nothing. The rest lives in the submodules (jxi.compress, jxi.archive, ...),
+which can be imported as usual. jxi.parse is the function rather than the
+module of the same name; use `from jxi.parse import ...` to get at the
+module's contents."""
+
+import sys
+from types import ModuleType
+
+# what's exported, and the submodule it comes from
+exports = {
+	"parse": "parse",
+	"dumps": "entity",
+	"iterparse": "incremental",
+	"Entity": "entity",
+	"freeze": "entity",
+	"thaw": "entity",
+	"JXIParseError": "lex",
+	"JXILimitError": "lex",
+	"Limits": "lex"
+}
+
+__all__ = sorted(exports)
+
+class LazyPackage(ModuleType):
+	"""the jxi package, which imports its exports' submodules when they're
+first asked for"""
+	def __getattribute__(self, name):
+		namespace = ModuleType.__getattribute__(self, "__dict__")
+		value = namespace.get(name, None)
+		# importing a submodule sets it on the package, which for jxi.parse
+		# hides the function of the same name
+		if name in exports and (value is None or type(value) is ModuleType):
+			module = __import__(namespace["__name__"] + "." + exports[name], fromlist=[name])
+			value = namespace[name] = getattr(module, name)
+			return value
+		return ModuleType.__getattribute__(self, name)
+
+	def __dir__(self):
+		return sorted(set(self.__dict__) | set(exports))
+
+# swap this module for a lazy one with the same contents. The old one is kept
+# alive by a reference from the new one, since this code's globals are its
+package = LazyPackage(__name__, __doc__)
+package.__dict__.update(dict((key, value) for key, value in globals().items() if key != "__doc__"))
+package._module = sys.modules[__name__]
+sys.modules[__name__] = package
@@ -0,0 +1,219 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os, mmap, bisect
+from array import array
+import lex, parse
+from entity import Entity
+from incremental import closing_chars, truncated
+
+# first line of every index file
+header = "jxi-index 1"
+
+# keys are written to the index file as a type char followed by the value
+def encode_key(key):
+	if key is None:
+		return "-"
+	elif type(key) in (int, long):
+		return "i%d" % key
+	elif type(key) == float:
+		return "f%r" % key
+	return "s" + key.encode("string_escape")
+
+def decode_key(field):
+	kind, value = field[0], field[1:]
+	if kind == "-":
+		return None
+	elif kind == "i":
+		return int(value)
+	elif kind == "f":
+		return float(value)
+	return value.decode("string_escape")
+
+# finds the top-level elements in data from start onwards and returns a list of
+# (offset, length, key) for them
+@parse.locked
+def scan(data, start, key=None):
+	size = len(data)
+	entries = []
+	parse.scheduled_links = []
+	parse.lexer = lex.lex(data, start)
+	try:
+		parse.next()
+		while parse.token[0] != "EOF":
+			offset = lex.token_start
+			elem = parse.parse_element()
+
+			# an element which runs right up to the end might not be finished
+			# yet, e.g. 12 could be the start of 123
+			if lex.token_start >= size and data[size-1] not in closing_chars:
+				break
+
+			length = len(data[offset:lex.token_start].rstrip(lex.whitespace_chars))
+			value = getattr(elem, key, None) if key is not None and isinstance(elem, Entity) else None
+			if not isinstance(value, (int, long, float, str)):
+				value = None
+			entries.append((offset, length, value))
+			# links can only be followed once an element is parsed on its own
+			parse.scheduled_links = []
+	except lex.JXIParseError, e:
+		# a half-written element at the end just gets picked up next time
+		if not truncated(e, size):
+			raise
+	finally:
+		# don't hang on to data once it's closed
+		lex.line_index = None
+	return entries
+
+class ArchiveIndex(object):
+	"""
+a sidecar index for a jxi archive: a big file of top-level elements which only
+ever gets appended to. It records where each element starts and how long it is,
+and optionally a key for each, taken from one of its attributes, so single
+elements can be read without parsing the whole archive.
+Syntax:
+	ArchiveIndex(archive [, key=None, path=None])
+archive is the path of the archive, path is where the index lives, defaulting
+to archive + ".idx". An existing index is loaded, otherwise a new one is
+started. Either way, call update() to pick up any elements added since.
+key is the name of the attribute to key elements by. Elements which aren't tags,
+or whose key attribute is missing or isn't a number or string, have no key.
+Links inside an element are resolved against the element alone, and only when
+they're accessed (see parse's lazy_links)."""
+	def __init__(self, archive, key=None, path=None):
+		self.archive = archive
+		self.key = key
+		self.path = path if path is not None else archive + ".idx"
+
+		self.offsets = array("L")
+		self.lengths = array("L")
+		self.keys = []
+		# keys sorted for range lookups, built when first needed
+		self._sorted = None
+		self._file = None
+
+		if os.path.exists(self.path):
+			self._load()
+		else:
+			self.rebuild()
+
+	def _load(self):
+		with open(self.path, "rb") as f:
+			fields = f.readline().rstrip("\n").split(" ", 2)
+			if " ".join(fields[:2]) != header:
+				raise ValueError("%s is not a jxi index" % self.path)
+			key = decode_key(fields[2])
+			if key != self.key:
+				raise ValueError("%s is keyed by %r, not %r" % (self.path, key, self.key))
+			for line in f:
+				offset, length, key = line.rstrip("\n").split(" ", 2)
+				self.offsets.append(int(offset))
+				self.lengths.append(int(length))
+				self.keys.append(decode_key(key))
+
+	def rebuild(self):
+		"""throws away the index file and starts again from scratch"""
+		del self.offsets[:], self.lengths[:], self.keys[:]
+		self._sorted = None
+		with open(self.path, "wb") as f:
+			f.write("%s %s\n" % (header, encode_key(self.key)))
+		return self.update()
+
+	@property
+	def end(self):
+		"""how far into the archive the index goes"""
+		return self.offsets[-1] + self.lengths[-1] if self.offsets else 0
+
+	def update(self):
+		"""indexes any elements added to the archive since the last update, and
+returns how many there were"""
+		with open(self.archive, "rb") as f:
+			size = os.fstat(f.fileno()).st_size
+			if size < self.end:
+				raise ValueError("%s is shorter than its index. Rebuild it" % self.archive)
+			if size == self.end:
+				return 0
+			data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+			try:
+				entries = scan(data, self.end, self.key)
+			finally:
+				data.close()
+
+		with open(self.path, "ab") as f:
+			for offset, length, key in entries:
+				self.offsets.append(offset)
+				self.lengths.append(length)
+				self.keys.append(key)
+				f.write("%d %d %s\n" % (offset, length, encode_key(key)))
+		if entries:
+			self._sorted = None
+		return len(entries)
+
+	def __len__(self):
+		return len(self.offsets)
+
+	def read(self, n):
+		"""returns the text of element n"""
+		if self._file is None:
+			self._file = open(self.archive, "rb")
+		self._file.seek(self.offsets[n])
+		return self._file.read(self.lengths[n])
+
+	def element(self, n):
+		"""seeks to element n and parses it"""
+		return parse.parse(self.read(n), lazy_links=True)[0]
+
+	__getitem__ = element
+
+	def find(self, key):
+		"""returns the first element with the given key. Raises KeyError if
+there isn't one"""
+		keys, positions = self._sorted_keys()
+		i = bisect.bisect_left(keys, key)
+		if i == len(keys) or keys[i] != key:
+			raise KeyError(key)
+		return self.element(positions[i])
+
+	def keyrange(self, low=None, high=None):
+		"""
+yields the elements with low <= key < high, in key order. Leave out low or high
+to go from the start or to the end"""
+		keys, positions = self._sorted_keys()
+		start = bisect.bisect_left(keys, low) if low is not None else 0
+		stop = bisect.bisect_left(keys, high) if high is not None else len(keys)
+		for i in xrange(start, stop):
+			yield self.element(positions[i])
+
+	def _sorted_keys(self):
+		if self._sorted is None:
+			pairs = sorted((key, n) for n, key in enumerate(self.keys) if key is not None)
+			self._sorted = ([key for key, n in pairs], [n for key, n in pairs])
+		return self._sorted
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
@@ -0,0 +1,278 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import bisect
+from entity import Entity
+
+# attribute values which get indexed. Anything else (lists, dicts, tags) is
+# looked inside for more tags instead
+value_types = (basestring, int, long, float)
+
+missing = object()
+
+class AttrIndex(object):
+	"""
+an index of the tags in a tree by their attribute values, so finding the tag
+with a given id doesn't mean looking at every tag in the document.
+Syntax:
+	AttrIndex([attrs=None])
+	parse(text, index=index)
+attrs is the names of the attributes to index, or None for all of them. Only
+strings and numbers are indexed. parse(text, index=index) fills it in with the
+tags it parses, which are IndexedEntities, and they keep it up to date when
+they're changed through their attributes or the Entity child methods (_append,
+_insert, _remove, del tag[...] and so on). Changing a tag's _children list
+directly isn't noticed, and neither are lazy links until they're resolved.
+Things are added and removed a subtree at a time, so taking a tag out of the
+tree drops everything in it from the index, even if it's linked to from
+elsewhere."""
+	def __init__(self, attrs=None):
+		self.attrs = frozenset(attrs) if attrs is not None else None
+		# maps attr -> value -> id(tag) -> tag
+		self._entries = {}
+		# maps attr -> sorted list of its values, built when first needed
+		self._sorted = {}
+		self._tags = {}
+
+	##### keeping it up to date #####
+
+	def add(self, obj):
+		"""indexes every tag in obj, which can be anything parse returns"""
+		# this is tags_in and _add_value rolled into one, as it goes over
+		# every tag parse(text, index=index) makes
+		tags = self._tags
+		entries = self._entries
+		attrs = self.attrs
+		seen = set()
+		stack = [obj]
+		while stack:
+			obj = stack.pop()
+			key = id(obj)
+			if key in seen:
+				continue
+			seen.add(key)
+			if isinstance(obj, Entity):
+				if key in tags:
+					continue
+				tags[key] = obj
+				d = obj.__dict__
+				if type(obj) == IndexedEntity:
+					d["_attr_index"] = self
+				for name, value in d.iteritems():
+					if name[0] == "_":
+						continue
+					elif not isinstance(value, value_types):
+						stack.append(value)
+					elif attrs is None or name in attrs:
+						values = entries.get(name)
+						if values is None:
+							values = entries[name] = {}
+						bucket = values.get(value)
+						if bucket is None:
+							bucket = values[value] = {}
+							self._sorted.pop(name, None)
+						bucket[key] = obj
+				stack.extend(raw_items(obj._children))
+			elif isinstance(obj, (list, tuple)):
+				stack.extend(raw_items(obj))
+			elif isinstance(obj, dict):
+				stack.extend(dict.itervalues(obj))
+
+	def discard(self, obj):
+		"""drops every tag in obj from the index"""
+		for tag in tags_in(obj):
+			if self._tags.pop(id(tag), None) is None:
+				continue
+			tag.__dict__.pop("_attr_index", None)
+			for name, value in tag.__dict__.items():
+				self._remove_value(tag, name, value)
+
+	def _add_value(self, tag, name, value):
+		if not isinstance(value, value_types) or name.startswith("_") or \
+		   (self.attrs is not None and name not in self.attrs):
+			return
+		values = self._entries.setdefault(name, {})
+		tags = values.get(value)
+		if tags is None:
+			tags = values[value] = {}
+			self._sorted.pop(name, None)
+		tags[id(tag)] = tag
+
+	def _remove_value(self, tag, name, value):
+		if not isinstance(value, value_types):
+			return
+		values = self._entries.get(name)
+		tags = values.get(value) if values is not None else None
+		if tags is None:
+			return
+		tags.pop(id(tag), None)
+		if not tags:
+			del values[value]
+			self._sorted.pop(name, None)
+
+	# called by IndexedEntity when one of its attributes changes
+	def _changed(self, tag, name, old, new):
+		if old is not missing:
+			if isinstance(old, value_types):
+				self._remove_value(tag, name, old)
+			else:
+				self.discard(old)
+		if new is not missing:
+			if isinstance(new, value_types):
+				self._add_value(tag, name, new)
+			else:
+				self.add(new)
+
+	##### looking things up #####
+
+	def find(self, attr, value):
+		"""returns every tag whose attribute attr is value, in no particular order"""
+		tags = self._entries.get(attr, {}).get(value)
+		return tags.values() if tags is not None else []
+
+	def get(self, attr, value, default=None):
+		"""returns a tag whose attribute attr is value, or default if there isn't one"""
+		tags = self._entries.get(attr, {}).get(value)
+		if not tags:
+			return default
+		return next(tags.itervalues())
+
+	def having(self, attr):
+		"""returns every tag with the attribute attr"""
+		return [tag for tags in self._entries.get(attr, {}).itervalues() for tag in tags.itervalues()]
+
+	def values(self, attr):
+		"""returns the values attr takes, sorted"""
+		values = self._sorted.get(attr)
+		if values is None:
+			values = self._sorted[attr] = sorted(self._entries.get(attr, ()))
+		return values
+
+	def valuerange(self, attr, low=None, high=None):
+		"""
+yields the tags with low <= attr < high, in order of attr. Leave out low or
+high to go from the start or to the end"""
+		values = self.values(attr)
+		start = bisect.bisect_left(values, low) if low is not None else 0
+		stop = bisect.bisect_left(values, high) if high is not None else len(values)
+		entries = self._entries[attr] if start < stop else None
+		for value in values[start:stop]:
+			for tag in entries[value].values():
+				yield tag
+
+	def __contains__(self, tag):
+		return id(tag) in self._tags
+
+	def __len__(self):
+		return len(self._tags)
+
+# yields the tags in obj, each one once. Lazy links and numbers are left alone
+def tags_in(obj, skip=()):
+	seen = set()
+	stack = [obj]
+	while stack:
+		obj = stack.pop()
+		if id(obj) in seen or isinstance(obj, value_types):
+			continue
+		seen.add(id(obj))
+		if isinstance(obj, Entity):
+			if id(obj) in skip:
+				continue
+			yield obj
+			stack.extend(value for name, value in obj.__dict__.items() if not name.startswith("_"))
+			stack.extend(raw_items(obj._children))
+		elif isinstance(obj, (list, tuple)):
+			stack.extend(raw_items(obj))
+		elif isinstance(obj, dict):
+			stack.extend(dict.itervalues(obj))
+
+def raw_items(items):
+	return list.__iter__(items) if isinstance(items, list) else iter(items)
+
+class IndexedEntity(Entity):
+	"""
+a tag which keeps an AttrIndex up to date as it's changed. parse(text,
+index=index) makes these"""
+	def __init__(self, name="", attrs={}, children=[]):
+		d = self.__dict__
+		d["_children"] = children
+		d["_tag_name"] = name
+		d["_parent"] = None
+		d.update(attrs)
+
+	def __setattr__(self, name, value):
+		d = self.__dict__
+		index = d.get("_attr_index")
+		old = d.get(name, missing)
+		d[name] = value
+		if index is not None:
+			if name == "_children":
+				index.discard(old)
+				index.add(value)
+			elif not name.startswith("_"):
+				index._changed(self, name, old, value)
+
+	def __delattr__(self, name):
+		d = self.__dict__
+		if name not in d:
+			raise AttributeError(name)
+		old = d.pop(name)
+		index = d.get("_attr_index")
+		if index is not None and not name.startswith("_"):
+			index._changed(self, name, old, missing)
+
+	def _added(self, elems):
+		index = self.__dict__.get("_attr_index")
+		if index is not None:
+			index.add(elems)
+
+	def _removed(self, elems):
+		index = self.__dict__.get("_attr_index")
+		if index is not None:
+			index.discard(elems)
+
+	def _append(self, elem):
+		self._children.append(elem)
+		self._added(elem)
+
+	def _extend(self, elems):
+		elems = list(elems)
+		self._children.extend(elems)
+		self._added(elems)
+
+	def _insert(self, i, elem):
+		self._children.insert(i, elem)
+		self._added(elem)
+
+	# list.remove goes by ==, which for tags means by name, so it's the one
+	# actually taken out that has to come out of the index
+	def _remove(self, elem):
+		self._removed(self._children.pop(self._children.index(elem)))
+
+	def _pop(self, i):
+		elem = self._children.pop(i)
+		self._removed(elem)
+		return elem
+
+	def __delitem__(self, key):
+		removed = self[key]
+		Entity.__delitem__(self, key)
+		self._removed(removed)
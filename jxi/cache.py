@@ -0,0 +1,114 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import sys, copy, hashlib, threading
+from collections import OrderedDict
+import parse
+from entity import Entity
+
+class Parser(object):
+	"""
+a memoizing front end for parse. Results are cached by a hash of the text, and
+the least recently used ones are thrown out once there are more than
+cache_size of them, or once the trees take up more than max_bytes of memory,
+as near as sys.getsizeof can tell.
+Syntax:
+	Parser([cache_size=128, max_bytes=None, tagclass=Entity, copy=True, frozen=False])
+With copy=True every call gets its own deep copy of the cached result, so
+callers can mutate what they get back. With copy=False everyone shares the
+cached objects, which is faster but only safe if nobody modifies them.
+frozen=True caches immutable trees (see entity.freeze), which are shared
+safely without copying."""
+	def __init__(self, cache_size=128, max_bytes=None, tagclass=Entity, copy=True, frozen=False):
+		self.cache_size = cache_size
+		self.max_bytes = max_bytes
+		self.tagclass = tagclass
+		self.copy = copy and not frozen
+		self.frozen = frozen
+
+		self.hits = 0
+		self.misses = 0
+		self.size_bytes = 0
+
+		# maps hash -> (result, size in bytes), oldest first
+		self._cache = OrderedDict()
+		# guards the cache. parse.parse takes care of its own globals
+		self._lock = threading.Lock()
+
+	def parse(self, text):
+		"""returns parse(text, tagclass, frozen), from the cache if possible"""
+		data = text.encode("utf-8") if isinstance(text, unicode) else text
+		key = hashlib.sha1(data).digest()
+
+		with self._lock:
+			if key in self._cache:
+				# move to the most recently used end
+				entry = self._cache.pop(key)
+				self._cache[key] = entry
+				self.hits += 1
+			else:
+				self.misses += 1
+				result = parse.parse(text, self.tagclass, self.frozen)
+				entry = (result, tree_size(result) if self.max_bytes is not None else 0)
+				self._store(key, entry)
+
+		# cached trees never change, so copying them needn't hold anyone up
+		return copy.deepcopy(entry[0]) if self.copy else entry[0]
+
+	def _store(self, key, entry):
+		size = entry[1]
+		if self.cache_size <= 0 or (self.max_bytes is not None and size > self.max_bytes):
+			return
+		self._cache[key] = entry
+		self.size_bytes += size
+
+		while len(self._cache) > self.cache_size or \
+				(self.max_bytes is not None and self.size_bytes > self.max_bytes):
+			_, (_, old_size) = self._cache.popitem(last=False)
+			self.size_bytes -= old_size
+
+	def clear(self):
+		with self._lock:
+			self._cache.clear()
+			self.size_bytes = 0
+
+	def __len__(self):
+		return len(self._cache)
+
+# roughly how many bytes elem takes up, counting everything in it once
+def tree_size(elem):
+	seen = set()
+	size = 0
+	stack = [elem]
+	while stack:
+		obj = stack.pop()
+		if id(obj) in seen:
+			continue
+		seen.add(id(obj))
+		size += sys.getsizeof(obj)
+		if isinstance(obj, Entity):
+			size += sys.getsizeof(obj.__dict__)
+			stack.extend(obj.__dict__.itervalues())
+		elif isinstance(obj, dict):
+			stack.extend(obj.iterkeys())
+			stack.extend(obj.itervalues())
+		elif isinstance(obj, (list, tuple, set, frozenset)):
+			stack.extend(obj)
+	return size
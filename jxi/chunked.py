@@ -0,0 +1,280 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import copy
+from itertools import chain
+
+class ChunkedList(object):
+	"""
+a list kept in chunks of a few hundred items, for the children of very wide
+tags. Positional inserts and deletes only shuffle one chunk along, and finding
+the chunk is O(log n), so editing a tag with hundreds of thousands of children
+in place doesn't have to move all of them every time. Plain lists are quicker
+for everything else, so only use this where that matters.
+Syntax:
+	ChunkedList([items, load=512])
+	tag._children = ChunkedList(tag._children)
+It acts like a list, apart from slices, which come back as plain lists. Chunks
+are split once they get to 2*load items, and merged with a neighbour when they
+drop below load/4. remove_if() takes out everything matching a test in one
+pass, which is what del tag[".name"] uses."""
+	def __init__(self, items=(), load=512):
+		self._load = load
+		self._build(items)
+
+	def _build(self, items):
+		items = list(items)
+		load = self._load
+		self._chunks = [items[i:i+load] for i in xrange(0, len(items), load)]
+		self._len = len(items)
+		self._tree = None
+
+	##### finding things #####
+
+	# a fenwick tree over the chunk lengths, so the chunk holding a given
+	# position can be found, and the lengths updated, in O(log n). Splitting or
+	# merging chunks just throws it away, and it's rebuilt when next needed
+	def _index_tree(self):
+		if self._tree is None:
+			n = len(self._chunks)
+			tree = [0] + [len(chunk) for chunk in self._chunks]
+			for i in xrange(1, n + 1):
+				j = i + (i & -i)
+				if j <= n:
+					tree[j] += tree[i]
+			self._tree = tree
+		return self._tree
+
+	def _grew(self, c, by):
+		tree = self._tree
+		if tree is not None:
+			i = c + 1
+			n = len(tree)
+			while i < n:
+				tree[i] += by
+				i += i & -i
+
+	# returns the chunk number and position within it of item i, which must
+	# be in range and not negative
+	def _locate(self, i):
+		chunks = self._chunks
+		if len(chunks) == 1:
+			return 0, i
+		last = chunks[-1]
+		if i >= self._len - len(last):
+			return len(chunks) - 1, i - (self._len - len(last))
+		tree = self._index_tree()
+		n = len(tree) - 1
+		c = 0
+		bit = 1 << (n.bit_length() - 1)
+		while bit:
+			step = c + bit
+			if step <= n and tree[step] <= i:
+				c = step
+				i -= tree[step]
+			bit >>= 1
+		return c, i
+
+	def _position(self, i):
+		if not isinstance(i, (int, long)):
+			raise TypeError("list indices must be integers, not %s" % type(i).__name__)
+		if i < 0:
+			i += self._len
+		if not 0 <= i < self._len:
+			raise IndexError("list index out of range")
+		return i
+
+	##### keeping chunks the right size #####
+
+	def _split(self, c):
+		chunk = self._chunks[c]
+		half = len(chunk) // 2
+		self._chunks[c+1:c+1] = [chunk[half:]]
+		del chunk[half:]
+		self._tree = None
+
+	def _shrunk(self, c):
+		chunks = self._chunks
+		chunk = chunks[c]
+		if not chunk:
+			del chunks[c]
+			self._tree = None
+		elif len(chunk) < self._load // 4 and len(chunks) > 1:
+			# fold it into a neighbour
+			if c == len(chunks) - 1:
+				c -= 1
+			chunks[c].extend(chunks.pop(c + 1))
+			self._tree = None
+			if len(chunks[c]) >= 2 * self._load:
+				self._split(c)
+
+	##### list methods #####
+
+	def __len__(self):
+		return self._len
+
+	def __iter__(self):
+		return chain.from_iterable(self._chunks)
+
+	def __reversed__(self):
+		for chunk in reversed(self._chunks):
+			for item in reversed(chunk):
+				yield item
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return list(self)[i]
+		c, j = self._locate(self._position(i))
+		return self._chunks[c][j]
+
+	def __setitem__(self, i, value):
+		if isinstance(i, slice):
+			items = list(self)
+			items[i] = value
+			self._build(items)
+			return
+		c, j = self._locate(self._position(i))
+		self._chunks[c][j] = value
+
+	def __delitem__(self, i):
+		if isinstance(i, slice):
+			items = list(self)
+			del items[i]
+			self._build(items)
+			return
+		c, j = self._locate(self._position(i))
+		del self._chunks[c][j]
+		self._len -= 1
+		self._grew(c, -1)
+		self._shrunk(c)
+
+	def append(self, item):
+		chunks = self._chunks
+		if not chunks:
+			chunks.append([])
+			self._tree = None
+		chunks[-1].append(item)
+		self._len += 1
+		self._grew(len(chunks) - 1, 1)
+		if len(chunks[-1]) >= 2 * self._load:
+			self._split(len(chunks) - 1)
+
+	def extend(self, items):
+		items = list(items)
+		if not items:
+			return
+		chunks = self._chunks
+		load = self._load
+		start = 0
+		if chunks and len(chunks[-1]) < load:
+			start = load - len(chunks[-1])
+			chunks[-1].extend(items[:start])
+		chunks.extend(items[i:i+load] for i in xrange(start, len(items), load))
+		self._len += len(items)
+		self._tree = None
+
+	def __iadd__(self, items):
+		self.extend(items)
+		return self
+
+	def insert(self, i, item):
+		# clamped, like list.insert
+		if i < 0:
+			i = max(i + self._len, 0)
+		if i >= self._len:
+			self.append(item)
+			return
+		c, j = self._locate(i)
+		chunk = self._chunks[c]
+		chunk.insert(j, item)
+		self._len += 1
+		self._grew(c, 1)
+		if len(chunk) >= 2 * self._load:
+			self._split(c)
+
+	def pop(self, i=-1):
+		if not self._len:
+			raise IndexError("pop from empty list")
+		item = self[i]
+		del self[i]
+		return item
+
+	def index(self, item, start=0, stop=None):
+		n = self._len
+		start = max(start + n, 0) if start < 0 else start
+		stop = n if stop is None else (max(stop + n, 0) if stop < 0 else stop)
+		i = 0
+		for chunk in self._chunks:
+			end = i + len(chunk)
+			if end > start and i < stop:
+				try:
+					return i + chunk.index(item, max(start - i, 0), min(stop - i, len(chunk)))
+				except ValueError:
+					pass
+			i = end
+		raise ValueError("%r is not in list" % (item,))
+
+	def remove(self, item):
+		del self[self.index(item)]
+
+	def remove_if(self, test):
+		"""removes every item for which test(item) is true, and returns how many
+there were. One pass over the list, however many there are"""
+		before = self._len
+		self._build(item for chunk in self._chunks for item in chunk if not test(item))
+		return before - self._len
+
+	def count(self, item):
+		return sum(chunk.count(item) for chunk in self._chunks)
+
+	def __contains__(self, item):
+		return any(item in chunk for chunk in self._chunks)
+
+	def sort(self, *args, **kwargs):
+		items = list(self)
+		items.sort(*args, **kwargs)
+		self._build(items)
+
+	def reverse(self):
+		self._build(reversed(list(self)))
+
+	def __eq__(self, other):
+		if not isinstance(other, (list, ChunkedList)) or len(other) != self._len:
+			return False
+		return all(a == b for a, b in zip(self, other))
+
+	def __ne__(self, other):
+		return not self == other
+
+	__hash__ = None
+
+	def __repr__(self):
+		return "ChunkedList(%r)" % list(self)
+
+	# pickles and copies as a list, so the chunks needn't be the same the other side
+	def __reduce__(self):
+		return (ChunkedList, (list(self), self._load))
+
+	def __deepcopy__(self, memo):
+		result = ChunkedList((), self._load)
+		memo[id(self)] = result
+		result._build(copy.deepcopy(item, memo) for item in self)
+		return result
@@ -0,0 +1,244 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import zlib, bz2
+from entity import Entity, dumps
+from incremental import iterparse
+
+# xz needs lzma, which only comes with python 2 as a backport
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma = None
+
+# how to spot each kind of compressed data
+magic_numbers = [
+	("gzip", "\x1f\x8b"),
+	("bz2", "BZh"),
+	("xz", "\xfd7zXZ\x00")
+]
+
+magic_length = max(len(magic) for kind, magic in magic_numbers)
+
+# the least compressed data bz2 and xz are given at a time (see chunks)
+min_feed = 16
+
+extensions = {".gz": "gzip", ".gzip": "gzip", ".bz2": "bz2", ".xz": "xz"}
+
+def sniff(data):
+	"""returns the kind of compression data starts with, or None"""
+	for kind, magic in magic_numbers:
+		if data.startswith(magic):
+			return kind
+	return None
+
+def from_extension(path):
+	for ext, kind in extensions.items():
+		if path.endswith(ext):
+			return kind
+	return None
+
+def need_lzma():
+	if lzma is None:
+		raise ValueError("xz compression needs the lzma module (pip install backports.lzma)")
+
+def decompressor(kind):
+	if kind == "gzip":
+		# 16 tells zlib to expect a gzip header
+		return zlib.decompressobj(16 + zlib.MAX_WBITS)
+	elif kind == "bz2":
+		return bz2.BZ2Decompressor()
+	elif kind == "xz":
+		need_lzma()
+		return lzma.LZMADecompressor()
+	raise ValueError("unknown compression '%s'" % kind)
+
+def compressor(kind, level=9):
+	if kind == "gzip":
+		return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	elif kind == "bz2":
+		return bz2.BZ2Compressor(level)
+	elif kind == "xz":
+		need_lzma()
+		return lzma.LZMACompressor()
+	raise ValueError("unknown compression '%s'" % kind)
+
+###################
+##### READING #####
+###################
+
+def chunks(source, chunk_size=65536):
+	"""
+yields the contents of source a chunk at a time, decompressing as it goes if it
+turns out to be gzip, bz2 or xz data. source is a path or a file-like object
+opened in binary mode. Files made of several compressed streams one after the
+other (as from cat a.gz b.gz) are read right through, and anything after the
+last one that isn't another stream is ignored.
+gzip chunks are never longer than chunk_size, however well the data compresses.
+bz2 and xz can't be stopped part way through an input like that, so they're fed
+smaller pieces the more the data expands, and a chunk is at most what a few
+bytes decompress to. That's around 100KB for xz, and a single bz2 block, which
+is usually 900KB but can be up to about 45MB for very repetitive data."""
+	if isinstance(source, basestring):
+		with open(source, "rb") as f:
+			for chunk in chunks(f, chunk_size):
+				yield chunk
+		return
+
+	data = source.read(chunk_size)
+	kind = sniff(data)
+	if kind is None:
+		while data:
+			yield data
+			data = source.read(chunk_size)
+		return
+
+	d = decompressor(kind)
+	feed = min_feed
+	while True:
+		leftover = None
+		if hasattr(d, "unconsumed_tail"):
+			# zlib stops at chunk_size and keeps the rest of its input
+			chunk = d.decompress(data, chunk_size)
+			# at the end of a stream the rest goes in unused_data as well
+			data = d.unconsumed_tail if not d.unused_data else ""
+			more = len(chunk) == chunk_size
+		else:
+			piece, data = data[:feed], data[feed:]
+			try:
+				chunk = d.decompress(piece)
+			except EOFError:
+				# the stream ended right at the end of the last piece, so
+				# this one starts another
+				chunk, leftover = "", piece
+			# feed less next time if that came out big, more if it didn't
+			if len(chunk) > chunk_size:
+				feed = max(min_feed, feed // 2)
+			else:
+				feed = min(chunk_size, feed * 2)
+			more = False
+		if chunk:
+			yield chunk
+
+		if leftover is None and d.unused_data:
+			leftover = d.unused_data
+		if leftover is not None:
+			# the stream's finished. see if another one follows it
+			data = leftover + data
+			while len(data) < magic_length:
+				extra = source.read(chunk_size)
+				if not extra:
+					break
+				data += extra
+			if sniff(data) != kind:
+				return
+			d = decompressor(kind)
+		elif not data and not more:
+			data = source.read(chunk_size)
+			if not data:
+				return
+
+def iterload(source, tagclass=Entity, chunk_size=65536):
+	"""
+parses a possibly compressed file or stream bit by bit, yielding the same
+events as incremental.iterparse. Neither the compressed nor the decompressed
+text is ever held in memory all at once."""
+	return iterparse(chunks(source, chunk_size), tagclass, chunk_size)
+
+def load(source, tagclass=Entity, chunk_size=65536):
+	"""
+parses a possibly compressed file or stream and returns the list of top-level
+elements, like parse.parse.
+Syntax:
+	load(source [, tagclass=Entity, chunk_size=65536])
+source is a path or a binary file-like object. Compression is spotted from the
+data itself, so the file name doesn't matter."""
+	for event, elems in iterload(source, tagclass, chunk_size):
+		if event == "document":
+			return elems
+
+###################
+##### WRITING #####
+###################
+
+class CompressedWriter(object):
+	"""
+a file-like object which compresses whatever is written to it on its way to
+stream. Small writes are saved up so the compressor sees decent sized chunks.
+close() finishes the compressed data, but leaves stream open.
+Syntax:
+	CompressedWriter(stream, kind [, level=9, buffer_size=65536])"""
+	def __init__(self, stream, kind, level=9, buffer_size=65536):
+		self.stream = stream
+		self.compressor = compressor(kind, level)
+		self.buffer_size = buffer_size
+		self._parts = []
+		self._size = 0
+
+	def write(self, data):
+		if isinstance(data, unicode):
+			data = data.encode("utf-8")
+		self._parts.append(data)
+		self._size += len(data)
+		if self._size >= self.buffer_size:
+			self.flush()
+
+	def flush(self):
+		if self._parts:
+			self.stream.write(self.compressor.compress("".join(self._parts)))
+			self._parts = []
+			self._size = 0
+
+	def close(self):
+		if self.compressor is not None:
+			self.flush()
+			self.stream.write(self.compressor.flush())
+			self.compressor = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+def dump(elem, target, compression=None, level=9, **options):
+	"""
+encodes elem like entity.dumps, writing it to target and compressing it on the
+way.
+Syntax:
+	dump(elem, target [, compression=None, level=9, <dumps options>])
+target is a path or a binary file-like object. compression is "gzip", "bz2",
+"xz" or None. For paths it defaults to whatever the extension says (.gz, .bz2
+or .xz). Streams aren't closed afterwards."""
+	if isinstance(target, basestring):
+		if compression is None:
+			compression = from_extension(target)
+		with open(target, "wb") as f:
+			dump(elem, f, compression, level, **options)
+		return
+
+	if compression is None:
+		dumps(elem, target, **options)
+	else:
+		with CompressedWriter(target, compression, level) as out:
+			dumps(elem, out, **options)
@@ -18,15 +18,62 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-import re, StringIO
+import re, sys, math, StringIO
+from collections import OrderedDict
 
 class RawString(str):
 	pass
 
+class NumberText(str):
+	"""
+the text of a number literal, from parse(text, lazy_numbers=True). The lazy
+lists and dicts it's left in turn it into a number the first time it's got at"""
+	__slots__ = ()
+
+	def decode(self):
+		if "." in self or "e" in self or "E" in self:
+			return float(self)
+		return int(self)
+
+class DecimalText(NumberText):
+	"""NumberText which decodes floats as decimal.Decimals"""
+	__slots__ = ()
+
+	def decode(self):
+		if "." in self or "e" in self or "E" in self:
+			return decimal_type()(self)
+		return int(self)
+
+# decimal takes a while to import, so it's left until someone needs it. Once
+# it's been imported, Decimals can be encoded
+def decimal_type():
+	from decimal import Decimal
+	if Decimal not in element_encoders:
+		element_encoders[Decimal] = EncodeDecimal()
+	return Decimal
+
 ######################################################
 ##### Entity is the base object of the jxi world #####
 ######################################################
 
+# the public names tag classes have themselves, e.g. methods added by
+# subclasses. dir() is slow, so each class only gets looked at once
+public_class_attrs = {}
+
+def class_attrs(cls):
+	attrs = public_class_attrs.get(cls)
+	if attrs is None:
+		attrs = public_class_attrs[cls] = [attr for attr in dir(cls) if not attr.startswith("_")]
+	return attrs
+
+# resolves whatever lazy symbolic links (see parse's lazy_links) are still
+# waiting in tag's attributes, for things which read __dict__ directly
+def resolve_lazy_links(tag):
+	lazy = tag.__dict__.get("_lazy_links")
+	if lazy:
+		for name in list(lazy):
+			getattr(tag, name)
+
 class Entity(object):
 	"""Represents a tag in the tree"""
 	def __init__(self, name="", attrs={}, children=[]):
@@ -35,8 +82,7 @@ class Entity(object):
 		self._parent = None
 
 		# assign attributes
-		for key, val in attrs.items():
-			object.__setattr__(self, key, val)
+		self.__dict__.update(attrs)
 
 	def _append(self, elem):
 		self._children.append(elem)
@@ -66,7 +112,20 @@ class Entity(object):
 		self._children.reverse()
 
 	def _attrs(self):
-		return [attr for attr in dir(self) if not attr.startswith("_")]
+		attrs = set(attr for attr in self.__dict__ if not attr.startswith("_"))
+		attrs.update(class_attrs(type(self)))
+		lazy = self.__dict__.get("_lazy_links")
+		if lazy:
+			attrs.update(lazy)
+		return sorted(attrs)
+
+	# attributes which are lazy symbolic links (see parse's lazy_links) wait
+	# in _lazy_links until they're first asked for
+	def __getattr__(self, name):
+		lazy = self.__dict__.get("_lazy_links")
+		if lazy and name in lazy:
+			return lazy[name].resolve()
+		raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
 
 	def __getitem__(self, key):
 		if isinstance(key, basestring):
@@ -74,7 +133,7 @@ class Entity(object):
 			if key.startswith("."):
 				# find all matches
 				key = key[1:]
-				if not re.match(r'^[a-zA-Z]\w+$', key):
+				if not re.match(r'^[a-zA-Z]\w*$', key):
 					raise KeyError("'%s' is not a valid tag name" % key)
 				elems = []
 				for elem in self:
@@ -83,7 +142,7 @@ class Entity(object):
 				return elems
 			else:
 				# find first match
-				if not re.match(r'^[a-zA-Z]\w+$', key):
+				if not re.match(r'^[a-zA-Z]\w*$', key):
 					raise KeyError("'%s' is not a valid tag name" % key)
 				for elem in self:
 					if type(elem) == type(self) and elem._tag_name == key:
@@ -96,23 +155,23 @@ class Entity(object):
 		if isinstance(key, basestring):
 			# search by tag name
 			if key.startswith("."):
-				# find all matches
+				# remove all matches, in one pass
 				key = key[1:]
-				if not re.match(r'^[a-zA-Z]\w+$', key):
+				if not re.match(r'^[a-zA-Z]\w*$', key):
 					raise KeyError("'%s' is not a valid tag name" % key)
-				elems_to_remove = []
-				for elem in self:
-					if type(elem) == type(self) and elem._tag_name == key:
-						elems_to_remove.append(elem)
-				for elem in elems_to_remove:
-					self._children.remove(elem)
+				matches = lambda elem: type(elem) == type(self) and elem._tag_name == key
+				remove_if = getattr(self._children, "remove_if", None)
+				if remove_if is not None:
+					remove_if(matches)
+				else:
+					self._children[:] = [elem for elem in self if not matches(elem)]
 			else:
 				# find first match
-				if not re.match(r'^[a-zA-Z]\w+$', key):
+				if not re.match(r'^[a-zA-Z]\w*$', key):
 					raise KeyError("'%s' is not a valid tag name" % key)
-				for elem in self:
+				for i, elem in enumerate(self):
 					if type(elem) == type(self) and elem._tag_name == key:
-						self._children.remove(elem)
+						del self._children[i]
 						return
 				raise KeyError("No tag with name '%s'" % key)
 		else:
@@ -148,49 +207,382 @@ class Entity(object):
 	def __str__(self):
 		return dumps(self)
 
+	# pickles the quick way whatever the protocol, and without dragging any
+	# unresolved lazy links along. This is still pickle's own recursive walk,
+	# so trees nested deeper than the recursion limit need packing.dumps. The
+	# table that makes can only keep things shared within the one object it's
+	# given, while pickle's memo keeps them shared across everything in the
+	# pickle, e.g. a tag and a list of links to its children pickled together
+	def __reduce_ex__(self, protocol):
+		resolve_lazy_links(self)
+		return object.__reduce_ex__(self, 2)
+
+	# see packing.copy_tree
+	def __deepcopy__(self, memo):
+		import packing
+		return packing.copy_tree(self, memo)
+
+
+####################################################
+##### Frozen entities can be shared and hashed #####
+####################################################
+
+class FrozenEntity(Entity):
+	"""
+An immutable, hashable tag. Get these from freeze() or parse(text, frozen=True).
+Children are kept in a tuple and attributes can't be changed in place. Instead
+the _set_attr, _del_attr, _set_child, _with_children and _set_in methods return
+modified copies which share every untouched subtree with the original.
+Equality and hashing are structural."""
+	def __init__(self, name="", attrs={}, children=()):
+		d = self.__dict__
+		d["_children"] = tuple(children)
+		d["_tag_name"] = name
+		d["_parent"] = None
+		d["_hash"] = None
+		d.update(attrs)
+
+	def _immutable(self, *args):
+		raise TypeError("FrozenEntity objects are immutable")
+
+	__setattr__ = __delattr__ = __setitem__ = __delitem__ = _immutable
+	_append = _extend = _insert = _remove = _pop = _sort = _reverse = _immutable
+
+	def _attr_dict(self):
+		return dict((k, v) for k, v in self.__dict__.items() if not k.startswith("_"))
+
+	def _set_attr(self, attr, value):
+		attrs = self._attr_dict()
+		attrs[attr] = freeze(value)
+		return FrozenEntity(self._tag_name, attrs, self._children)
+
+	def _del_attr(self, attr):
+		attrs = self._attr_dict()
+		del attrs[attr]
+		return FrozenEntity(self._tag_name, attrs, self._children)
+
+	def _set_child(self, i, elem):
+		children = list(self._children)
+		children[i] = freeze(elem)
+		return FrozenEntity(self._tag_name, self._attr_dict(), children)
+
+	def _with_children(self, children):
+		return FrozenEntity(self._tag_name, self._attr_dict(), [freeze(c) for c in children])
+
+	def _set_in(self, path, value):
+		"""
+returns a copy with the element at the end of path replaced by value. Path
+items are child indices (ints) or attribute names (strings) for tags, and
+indices or keys for tuples and dicts. Only the nodes along the path are copied."""
+		return set_in(self, path, value)
+
+	def __hash__(self):
+		if self._hash is None:
+			attrs = frozenset(self._attr_dict().items())
+			self.__dict__["_hash"] = hash((self._tag_name, attrs, self._children))
+		return self._hash
+
+	def __eq__(self, other):
+		if self is other:
+			return True
+		if type(other) != type(self) or hash(self) != hash(other):
+			return False
+		return self._tag_name == other._tag_name and \
+			self._children == other._children and \
+			self._attr_dict() == other._attr_dict()
+
+	def __ne__(self, other):
+		return not self == other
+
+	# no point copying something that can't change
+	def __copy__(self):
+		return self
+
+	def __deepcopy__(self, memo):
+		return self
+
+	# hashes aren't guaranteed to survive a trip to another process
+	def __getstate__(self):
+		state = dict(self.__dict__)
+		state["_hash"] = None
+		return state
+
+class FrozenDict(dict):
+	"""an immutable, hashable dict, used for dict literals in frozen trees"""
+	def _immutable(self, *args, **kwargs):
+		raise TypeError("FrozenDict objects are immutable")
+
+	__setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+	def __hash__(self):
+		if not hasattr(self, "_hash"):
+			self._hash = hash(frozenset(self.items()))
+		return self._hash
+
+	def __copy__(self):
+		return self
+
+	def __deepcopy__(self, memo):
+		return self
+
+	def __reduce__(self):
+		return (FrozenDict, (dict(self),))
+
+def freeze(elem, memo=None):
+	"""
+returns an immutable copy of elem, which can be anything parse produces.
+Entities become FrozenEntities, lists become tuples, dicts become FrozenDicts
+and sets become frozensets. Anything referenced more than once (i.e. the targets
+of links) stays shared in the copy. Raises ValueError on reference cycles, as
+there's no way to build those out of immutable objects."""
+	if memo is None:
+		memo = {}
+	key = id(elem)
+	if key in memo:
+		if memo[key] is None:
+			raise ValueError("can't freeze a structure containing a reference cycle")
+		return memo[key]
+
+	t = type(elem)
+	if t in (FrozenEntity, FrozenDict):
+		return elem
+	elif isinstance(elem, Entity):
+		memo[key] = None
+		resolve_lazy_links(elem)
+		attrs = {}
+		for k, v in elem.__dict__.items():
+			if not k.startswith("_"):
+				attrs[k] = freeze(v, memo)
+		result = FrozenEntity(elem._tag_name, attrs, [freeze(c, memo) for c in elem._children])
+	elif isinstance(elem, (list, tuple)):
+		memo[key] = None
+		result = tuple([freeze(e, memo) for e in elem])
+		# tuples which were already frozen all the way down can be reused
+		if t == tuple and all(a is b for a, b in zip(result, elem)):
+			result = elem
+	elif isinstance(elem, dict):
+		memo[key] = None
+		result = FrozenDict((k, freeze(v, memo)) for k, v in elem.items())
+	elif isinstance(elem, (set, frozenset)):
+		memo[key] = None
+		result = frozenset(freeze(e, memo) for e in elem)
+	else:
+		# strings, numbers and the like are immutable already
+		return elem
+
+	memo[key] = result
+	return result
+
+def thaw(elem, memo=None):
+	"""the opposite of freeze. Returns a mutable copy of a frozen structure"""
+	if memo is None:
+		memo = {}
+	# python only has one empty tuple, so the empty lists it came from can't
+	# have been one and the same
+	if type(elem) == tuple and not elem:
+		return []
+	key = id(elem)
+	if key in memo:
+		return memo[key]
+
+	t = type(elem)
+	if t == FrozenEntity:
+		result = Entity(elem._tag_name, {}, [])
+		memo[key] = result
+		for k, v in elem._attr_dict().items():
+			object.__setattr__(result, k, thaw(v, memo))
+		result._children.extend(thaw(c, memo) for c in elem._children)
+	elif t == tuple:
+		result = memo[key] = []
+		result.extend(thaw(e, memo) for e in elem)
+	elif t == FrozenDict:
+		result = memo[key] = {}
+		for k, v in elem.items():
+			result[k] = thaw(v, memo)
+	elif t == frozenset:
+		result = memo[key] = set(thaw(e, memo) for e in elem)
+	else:
+		return elem
+	return result
+
+def set_in(elem, path, value):
+	"""see FrozenEntity._set_in"""
+	if len(path) == 0:
+		return freeze(value)
+	step, rest = path[0], path[1:]
+
+	# the last step is allowed to name a new attribute or key
+	if type(elem) == FrozenEntity:
+		if isinstance(step, basestring):
+			child = getattr(elem, step) if rest else None
+			return elem._set_attr(step, set_in(child, rest, value))
+		else:
+			return elem._set_child(step, set_in(elem._children[step], rest, value))
+	elif type(elem) == tuple:
+		items = list(elem)
+		items[step] = set_in(items[step], rest, value)
+		return tuple(items)
+	elif type(elem) == FrozenDict:
+		items = dict(elem)
+		items[step] = set_in(items[step] if rest else None, rest, value)
+		return FrozenDict(items)
+	else:
+		raise TypeError("can't follow path into %s" % type(elem).__name__)
+
 
 ######################
 ### ENCODING STUFF ###
 ######################
 
+# things like tag names and bare dict keys
+ident_regex = re.compile(r"^[a-zA-Z][a-zA-Z0-9_]*$")
+# idents which the lexer reads as something else
+reserved_words = set(["null", "true", "false"])
+
+string_escapes = {
+	'\\': '\\\\',
+	'"': '\\"',
+	'\b': '\\b',
+	'\f': '\\f',
+	'\n': '\\n',
+	'\r': '\\r',
+	'\t': '\\t'
+}
+string_escape_regex = re.compile(r'[\\"\x00-\x1f]')
+
+def escape_char(match):
+	c = match.group(0)
+	return string_escapes.get(c) or "\\u%04x" % ord(c)
+
+def quote(string):
+	"""returns string as a jxi string literal"""
+	if isinstance(string, unicode):
+		string = string.encode("utf-8")
+	return '"%s"' % string_escape_regex.sub(escape_char, string)
+
+def is_ident(string):
+	return isinstance(string, basestring) and ident_regex.match(string) is not None \
+		and string not in reserved_words
+
+def format_step(operator, operand):
+	"""
+returns one step of a symbolic link's path, where operator is ">", "." or "["
+as in SymbolicLink.args"""
+	if operator != "[":
+		return operator + operand
+	if type(operand) in (int, long) or is_ident(operand):
+		return "[%s]" % operand
+	return "[%s]" % quote(operand)
+
+def format_path(args):
+	"""
+turns a list of (operator, operand) steps, as in SymbolicLink.args, back into
+link syntax, minus the @ and ;"""
+	return "".join(format_step(operator, operand) for operator, operand in args)
+
+def make_link(steps):
+	return "@%s;" % format_path(steps)
+
+class EncodingCache(object):
+	"""
+remembers the text of frozen tags written by dumps(elem, canonical=True,
+cache=...), so unchanged parts of a document can be written again by just
+copying it. It keeps the max_entries most recently used tags.
+Syntax:
+	EncodingCache([max_entries=10000])"""
+	def __init__(self, max_entries=10000):
+		self.max_entries = max_entries
+		self.hits = 0
+		self.misses = 0
+		# maps cache_key -> (tag, text), oldest first. keeping hold of the tag
+		# stops its id being reused while it's in here
+		self._entries = OrderedDict()
+
+	def get(self, tag):
+		key = cache_key(tag)
+		entry = self._entries.pop(key, None)
+		if entry is None:
+			self.misses += 1
+			return None
+		self._entries[key] = entry
+		self.hits += 1
+		return entry[1]
+
+	def put(self, tag, text):
+		self._entries[cache_key(tag)] = (tag, text)
+		while len(self._entries) > self.max_entries:
+			self._entries.popitem(last=False)
+
+	def __len__(self):
+		return len(self._entries)
+
+	def clear(self):
+		self._entries.clear()
+
+# canonical mode fixes everything about how a tag is written except for the
+# options about keys, so the same tag is cached separately for each of them
+def cache_key(tag):
+	return (id(tag), keys_quoted, keys_skipped)
+
 class ObjectVisitor(object):
+	"""
+writes out containers. One which has been written already gets a link to where
+it was first written instead, which keeps shared objects shared and stops
+cycles going round forever."""
 	def visit(self, obj, depth):
-		# copy current object stack
-		if obj in seen_objects:
-			out.write(make_link(seen_objects[obj]))
+		if canonical_mode and type(obj) in frozen_types:
+			if type(obj) == FrozenEntity and encoding_cache is not None:
+				self.encode_cached(obj, depth)
+			else:
+				self.encode(obj, depth)
+			return
+		key = id(obj)
+		if key in seen_objects:
+			out.write(make_link(seen_objects[key][1]))
 		else:
-			seen_objects[obj] = [o for o in object_stack]
-			object_stack.append(obj)
+			# obj is kept so that its id can't be reused
+			seen_objects[key] = (obj, list(path))
 			self.encode(obj, depth) # implemented in subclasses
-			assert object_stack.pop() == obj
 
+	# encodes item, which lives at step from obj
+	def encode_item(self, step, item, depth):
+		path.append(step)
+		encode_element(item, depth)
+		path.pop()
+
+	def encode_cached(self, obj, depth):
+		global out
+		text = encoding_cache.get(obj)
+		if text is None:
+			outer, out = out, StringIO.StringIO()
+			try:
+				self.encode(obj, depth)
+				text = out.getvalue()
+			finally:
+				out = outer
+			encoding_cache.put(obj, text)
+		out.write(text)
+
+class ValueVisitor(object):
+	"""writes out things which can't hold anything, wherever they appear"""
+	def visit(self, obj, depth):
+		self.encode(obj, depth)
 
-element_encoders = {
-	list: None,
-	dict: None,
-	str: None,
-	unicode: None,
-	Entity: None,
-	int: None,
-	float: None,
-	RawString: None
-}
+# frozen things can't contain links or mutable containers. So in canonical
+# mode, where only their contents matter, they're written out in full wherever
+# they appear. Their text doesn't depend on where they are then, which means
+# it can be cached
+frozen_types = set([FrozenEntity, FrozenDict, tuple])
 
 dict_separator = ":"
 separator = " "
 seen_objects = dict()
-object_stack = []
+path = []
 out = None
-string_keys=False
-string_escapes= {
-	'\\': '\\\\',
-    '"': '\\"',
-    '\b': '\\b',
-    '\f': '\\f',
-    '\n': '\\n',
-    '\r': '\\r',
-    '\t': '\\t'
-}
+keys_quoted = False
+keys_skipped = False
+canonical_mode = False
+encoding_cache = None
 
 def dumps(elem, buffer=None, 
 		use_commas=False,
@@ -198,94 +590,252 @@ def dumps(elem, buffer=None,
 		width=80,
 		skip_keys=False,
 		string_keys=False,
-		separators=None
+		separators=None,
+		canonical=False,
+		cache=None,
+		processes=None
 		):
-	global seen_objects, out, separator, dict_separator
+	"""
+encodes elem as jxi text, returning it, or writing it to buffer if given.
+Syntax:
+	dumps(elem [, buffer=None, use_commas=False, skip_keys=False, string_keys=False,
+	      separators=None, canonical=False, cache=None, processes=None])
+A list or tuple is taken to be a whole document, and its elements are written
+one per line. Anything referenced more than once is written the first time and
+linked to after that.
+use_commas separates things with commas, or separators gives the (item, dict)
+separators to use, (" ", ":") by default. string_keys quotes every dict key,
+and skip_keys leaves out dict keys which aren't strings or ints instead of
+raising TypeError.
+canonical=True gives the same text for the same contents every time: dict keys
+and attributes are sorted, floats are written exactly, separators are fixed,
+and frozen values are written in full rather than linked to. Decimals lose
+trailing zeros, so equal ones are written alike. cache can be an
+EncodingCache, to save writing out frozen tags it has seen before.
+processes encodes big documents that many processes at once (see parallel), and
+gives exactly the same text. None or 1 does it all in this one."""
+	global seen_objects, path, out, encoding_cache
+	if processes is not None and processes != 1:
+		import parallel
+		return parallel.dumps(elem, buffer, processes, use_commas=use_commas, skip_keys=skip_keys,
+		                      string_keys=string_keys, separators=separators, canonical=canonical,
+		                      cache=cache)
+	set_options(use_commas, skip_keys, string_keys, separators, canonical, cache)
 
 	seen_objects = dict()
+	path = []
 	out = buffer or StringIO.StringIO()
 
-	separator, dict_separator = separators or (" ",":")
-
-	element_encoders[str] = EncodeJsonString()
-	element_encoders[list] = EncodeListFlat()
-	element_encoders[float] = element_encoders[int] = element_encoders[long] = EncodeNumber()
-	element_encoders[dict] = EncodeDictFlat()
-	element_encoders[RawString] = EncodeRawString() 
-	if type(elem) == list:
-		for e in elem:
-			encode_element(e, 0)
-			out.write("\n")
-	else:
-		encode_element(elem, 0)
+	try:
+		if isinstance(elem, (list, tuple)):
+			for i, e in enumerate(elem):
+				path.append(("[", i))
+				encode_element(e, 0)
+				path.pop()
+				out.write("\n")
+		else:
+			path.append(("[", 0))
+			encode_element(elem, 0)
+	finally:
+		# don't hang on to everything that was written
+		seen_objects = dict()
+		encoding_cache = None
 	if not buffer:
 		c = out.getvalue()
 		out.close()
 		return c
 
+# sets the globals the encoders work from
+def set_options(use_commas=False, skip_keys=False, string_keys=False, separators=None, canonical=False,
+                cache=None):
+	global separator, dict_separator, keys_quoted, keys_skipped, canonical_mode, encoding_cache
+	keys_quoted = string_keys
+	keys_skipped = skip_keys
+	canonical_mode = canonical
+	encoding_cache = cache if canonical else None
+
+	if canonical:
+		separator, dict_separator = " ", ":"
+	elif separators:
+		separator, dict_separator = separators
+	else:
+		separator, dict_separator = (", " if use_commas else " "), ":"
+
 def encode_element(elem, depth):
-	if type(elem) in element_encoders:
-		element_encoders[type(elem)].visit(elem, depth)
+	encoder = element_encoders.get(type(elem))
+	if encoder is None and "decimal" in sys.modules:
+		decimal_type()
+		encoder = element_encoders.get(type(elem))
+	if encoder is None:
+		# subclasses
+		for t, encoder in subclass_encoders:
+			if isinstance(elem, t):
+				break
+		else:
+			raise TypeError("can't encode objects of type %s" % type(elem).__name__)
+	encoder.visit(elem, depth)
+
+# the parser's lazy lists and dicts (see parse.LazyList) follow their links for
+# _written, but leave numbers nobody's read as text, so they go out as they came in
+def list_items(ls):
+	written = getattr(ls, "_written", None)
+	return written() if written is not None else ls
+
+def dict_items(d):
+	written = getattr(d, "_written", None)
+	return written() if written is not None else d.items()
+
+class EncodeTag(ObjectVisitor):
+	def encode(self, tag, depth):
+		self.encode_open(tag, depth)
+		children = tag._children
+		if len(children) == 0:
+			out.write("/>")
+			return
+		out.write(">")
+		for i, child in enumerate(list_items(children)):
+			if i > 0:
+				out.write(separator)
+			self.encode_item(("[", i), child, depth+1)
+		out.write("</")
+		out.write(tag._tag_name)
+		out.write(">")
+
+	# writes the start of the tag: its name and attributes
+	def encode_open(self, tag, depth):
+		name = tag._tag_name
+		out.write("<")
+		out.write(name)
+		resolve_lazy_links(tag)
+		attrs = sorted((k, v) for k, v in tag.__dict__.items() if not k.startswith("_"))
+		# the tag name's own value goes first, as <name=value>
+		for attr, value in attrs:
+			if attr == name:
+				out.write("=")
+				self.encode_item((".", attr), value, depth+1)
+		for attr, value in attrs:
+			if attr != name:
+				# there's no writing the name any other way
+				if not is_ident(attr):
+					raise ValueError("can't encode attribute '%s' of <%s>, it isn't an identifier" % (attr, name))
+				out.write(" ")
+				out.write(attr)
+				out.write("=")
+				self.encode_item((".", attr), value, depth+1)
 
 class EncodeListFlat(ObjectVisitor):
 	def encode(self, ls, depth):
 		out.write("[")
-		for item in ls[:-1]:
-			encode_element(item, depth+1)
-			out.write(separator)
-		for item in ls[-1:]:
-			encode_element(item, depth+1)
+		for i, item in enumerate(list_items(ls)):
+			if i > 0:
+				out.write(separator)
+			self.encode_item(("[", i), item, depth+1)
 		out.write("]")
 
-class EncodeSetFlat(object):
-	def encode(self, s, depth):
-		out.write("(")
-		items = [e for e in s]
-		for item in items[:-1]:
-			encode_element(item, depth+1)
-			out.write(separator)
-		for item in items[-1:]:
-			encode_element(item, depth+1)
-		out.write(")")
-
 class EncodeDictFlat(ObjectVisitor):
-	def encode(self, d, depth, string_keys=string_keys):
+	def encode(self, d, depth):
 		out.write("{")
-		items = d.items()
-		def write(k,v):
-			if isinstance(k, basestring):
-				if not string_keys and re.match(r"[a-zA-Z]\w+", k):
-					out.write(k)
-				else:
-					encode_element(k, depth)
+		items = dict_items(d)
+		if canonical_mode:
+			items.sort(key=lambda item: item[0])
+		first = True
+		for k, v in items:
+			if type(k) in (int, long):
+				key = str(k)
+			elif isinstance(k, basestring):
+				key = k if is_ident(k) and not keys_quoted else quote(k)
+			elif keys_skipped:
+				continue
+			else:
+				raise TypeError("dict keys must be strings or ints, not %s" % type(k).__name__)
+			if not first:
+				out.write(separator)
+			first = False
+			out.write(key)
 			out.write(dict_separator)
-			encode_element(v, depth+1)
-		for k, v in items[:-1]:
-			write(k,v)
-			out.write(separator)
-		for k, v in items[-1:]:
-			write(k,v)
+			self.encode_item(("[", k), v, depth+1)
 		out.write("}")
 
-class EncodeRawString(ObjectVisitor):
+class EncodeRawString(ValueVisitor):
 	def encode(self, string, depth):
 		out.write("`")
 		out.write(string.replace("`", "\\`"))
 		out.write("`")
 
-class EncodeJsonString(object):
-	def encode(self, string, depth, string_escapes=string_escapes):
-		out.write('"')
-		for c in string:
-			out.write(string_escapes.get(c, c))
-		out.write('"')
+class EncodeJsonString(ValueVisitor):
+	def encode(self, string, depth):
+		out.write(quote(string))
 
-class EncodeNumber(object):
+class EncodeNumber(ValueVisitor):
 	def encode(self, num, depth):
-		if num in (float("inf"), float("-inf"), float("nan")):
+		if type(num) == float:
+			if math.isinf(num) or math.isnan(num):
+				raise ValueError("cannot encode '%s'" % num)
+			# repr gives back exactly the same float. -0.0 and 0.0 are equal,
+			# so canonically they're written the same
+			out.write(repr(num) if num or not canonical_mode else "0.0")
+		else:
+			out.write("%d" % num)
+
+class EncodeDecimal(ValueVisitor):
+	def encode(self, num, depth):
+		if not num.is_finite():
 			raise ValueError("cannot encode '%s'" % num)
+		if canonical_mode:
+			num = canonical_decimal(num)
+		# str keeps every digit, so the number reads back exactly as it was
+		out.write(str(num))
+
+# equal decimals are written the same way canonically, e.g. 1.10 and 1.1, so
+# trailing zeros after the point go, and whole numbers lose their exponents
+def canonical_decimal(num):
+	sign, digits, exponent = num.as_tuple()
+	if not any(digits):
+		return type(num)(0)
+	if exponent > 0:
+		digits, exponent = digits + (0,) * exponent, 0
+	while exponent < 0 and digits[-1] == 0:
+		digits, exponent = digits[:-1], exponent + 1
+	return type(num)((sign, digits, exponent))
+
+# numbers nobody has looked at yet are written just as they were read, unless
+# they need to be written canonically
+class EncodeNumberText(ValueVisitor):
+	def encode(self, text, depth):
+		if canonical_mode:
+			encode_element(text.decode(), depth)
 		else:
-			out.write(str(num))
+			out.write(text)
+
+class EncodeConstant(ValueVisitor):
+	def encode(self, value, depth):
+		out.write("null" if value is None else "true" if value else "false")
 
-print dumps({"thing":[1,2,3,4,5e26,6,"hekkis"]}, separators=(", ",": "))
+element_encoders = {
+	list: EncodeListFlat(),
+	tuple: EncodeListFlat(),
+	dict: EncodeDictFlat(),
+	FrozenDict: EncodeDictFlat(),
+	str: EncodeJsonString(),
+	unicode: EncodeJsonString(),
+	RawString: EncodeRawString(),
+	NumberText: EncodeNumberText(),
+	DecimalText: EncodeNumberText(),
+	int: EncodeNumber(),
+	long: EncodeNumber(),
+	float: EncodeNumber(),
+	bool: EncodeConstant(),
+	type(None): EncodeConstant(),
+	Entity: EncodeTag(),
+	FrozenEntity: EncodeTag()
+}
 
+# for anything whose exact type isn't above, e.g. the parser's lazy lists and
+# user tag classes
+subclass_encoders = [
+	(Entity, element_encoders[Entity]),
+	(list, element_encoders[list]),
+	(dict, element_encoders[dict]),
+	(RawString, element_encoders[RawString]),
+	(basestring, element_encoders[str])
+]
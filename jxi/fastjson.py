@@ -0,0 +1,106 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# Plain JSON is valid jxi, and the json module's C decoder reads it far faster
+# than lex and the parser can. This gets parse the same result out of it.
+
+import re, json
+
+# jxi turns each half of a surrogate pair into utf-8 on its own, where json
+# puts them together first, so texts with any are left to the jxi parser
+surrogate_pair = re.compile(r"\\u[dD][89abAB][0-9a-fA-F]{2}\\u[dD][c-fC-F]")
+
+json_start = re.compile(r"[ \t\n\r]*[{\[]")
+
+# NaN and Infinity are json, but not jxi
+def reject_constant(name):
+	raise ValueError("%s isn't jxi" % name)
+
+# json gives back unicode and real constants, where the parser gives utf-8
+# strings and the names of the constants (which are unicode if the text was)
+def converters(unicode_text):
+	true, false, null = (u"true", u"false", u"null") if unicode_text else ("true", "false", "null")
+	# the same keys tend to come up over and over
+	keys = {}
+
+	def convert(value):
+		t = type(value)
+		if t == unicode:
+			return value.encode("utf-8")
+		elif t == list:
+			return convert_list(value)
+		elif t == bool:
+			return true if value else false
+		elif value is None:
+			return null
+		return value
+
+	def convert_list(items):
+		for i, value in enumerate(items):
+			t = type(value)
+			# dicts have been converted already, by convert_pairs
+			if t != int and t != float and t != dict:
+				items[i] = convert(value)
+		return items
+
+	def convert_pairs(pairs):
+		result = {}
+		for key, value in pairs:
+			name = keys.get(key)
+			if name is None:
+				name = keys[key] = key.encode("utf-8")
+			t = type(value)
+			if t == unicode:
+				value = value.encode("utf-8")
+			elif t != int and t != float and t != dict:
+				value = convert(value)
+			result[name] = value
+		return result
+
+	return convert, convert_pairs
+
+def looks_like_json(text):
+	"""whether text starts like a json object or array does"""
+	return json_start.match(text) is not None
+
+def loads(text, decimals=False):
+	"""
+returns what parse.parse would for text if it's plain JSON, or None if it isn't.
+Syntax:
+	loads(text [, decimals=False])
+decimals is as for parse. The result is always a list of one element, JSON
+documents only having the one. Anything which isn't JSON is given up on as soon
+as the json module notices, but it's up to parse to go on from there."""
+	if "\\u" in text and surrogate_pair.search(text):
+		return None
+	convert, convert_pairs = converters(isinstance(text, unicode))
+	parse_float = float
+	if decimals:
+		from entity import decimal_type
+		parse_float = decimal_type()
+	decoder = json.JSONDecoder(object_pairs_hook=convert_pairs, parse_float=parse_float,
+	                           parse_constant=reject_constant)
+	try:
+		value = decoder.decode(text)
+	except ValueError:
+		# which covers bad utf-8
+		return None
+	return [convert(value)]
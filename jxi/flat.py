@@ -0,0 +1,440 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# A flat encoding of parsed trees, for sharing one big tree between processes
+# without each of them parsing or unpickling it.
+#
+# Everything lives in one string of node records. A record starts with a kind
+# byte, and refers to other records by their offset from the start:
+#
+#	NONE, TRUE, FALSE   <kind>
+#	INT                 <kind> <int64>
+#	FLOAT               <kind> <double>
+#	BIGINT, STR, RAW    <kind> <length> <bytes>      (BIGINT in decimal)
+#	LIST                <kind> <n> <item offset>*n
+#	DICT                <kind> <n> (<key offset> <value offset>)*n, by key
+#	TAG                 <kind> <name offset> <n attrs> <n children>
+#	                        (<name offset> <value offset>)*n attrs, by name
+#	                        <child offset>*n children
+#
+# lengths, counts and offsets are unsigned 64 bit, all little endian. The string
+# starts with a header giving the offset of the document's list of top-level
+# elements. Each object is written once, so anything referenced from more than
+# one place (i.e. the targets of links) is shared, cycles included.
+
+import re, mmap, struct
+from entity import Entity, RawString
+
+NONE, TRUE, FALSE, INT, BIGINT, FLOAT, STR, RAW, LIST, DICT, TAG = range(11)
+
+magic = "JXIF"
+version = 1
+
+header = struct.Struct("<4sBQ")
+kind_struct = struct.Struct("<B")
+int_struct = struct.Struct("<Bq")
+float_struct = struct.Struct("<Bd")
+sized_struct = struct.Struct("<BQ")
+tag_struct = struct.Struct("<BQQQ")
+offset_struct = struct.Struct("<Q")
+pair_struct = struct.Struct("<QQ")
+
+# where the root offset goes in the header
+root_slot = header.size - offset_struct.size
+
+tag_name_regex = re.compile(r'^[a-zA-Z]\w*$')
+
+###################
+##### WRITING #####
+###################
+
+def tag_attrs(elem):
+	# lazy links get resolved on the way out
+	for name in list(elem.__dict__.get("_lazy_links") or ()):
+		getattr(elem, name)
+	return sorted((k, v) for k, v in elem.__dict__.items() if not k.startswith("_"))
+
+# appends the record for obj to out and returns (child, slot) for each offset in
+# it which still needs filling in
+def write_record(out, obj):
+	start = len(out)
+	if obj is None:
+		out += kind_struct.pack(NONE)
+	elif obj is True or obj is False:
+		out += kind_struct.pack(TRUE if obj else FALSE)
+	elif isinstance(obj, (int, long)):
+		if -2**63 <= obj < 2**63:
+			out += int_struct.pack(INT, obj)
+		else:
+			digits = str(obj)
+			out += sized_struct.pack(BIGINT, len(digits))
+			out += digits
+	elif isinstance(obj, float):
+		out += float_struct.pack(FLOAT, obj)
+	elif isinstance(obj, basestring):
+		data = obj.encode("utf-8") if isinstance(obj, unicode) else obj
+		out += sized_struct.pack(RAW if isinstance(obj, RawString) else STR, len(data))
+		out += data
+	elif isinstance(obj, Entity):
+		attrs = tag_attrs(obj)
+		children = list(obj._children)
+		out += tag_struct.pack(TAG, 0, len(attrs), len(children))
+		out += "\0" * (pair_struct.size * len(attrs) + offset_struct.size * len(children))
+		slot = start + 1
+		pending = [(obj._tag_name, slot)]
+		slot = start + tag_struct.size
+		for name, value in attrs:
+			pending.append((name, slot))
+			pending.append((value, slot + offset_struct.size))
+			slot += pair_struct.size
+		for child in children:
+			pending.append((child, slot))
+			slot += offset_struct.size
+		return pending
+	elif isinstance(obj, dict):
+		items = sorted(obj.items(), key=lambda pair: pair[0])
+		out += sized_struct.pack(DICT, len(items))
+		out += "\0" * (pair_struct.size * len(items))
+		slot = start + sized_struct.size
+		pending = []
+		for key, value in items:
+			pending.append((key, slot))
+			pending.append((value, slot + offset_struct.size))
+			slot += pair_struct.size
+		return pending
+	elif isinstance(obj, (list, tuple)):
+		# iterating resolves any lazy links
+		items = list(obj)
+		out += sized_struct.pack(LIST, len(items))
+		out += "\0" * (offset_struct.size * len(items))
+		slot = start + sized_struct.size
+		return [(item, slot + i * offset_struct.size) for i, item in enumerate(items)]
+	else:
+		raise TypeError("can't flatten objects of type %s" % type(obj).__name__)
+	return ()
+
+def flatten(document):
+	"""
+returns the flat encoding of document, a list of top-level elements as returned
+by parse. Shared objects are written once and stay shared.
+Syntax:
+	flatten(document)"""
+	out = bytearray(header.pack(magic, version, 0))
+	# maps id -> offset. objects are kept in alive so their ids aren't reused
+	written = {}
+	alive = []
+	# done with a stack rather than recursion, so deep trees are fine
+	stack = [(document, root_slot)]
+	while stack:
+		obj, slot = stack.pop()
+		offset = written.get(id(obj))
+		if offset is None:
+			offset = written[id(obj)] = len(out)
+			alive.append(obj)
+			pending = write_record(out, obj)
+			stack.extend(reversed(pending))
+		offset_struct.pack_into(out, slot, offset)
+	return str(out)
+
+def share(document):
+	"""
+flattens document into an anonymous shared memory map and returns a
+FlatDocument reading it. Processes forked afterwards (e.g. multiprocessing
+workers) see the same memory rather than copies of the tree."""
+	data = flatten(document)
+	buf = mmap.mmap(-1, len(data))
+	buf.write(data)
+	return FlatDocument(buf)
+
+def dump(document, path):
+	"""writes the flat encoding of document to path, for use with load()"""
+	with open(path, "wb") as f:
+		f.write(flatten(document))
+
+def load(path):
+	"""memory maps a file written by dump() and returns a FlatDocument reading it"""
+	with open(path, "rb") as f:
+		buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	return FlatDocument(buf)
+
+###################
+##### READING #####
+###################
+
+class FlatDocument(object):
+	"""
+a read-only view of a flattened document. It behaves like the list of top-level
+elements that parse returns, and tags, lists and dicts inside it come back as
+FlatTag, FlatList and FlatDict views which are read from the buffer as they're
+navigated. Strings and numbers are copied out when asked for.
+Syntax:
+	FlatDocument(buffer)
+buffer is a string, an mmap, or anything else supporting the buffer interface,
+holding the output of flatten(). Links come out as the same view object as
+their target, so `is` works as it would on the parsed tree."""
+	def __init__(self, buf):
+		if not isinstance(buf, (str, mmap.mmap)):
+			buf = buffer(buf)
+		if len(buf) < header.size:
+			raise ValueError("not a flattened jxi document")
+		tag, v, root = header.unpack_from(buf, 0)
+		if tag != magic:
+			raise ValueError("not a flattened jxi document")
+		if v != version:
+			raise ValueError("unsupported flat encoding version %d" % v)
+		self.buf = buf
+		# views by offset, so shared records give the same view each time
+		self._views = {}
+		self.root = self.value(root)
+
+	def value(self, offset):
+		"""returns whatever is at offset: a view for containers, else the value"""
+		view = self._views.get(offset)
+		if view is not None:
+			return view
+		buf = self.buf
+		kind = kind_struct.unpack_from(buf, offset)[0]
+		if kind == STR or kind == RAW:
+			n = sized_struct.unpack_from(buf, offset)[1]
+			start = offset + sized_struct.size
+			data = buf[start:start+n]
+			return RawString(data) if kind == RAW else data
+		elif kind == INT:
+			return int_struct.unpack_from(buf, offset)[1]
+		elif kind == FLOAT:
+			return float_struct.unpack_from(buf, offset)[1]
+		elif kind == TAG:
+			view = FlatTag(self, offset)
+		elif kind == LIST:
+			view = FlatList(self, offset)
+		elif kind == DICT:
+			view = FlatDict(self, offset)
+		elif kind == NONE:
+			return None
+		elif kind == TRUE:
+			return True
+		elif kind == FALSE:
+			return False
+		elif kind == BIGINT:
+			n = sized_struct.unpack_from(buf, offset)[1]
+			start = offset + sized_struct.size
+			return int(buf[start:start+n])
+		else:
+			raise ValueError("bad record kind %d at offset %d" % (kind, offset))
+		self._views[offset] = view
+		return view
+
+	def __len__(self):
+		return len(self.root)
+
+	def __getitem__(self, i):
+		return self.root[i]
+
+	def __iter__(self):
+		return iter(self.root)
+
+	def close(self):
+		if isinstance(self.buf, mmap.mmap):
+			self.buf.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+# reads n offsets starting at position start
+def read_offsets(buf, start, n):
+	return struct.unpack_from("<%dQ" % n, buf, start)
+
+class FlatList(object):
+	"""a read-only view of a list in a FlatDocument"""
+	def __init__(self, doc, offset):
+		self._doc = doc
+		self._offset = offset
+		self._len = sized_struct.unpack_from(doc.buf, offset)[1]
+		self._items = offset + sized_struct.size
+
+	def __len__(self):
+		return self._len
+
+	def _item(self, i):
+		return self._doc.value(offset_struct.unpack_from(self._doc.buf, self._items + i * offset_struct.size)[0])
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self._item(j) for j in xrange(*i.indices(self._len))]
+		if i < 0:
+			i += self._len
+		if not 0 <= i < self._len:
+			raise IndexError("list index out of range")
+		return self._item(i)
+
+	def __iter__(self):
+		value = self._doc.value
+		for offset in read_offsets(self._doc.buf, self._items, self._len):
+			yield value(offset)
+
+	def __repr__(self):
+		return "<FlatList of %d items>" % self._len
+
+class FlatDict(object):
+	"""a read-only view of a dict in a FlatDocument. Keys are looked up by
+binary search, so nothing is read apart from the keys on the way"""
+	def __init__(self, doc, offset):
+		self._doc = doc
+		self._offset = offset
+		self._len = sized_struct.unpack_from(doc.buf, offset)[1]
+		self._items = offset + sized_struct.size
+
+	def __len__(self):
+		return self._len
+
+	def _pair(self, i):
+		return pair_struct.unpack_from(self._doc.buf, self._items + i * pair_struct.size)
+
+	def _find(self, key):
+		lo, hi = 0, self._len
+		value = self._doc.value
+		while lo < hi:
+			mid = (lo + hi) // 2
+			k, v = self._pair(mid)
+			k = value(k)
+			if k == key:
+				return v
+			elif k < key:
+				lo = mid + 1
+			else:
+				hi = mid
+		return None
+
+	def __getitem__(self, key):
+		offset = self._find(key)
+		if offset is None:
+			raise KeyError(key)
+		return self._doc.value(offset)
+
+	def get(self, key, default=None):
+		offset = self._find(key)
+		return default if offset is None else self._doc.value(offset)
+
+	def __contains__(self, key):
+		return self._find(key) is not None
+
+	has_key = __contains__
+
+	def iteritems(self):
+		value = self._doc.value
+		for i in xrange(self._len):
+			k, v = self._pair(i)
+			yield value(k), value(v)
+
+	def iterkeys(self):
+		for k, v in self.iteritems():
+			yield k
+
+	def itervalues(self):
+		for k, v in self.iteritems():
+			yield v
+
+	__iter__ = iterkeys
+
+	def items(self):
+		return list(self.iteritems())
+
+	def keys(self):
+		return list(self.iterkeys())
+
+	def values(self):
+		return list(self.itervalues())
+
+	def __repr__(self):
+		return "<FlatDict of %d items>" % self._len
+
+class FlatTag(object):
+	"""
+a read-only view of a tag in a FlatDocument, navigated just like an Entity:
+attributes are attributes, children are got by index, and tag["name"] or
+tag[".name"] find the first or all child tags called name."""
+	def __init__(self, doc, offset):
+		self._doc = doc
+		self._offset = offset
+		kind, name, self._n_attrs, self._len = tag_struct.unpack_from(doc.buf, offset)
+		self._tag_name = doc.value(name)
+		self._children_start = offset + tag_struct.size + self._n_attrs * pair_struct.size
+		# name -> value offset, read on first attribute access
+		self._attr_offsets = None
+
+	def _attr_table(self):
+		if self._attr_offsets is None:
+			doc = self._doc
+			start = self._offset + tag_struct.size
+			pairs = read_offsets(doc.buf, start, self._n_attrs * 2)
+			self._attr_offsets = dict((doc.value(pairs[i]), pairs[i+1])
+			                          for i in xrange(0, len(pairs), 2))
+		return self._attr_offsets
+
+	def _attrs(self):
+		return sorted(self._attr_table())
+
+	def __getattr__(self, name):
+		if not name.startswith("_"):
+			offset = self._attr_table().get(name)
+			if offset is not None:
+				return self._doc.value(offset)
+		raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+
+	@property
+	def _children(self):
+		return list(self)
+
+	def __len__(self):
+		return self._len
+
+	def __iter__(self):
+		value = self._doc.value
+		for offset in read_offsets(self._doc.buf, self._children_start, self._len):
+			yield value(offset)
+
+	def _find(self, key):
+		if not tag_name_regex.match(key):
+			raise KeyError("'%s' is not a valid tag name" % key)
+		for elem in self:
+			if type(elem) == FlatTag and elem._tag_name == key:
+				yield elem
+
+	def __getitem__(self, key):
+		if isinstance(key, basestring):
+			# search by tag name
+			if key.startswith("."):
+				return list(self._find(key[1:]))
+			for elem in self._find(key):
+				return elem
+			raise KeyError("No tag with name '%s'" % key)
+		elif isinstance(key, slice):
+			return list(self)[key]
+		if key < 0:
+			key += self._len
+		if not 0 <= key < self._len:
+			raise IndexError("child index out of range")
+		return self._doc.value(offset_struct.unpack_from(self._doc.buf, self._children_start + key * offset_struct.size)[0])
+
+	def __repr__(self):
+		return "<FlatTag %s>" % self._tag_name
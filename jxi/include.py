@@ -0,0 +1,230 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import os, copy, threading
+import lex, parse
+from entity import Entity, freeze
+from registry import TagRegistry
+
+class Include(object):
+	"""stands in for an <include="path"/> tag until the file's been spliced in"""
+	__slots__ = ("path",)
+
+	def __init__(self, path):
+		self.path = path
+
+def build_include(name, attrs, children):
+	path = attrs.get(name)
+	if not isinstance(path, basestring) or len(attrs) != 1 or children:
+		raise TypeError('includes look like <include="path"/>')
+	return Include(path)
+
+# what a file looked like when it was parsed. If it's changed since, so has the
+# mtime or the size
+def stamp(path):
+	info = os.stat(path)
+	return info.st_mtime, info.st_size
+
+class Loader(object):
+	"""
+loads jxi files which include other jxi files. An <include="path"/> tag is
+replaced by the top-level elements of the file it names, as if they had been
+written in its place, and links can point at anything that comes in that way.
+Paths are relative to the directory of the file doing the including.
+Syntax:
+	Loader([tagclass=Entity, copy=True, frozen=False])
+	loader.load(path)
+	loader.parse(text [, directory="."])
+Every file is parsed once, and parsed again only when its mtime or size changes.
+Files which include it are redone too. Included files are parsed on their own,
+so their links can't point outside them.
+Everything that includes a file shares the one parsed copy of it. With copy=True
+load returns a deep copy of the cached result, so callers can change what they
+get back. With copy=False they get the cached objects themselves, which is much
+faster but only safe if nobody modifies them, as a change to an included file's
+elements shows up everywhere it's included. frozen=True gives immutable trees
+(see entity.freeze), which are shared safely without copying.
+Includes can go anywhere an element can. In lists and tags' children they're
+replaced by all the file's elements, and anywhere else the file must have just
+the one."""
+	def __init__(self, tagclass=Entity, copy=True, frozen=False):
+		self.tagclass = tagclass
+		self.copy = copy and not frozen
+		self.frozen = frozen
+
+		self.hits = 0
+		self.misses = 0
+
+		self.tagclasses = TagRegistry()
+		self.tagclasses.register("include", Include, children=None, build=build_include)
+
+		# maps path -> (stamp, elems, stamps of everything it includes)
+		self._cache = {}
+		# the files being loaded right now, to catch includes going round in circles
+		self._loading = []
+		# guards the cache. parse.lock takes care of parse's globals, which
+		# includes use again in the middle of parsing
+		self._lock = threading.RLock()
+
+	def load(self, path):
+		"""returns the top-level elements of the file at path, with its includes spliced in"""
+		with self._lock, parse.lock:
+			elems = self._load(os.path.abspath(path))[0]
+			return copy.deepcopy(elems) if self.copy else elems
+
+	def parse(self, text, directory="."):
+		"""parses text, which isn't cached, with includes relative to directory"""
+		with self._lock, parse.lock:
+			elems = self._parse(text, os.path.abspath(directory))[0]
+			return freeze(elems) if self.frozen else elems
+
+	def _load(self, path):
+		entry = self._cache.get(path)
+		if entry is not None and self._fresh(path, entry):
+			self.hits += 1
+			return entry[1], entry[2]
+
+		if path in self._loading:
+			raise lex.JXIParseError("%s includes itself" % path)
+		self.misses += 1
+		self._loading.append(path)
+		try:
+			file_stamp = stamp(path)
+			with open(path, "rb") as f:
+				text = f.read()
+			try:
+				elems, stamps = self._parse(text, os.path.dirname(path))
+			except lex.JXIParseError, e:
+				# say which file it's in, unless an included file already has
+				if getattr(e, "path", None) is None:
+					e.path = path
+					e.msg = "In %s: %s" % (path, e.msg)
+				raise
+		finally:
+			self._loading.pop()
+		self._cache[path] = (file_stamp, elems, stamps)
+		return elems, stamps
+
+	def _fresh(self, path, entry):
+		try:
+			if stamp(path) != entry[0]:
+				return False
+			for other, other_stamp in entry[2].items():
+				if stamp(other) != other_stamp:
+					return False
+		except OSError:
+			return False
+		return True
+
+	# parses text and splices in its includes before resolving its links.
+	# Returns the elements and the stamps of every file they came from
+	def _parse(self, text, directory):
+		parse.scheduled_links = []
+		parse.lexer = lex.lex(text)
+		previous = parse.use_tagclasses(self.tagclass, self.tagclasses)
+		try:
+			parse.next()
+			elems = parse.parse_file()
+		finally:
+			parse.use_tagclasses(*previous)
+		links = parse.scheduled_links
+
+		stamps = {}
+		spliced = self._splice(elems, directory, stamps)
+		# splicing moves things about in the lists it changes
+		for evaluator in links:
+			if type(evaluator) == parse.ListLinkEvaluator and id(evaluator.listobj) in spliced:
+				evaluator.index = index_of(evaluator.listobj, evaluator.link)
+
+		parse.scheduled_links = links
+		previous = parse.use_tagclasses(self.tagclass, self.tagclasses)
+		try:
+			parse.resolve_links(elems)
+		finally:
+			parse.use_tagclasses(*previous)
+		if self.frozen:
+			# included files are frozen already, and stay as they are
+			elems = freeze(elems)
+		return elems, stamps
+
+	# replaces includes with what they include, and returns the ids of the lists
+	# which were changed. Until links are resolved the tree really is a tree, and
+	# what's included has been dealt with already
+	def _splice(self, elems, directory, stamps):
+		spliced = set()
+		stack = [elems]
+		while stack:
+			obj = stack.pop()
+			if isinstance(obj, Entity):
+				for name, value in obj.__dict__.items():
+					if type(value) == Include:
+						setattr(obj, name, self._include_one(value, directory, stamps))
+					elif not name.startswith("_"):
+						stack.append(value)
+				stack.append(obj._children)
+			elif isinstance(obj, list):
+				if not any(type(elem) == Include for elem in obj):
+					stack.extend(obj)
+					continue
+				items = []
+				for elem in obj:
+					if type(elem) == Include:
+						items.extend(self._include(elem, directory, stamps))
+					else:
+						items.append(elem)
+						stack.append(elem)
+				obj[:] = items
+				spliced.add(id(obj))
+			elif isinstance(obj, dict):
+				for key, value in obj.items():
+					if type(value) == Include:
+						obj[key] = self._include_one(value, directory, stamps)
+					else:
+						stack.append(value)
+		return spliced
+
+	def _include(self, include, directory, stamps):
+		path = os.path.normpath(os.path.join(directory, include.path))
+		elems, included_stamps = self._load(path)
+		stamps[path] = self._cache[path][0]
+		stamps.update(included_stamps)
+		# nobody outside sees what's cached, so it can all share the one copy
+		return elems
+
+	def _include_one(self, include, directory, stamps):
+		elems = self._include(include, directory, stamps)
+		if len(elems) != 1:
+			raise lex.JXIParseError("%s has %d elements, so it can only be included in a list or tag"
+			                        % (include.path, len(elems)))
+		return elems[0]
+
+	def clear(self):
+		with self._lock:
+			self._cache.clear()
+
+	def __len__(self):
+		return len(self._cache)
+
+def index_of(items, elem):
+	for i, item in enumerate(items):
+		if item is elem:
+			return i
+	raise ValueError("not in list")
@@ -0,0 +1,185 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import lex, parse
+from entity import Entity
+
+# chars which can't be followed by more of the same token
+closing_chars = set([",", " ", "\v", "\t", "\n", "\r", "\f",
+                     ">", "]", "}", ";", "/", '"', "'", "`"])
+
+# decides whether a parse error might just be down to the input stopping short
+# at size, rather than there being something wrong with it
+def truncated(error, size):
+	if error.index is not None:
+		return error.index >= size
+	# the parser choked on a token. if nothing comes after it then more
+	# input could still make it valid
+	try:
+		return parse.token[0] == "EOF" or parse.lexer.next()[0] == "EOF"
+	except lex.JXIParseError, e:
+		return e.index is None or e.index >= size
+	except StopIteration:
+		return True
+
+class IncrementalParser(object):
+	"""
+parses a document which arrives in chunks, e.g. off a socket. Give it data with
+feed() as it comes in, and call close() at the end. Both return a list of
+events:
+	("element", <elem>)     a top-level element has been fully parsed
+	("document", <elems>)   the document is finished (close() only)
+Links can point anywhere in the document, so they're only resolved at close().
+Until then elements may contain parse.SymbolicLink placeholders.
+
+feed() only does as much work as the new data allows and then returns, so it
+can be called straight from an event loop's data callback, or handed to a
+worker thread when the chunks are big. The parser's state is shared by the
+whole process though, so feed() and close() wait on parse.lock, and only one
+thread parses anything at a time."""
+	def __init__(self, tagclass=Entity):
+		self.tagclass = tagclass
+		self.elems = []
+		self.result = None
+
+		self._links = []
+		self._buffer = None
+		self._pending = []
+		self._pending_size = 0
+		# index into the buffer of the first unparsed char, and the line it's on
+		self._offset = 0
+		self._line = 1
+		# don't try again until we have at least this much buffered. stops a
+		# big element arriving in little chunks from being parsed over and over
+		self._retry_at = 0
+		self._closed = False
+
+	@parse.locked
+	def feed(self, data):
+		if self._closed:
+			raise ValueError("can't feed a closed parser")
+		self._pending.append(data)
+		self._pending_size += len(data)
+		if self._buffered() < self._retry_at:
+			return []
+		return self._parse_elements(False)
+
+	@parse.locked
+	def close(self):
+		"""finishes the document, resolves links and returns the last events"""
+		if self._closed:
+			raise ValueError("parser already closed")
+		self._closed = True
+		events = self._parse_elements(True)
+
+		parse.scheduled_links = self._links
+		parse.tagclass, previous_tagclass = self.tagclass, parse.tagclass
+		try:
+			parse.resolve_links(self.elems)
+		finally:
+			parse.tagclass = previous_tagclass
+
+		self.result = self.elems
+		events.append(("document", self.elems))
+		return events
+
+	def _buffered(self):
+		return (len(self._buffer) if self._buffer is not None else 0) + self._pending_size
+
+	def _parse_elements(self, final):
+		if self._pending:
+			if self._buffer is not None:
+				self._pending.insert(0, self._buffer)
+			self._buffer = self._pending[0][:0].join(self._pending)
+			self._pending = []
+			self._pending_size = 0
+		if self._buffer is None:
+			return []
+
+		buf = self._buffer
+		size = len(buf)
+		events = []
+
+		parse.tagclass, previous_tagclass = self.tagclass, parse.tagclass
+		parse.scheduled_links = self._links
+		parse.lexer = lex.lex(buf, self._offset, self._line)
+		first_link = links_before = len(self._links)
+		try:
+			parse.next()
+			while parse.token[0] != "EOF":
+				links_before = len(self._links)
+				elem = parse.parse_element()
+
+				# if we've hit the end of the buffer, the element's last token
+				# might carry on in the next chunk. only idents and numbers can
+				if lex.token_start >= size and not final and buf[-1] not in closing_chars:
+					del self._links[links_before:]
+					break
+
+				self.elems.append(elem)
+				if type(elem) == parse.SymbolicLink:
+					self._links.append(parse.ListLinkEvaluator(elem, self.elems, len(self.elems)-1))
+				events.append(("element", elem))
+				self._offset = lex.token_start
+		except lex.JXIParseError, e:
+			if final or not truncated(e, size):
+				raise
+			del self._links[links_before:]
+		finally:
+			parse.tagclass = previous_tagclass
+
+		# links keep hold of the buffer in case anyone asks for their line
+		# numbers. work them out now, so old buffers can be thrown away
+		for evaluator in self._links[first_link:]:
+			evaluator.link.locate()
+
+		self._retry_at = size + (size - self._offset)
+		self._trim()
+		return events
+
+	# throws away the parsed part of the buffer once it's the bigger half.
+	# cuts at a newline where possible so the lexer's char numbers stay right
+	def _trim(self):
+		buf = self._buffer
+		if self._offset * 2 < len(buf):
+			return
+		cut = buf.rfind("\n", 0, self._offset) + 1 or self._offset
+		self._line += buf.count("\n", 0, cut)
+		self._buffer = buf[cut:]
+		self._offset -= cut
+		self._retry_at -= cut
+
+def iterparse(source, tagclass=Entity, chunk_size=65536):
+	"""
+parses a document bit by bit, yielding the same events as IncrementalParser.
+source can be a string, a file-like object or an iterable of string chunks."""
+	if isinstance(source, basestring):
+		chunks = (source[i:i+chunk_size] for i in xrange(0, len(source), chunk_size))
+	elif hasattr(source, "read"):
+		chunks = iter(lambda: source.read(chunk_size), source.read(0))
+	else:
+		chunks = source
+
+	parser = IncrementalParser(tagclass)
+	for chunk in chunks:
+		for event in parser.feed(chunk):
+			yield event
+	for event in parser.close():
+		yield event
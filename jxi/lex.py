@@ -18,10 +18,14 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-import string
-from entity import RawString
+import re, string, bisect, time
+from array import array
+from entity import RawString, NumberText, DecimalText, decimal_type
 
-line = 1
+# where the most recently lexed token starts in the input text
+token_start = 0
+# a LineIndex for the text being lexed, so errors can say where they are
+line_index = None
 
 ###################
 #### UTILITIES ####
@@ -29,9 +33,19 @@ line = 1
 
 class JXIParseError(Exception):
 	def __init__(self, message, line_start_char=None, index=None, lineoverride=None):
-		self.line = lineoverride or line
-		if line_start_char != None and index != None:
-			self.char = index-line_start_char + 1
+		self.line = lineoverride
+		self.index = index
+		self.reason = message
+		self.char = None
+		where = index
+		if lineoverride is None and line_index is not None:
+			# work it out from the text being lexed. Errors without an index
+			# come from the parser, and are about the token it's looking at
+			if where is None:
+				where = token_start
+			self.line, line_start_char = line_index.position(where)
+		if line_start_char != None and where != None:
+			self.char = where-line_start_char + 1
 			msg = "Error detected at "
 			msg += "line %s char %s\n" % (self.line, self.char)
 			msg += "\tMessage: " + message
@@ -41,15 +55,134 @@ class JXIParseError(Exception):
 	def __str__(self):
 		return self.msg
 
+# works out the line number and the index of the start of the line for some
+# index into text. Handy for building JXIParseErrors after the fact
+def position(text, index):
+	return text.count("\n", 0, index) + 1, text.rfind("\n", 0, index) + 1
+
+class LineIndex(object):
+	"""
+works out line numbers for indices into a text, like position, but quickly
+when there are lots to do. The newlines are only found the first time
+they're needed, so there's no cost at all if nobody asks.
+Syntax:
+	LineIndex(text [, first_line=1])
+first_line is the line number of the beginning of text."""
+	def __init__(self, text, first_line=1):
+		self.text = text
+		self.first_line = first_line
+		self._newlines = None
+
+	def position(self, index):
+		"""returns the line number of index and the index its line starts at"""
+		newlines = self._newlines
+		if newlines is None:
+			newlines = self._newlines = [m.start() for m in re.finditer("\n", self.text)]
+		n = bisect.bisect_left(newlines, index)
+		return self.first_line + n, (newlines[n-1] + 1 if n else 0)
+
+################
+#### LIMITS ####
+################
+
+class JXILimitError(JXIParseError):
+	"""
+raised when a document goes over one of the Limits it's being parsed with.
+limit is the name of the limit, e.g. "depth", and maximum is what it was set to"""
+	def __init__(self, limit, maximum, index=None, line_start_char=None, lineoverride=None):
+		self.limit = limit
+		self.maximum = maximum
+		msg = "Document exceeds the %s limit (%s)" % (limit_names[limit], maximum)
+		JXIParseError.__init__(self, msg, line_start_char, index, lineoverride)
+
+limit_names = {
+	"depth": "nesting depth",
+	"tokens": "token",
+	"string": "literal length",
+	"links": "symbolic link",
+	"link_chain": "link chain length",
+	"seconds": "time"
+}
+
+class Limits(object):
+	"""
+limits on how much work a document can make the parser do, for text from
+people you don't trust. Anything left as None isn't limited.
+Syntax:
+	Limits([depth=None, tokens=None, string=None, links=None, link_chain=None, seconds=None])
+	parse(text, limits=limits)
+depth       how deeply tags, lists and dicts can be nested
+tokens      how many tokens the document can have
+string      how long a string, raw string, number or ident can be, in chars of
+            the text. Checked before the literal is copied out of it
+links       how many symbolic links the document can have
+link_chain  how many times one link can wait for another to be resolved, i.e.
+            roughly how long a chain of links to links can be
+seconds     how long lexing, parsing and resolving links can take, checked
+            every so often (so it can run over a little)
+Going over a limit raises a JXILimitError. See untrusted for some sensible ones."""
+	def __init__(self, depth=None, tokens=None, string=None, links=None, link_chain=None, seconds=None):
+		self.depth = depth
+		self.tokens = tokens
+		self.string = string
+		self.links = links
+		self.link_chain = link_chain
+		self.seconds = seconds
+
+	def start(self):
+		"""returns a Budget for one parse, with the clock started"""
+		return Budget(self)
+
+# limits for documents off the network. Good for anything that isn't huge
+untrusted = Limits(depth=100, tokens=1000000, string=1000000, links=10000, link_chain=100, seconds=5)
+
+class Budget(object):
+	"""
+what one parse has used of its Limits so far. The lexer and parser call tick()
+every so often rather than checking on every token"""
+	# how many tokens go by between looks at the clock
+	interval = 1024
+
+	def __init__(self, limits):
+		self.limits = limits
+		self.tokens = 0
+		self.links = 0
+		self.deadline = time.time() + limits.seconds if limits.seconds is not None else None
+
+	def tick(self, tokens=0):
+		"""counts tokens more tokens and checks the clock. Returns how many more
+can go by before tick should be called again"""
+		self.tokens += tokens
+		limit = self.limits.tokens
+		if limit is not None and self.tokens > limit:
+			raise JXILimitError("tokens", limit)
+		if self.deadline is not None and time.time() > self.deadline:
+			raise JXILimitError("seconds", self.limits.seconds)
+		if limit is not None:
+			return min(self.interval, limit - self.tokens + 1)
+		return self.interval
+
+	def link(self, index=None):
+		"""counts a symbolic link, which starts at index"""
+		self.links += 1
+		limit = self.limits.links
+		if limit is not None and self.links > limit:
+			raise JXILimitError("links", limit, index)
+
 ##########################
 #### LEXICAL ANALYSIS ####
 ##########################
 
-def lex(input_text):
+def lex(input_text, start=0, first_line=1, decimals=False, lazy_numbers=False, limits=None):
 	"""
 	This is obviously the jxi lexical analyser. It is a generator function which
-	yields a stream of tokens from the input text. The tokens are tuples of the
-	form (<type>, <value>)
+	yields a stream of tokens from the input text, beginning at index start.
+	first_line is the line number of the beginning of input_text. decimals=True
+	makes floats decimal.Decimals, which keep every digit they were written
+	with, and lazy_numbers=True leaves all numbers as entity.NumberText (see
+	number_types). limits is a Limits, or the Budget of a parse which is
+	already under way, whose token, string and time limits are enforced as
+	the text is lexed. The tokens are tuples of the form (<type>, <value>)
 	possible types are:
 		("null", "null")
 		("bool", "true"|"false")
@@ -60,7 +193,7 @@ def lex(input_text):
 		("rawstring", <raw string literal>)
 		("ident", <identifier>)
 	"""
-	global line
+	global line_index, token_start
 	# yeah, i know 200-line functions are fucked, but I'm trading verbosity for
 	# speed here. The structure of the function is actually reasonably simple
 
@@ -98,13 +231,38 @@ def lex(input_text):
 	for delim in ["`"]:
 		raw_string_escapes[delim] = set(["\\", delim])
 
+	# these match the longest run of chars which need no special treatment,
+	# so the string branches can skip ahead at C speed
+	json_string_chunks = {}
+	for delim, escapes in json_string_escapes.items():
+		json_string_chunks[delim] = re.compile("[^%s]*" % re.escape("".join(escapes))).match
+	raw_string_chunks = {}
+	for delim, escapes in raw_string_escapes.items():
+		raw_string_chunks[delim] = re.compile("[^%s]*" % re.escape("".join(escapes))).match
+
 	reserved_word_types = {"null":"null", "true":"bool", "false":"bool"}
 
-	line = 1
-	line_start_char = 0
+	int_type, float_type = number_types(decimals, lazy_numbers)
+
+	# tokens are counted down to the next budget check. Without limits it
+	# goes negative and never gets back to zero
+	if isinstance(limits, Limits):
+		limits = limits.start()
+	countdown = ticked = limits.tick() if limits is not None else -1
+	max_string = limits.limits.string if limits is not None else None
+	if max_string is None:
+		max_string = len(input_text)
+
+	# line numbers are only worked out if something goes wrong
+	line_index = LineIndex(input_text, first_line)
 
 	inp = input_text
-	i = 0
+	i = start
+
+	# string tokens are always utf-8 encoded byte strings. If we were given
+	# bytes then slices of the input already are, otherwise encode them
+	is_unicode = isinstance(input_text, unicode)
+	empty = input_text[:0]
 
 	size = len(input_text)
 
@@ -112,12 +270,13 @@ def lex(input_text):
 	while i < size:
 		# skip over whitespace
 		while i < size and inp[i] in whitespace:
-			if inp[i] == "\n":
-				line += 1
-				line_start_char = i + 1
 			i += 1
 
+		token_start = i
 		if i >= size: break
+		countdown -= 1
+		if countdown == 0:
+			countdown = ticked = limits.tick(ticked)
 		# figure out what type of token we're dealing with
 		### SYMBOLS ###
 		if inp[i] in symbols:
@@ -129,6 +288,8 @@ def lex(input_text):
 			j = i+1
 			while j < size and inp[j] in word_chars:
 				j += 1
+			if j - i > max_string:
+				raise JXILimitError("string", max_string, index=token_start)
 			yield (reserved_word_types.get(inp[i:j], "ident"), inp[i:j])
 			i = j
 
@@ -136,19 +297,33 @@ def lex(input_text):
 		elif inp[i] in json_string_escapes:
 			# get the delimiter being used and the corresponding escape chars
 			delim = inp[i]
-			escapes = json_string_escapes[delim]
+			chunk = json_string_chunks[delim]
 
 			# skip over delimiter
 			i += 1
-			text = u""
+			literal_start = i
+
+			# if the first interesting char is the closing delimiter then there are
+			# no escapes, and the literal is just a slice of the input
+			j = chunk(inp, i).end()
+			if j - i > max_string:
+				raise JXILimitError("string", max_string, index=token_start)
+			if j < size and inp[j] == delim:
+				text = inp[i:j]
+				i = j + 1
+				yield ("string", text.encode("utf-8") if is_unicode else text)
+				continue
+
+			# otherwise collect the pieces and join them once at the end
+			parts = []
 
 			# keep going until we see the delimiter again
 			while i < size and inp[i] != delim:
-				# get the next sequence of chars not containing escapes and concat
-				j = i
-				while j < size and inp[j] not in escapes:
-					j += 1
-				text += inp[i:j]
+				# get the next sequence of chars not containing escapes
+				j = chunk(inp, i).end()
+				if j - literal_start > max_string:
+					raise JXILimitError("string", max_string, index=token_start)
+				parts.append(inp[i:j])
 				i = j
 
 				if i == size: break
@@ -163,7 +338,7 @@ def lex(input_text):
 					### CONTROL CHARS ###
 					if inp[i] in control_characters:
 						# put the control character in the string
-						text += control_characters[inp[i]]
+						parts.append(control_characters[inp[i]])
 						i += 1
 
 					### UNICODE STUFFS ###
@@ -174,25 +349,29 @@ def lex(input_text):
 							charcode = int(inp[i:i+4], 16)
 						except ValueError:
 							msg = "invalid unicode hexadecimal format"
-							raise JXIParseError(msg, line_start_char, i)
+							raise JXIParseError(msg, index=i)
 						i += 4
-						text += unichr(charcode)
+						if is_unicode:
+							parts.append(unichr(charcode))
+						else:
+							parts.append(unichr(charcode).encode("utf-8"))
 
 					else:
 						msg = "Invalid escape sequence '\\%s'" % inp[i]
-						raise JXIParseError(msg, line_start_char, i)
+						raise JXIParseError(msg, index=i)
 
 				elif inp[i] != delim:
 					msg = "Unescaped %s detected in string literal" % repr(inp[i])
-					raise JXIParseError(msg, line_start_char, i)
+					raise JXIParseError(msg, index=i)
 
 			if i >= size:
 				msg = "Unterminated string literal"
-				raise JXIParseError(msg, line_start_char, i)
+				raise JXIParseError(msg, index=i)
 
 			# skip over final delimiter
 			i += 1
-			yield ("string", text.encode("utf-8"))
+			text = empty.join(parts)
+			yield ("string", text.encode("utf-8") if is_unicode else text)
 
 		### NUMBERS ###
 		elif inp[i] in number_start_chars:
@@ -205,11 +384,11 @@ def lex(input_text):
 
 				if j == size:
 					msg = "Unexpected EOF after '-'"
-					raise JXIParseError(msg, line_start_char, j)
+					raise JXIParseError(msg, index=j)
 
 				if inp[j] not in digits:
 					msg = "Expecting digit after '-', got %s" % repr(inp[j])
-					raise JXIParseError(msg, line_start_char, j)
+					raise JXIParseError(msg, index=j)
 				
 				while j < size and inp[j] in digits:
 					j += 1
@@ -222,7 +401,7 @@ def lex(input_text):
 					j += 1
 					if j == size or inp[j] not in digits:
 						msg = "Expecting digit after '.', got %s" % (repr(inp[j]) if j < size else "EOF")
-						raise JXIParseError(msg, line_start_char, j)
+						raise JXIParseError(msg, index=j)
 
 					while j < size and inp[j] in digits:
 						j += 1
@@ -241,54 +420,296 @@ def lex(input_text):
 					# at least one digit
 					if j == size or inp[j] not in digits:
 						msg = "Expecting exponent value, got %s" % (repr(inp[j]) if j < size else "EOF")
-						raise JXIParseError(msg, line_start_char, j)
+						raise JXIParseError(msg, index=j)
 
 					while j < size and inp[j] in digits:
 						j += 1
 
 				break
 
-			yield ("int" if numtype == int else "float", numtype(inp[i:j]))
+			# int() takes time quadratic in the number of digits
+			if j - i > max_string:
+				raise JXILimitError("string", max_string, index=token_start)
+			if numtype == int:
+				yield ("int", int_type(inp[i:j]))
+			else:
+				yield ("float", float_type(inp[i:j]))
 			i = j
 
 		### RAW STRINGS ###
 		elif inp[i] in raw_string_escapes:
 			# get delimiter and related escapes
 			delim = inp[i]
-			escapes = raw_string_escapes[delim]
+			chunk = raw_string_chunks[delim]
 
 			# skip over delimiter
 			i += 1
-			text = ""
+			literal_start = i
+
+			# same deal as json strings: no backslashes means a single slice
+			j = chunk(inp, i).end()
+			if j - i > max_string:
+				raise JXILimitError("string", max_string, index=token_start)
+			if j < size and inp[j] == delim:
+				text = inp[i:j]
+				i = j + 1
+				yield ("rawstring", RawString(text.encode("utf-8") if is_unicode else text))
+				continue
+
+			parts = []
 
 			# keep going until we see the delimiter again
-			while inp[i] != delim:
-				# get the next string of uninteresting chars and concat
-				j = i
-				while inp[j] not in escapes:
-					j += 1
-				text += inp[i:j]
+			while i < size and inp[i] != delim:
+				# get the next string of uninteresting chars
+				j = chunk(inp, i).end()
+				if j - literal_start > max_string:
+					raise JXILimitError("string", max_string, index=token_start)
+				parts.append(inp[i:j])
 				i = j
 
+				if i == size: break
+
 				# now we're at an interesting char
 				if inp[i] == "\\":
 					i += 1
 					# only need to escape if it's the delimiter
-					if inp[i] == delim:
-						text += delim
+					if i < size and inp[i] == delim:
+						parts.append(delim)
 						i += 1
 					else:
 						# otherwise, that backslash was meant to be there
 						# better put it back in
-						text += "\\"
+						parts.append("\\")
+
+			if i >= size:
+				msg = "Unterminated raw string literal"
+				raise JXIParseError(msg, index=i)
 
 			# ignore final delimiter
 			i += 1
-			yield ("rawstring", RawString(text.encode("utf-8")))
+			text = empty.join(parts)
+			yield ("rawstring", RawString(text.encode("utf-8") if is_unicode else text))
 
 		else:
 			msg = "Illegal character %s" % repr(inp[i])
-			raise JXIParseError(msg, line_start_char, i)
+			raise JXIParseError(msg, index=i)
 
+	token_start = size
 	yield ("EOF", "EOF")
 
+
+#######################
+#### TOKEN BUFFERS ####
+#######################
+
+# the functions which turn the text of int and float literals into values
+def number_types(decimals=False, lazy_numbers=False):
+	if lazy_numbers:
+		text = DecimalText if decimals else NumberText
+		return text, text
+	return int, decimal_type() if decimals else float
+
+# token kinds used by TokenBuffer. The scalar kinds are contiguous so a range
+# check will do, and every symbol gets its own kind so the parser only ever
+# compares small ints
+EOF, NULL, BOOL, INT, FLOAT, STRING, RAWSTRING, IDENT = range(8)
+LT, GT, LBRACKET, RBRACKET, LBRACE, RBRACE, COLON, SLASH, EQUALS, AT, DOT, SEMICOLON = range(8, 20)
+# with lazy_numbers=True, two or more numbers in a row are one token, whose value
+# is the list of them
+NUMBERS = 20
+
+symbol_kinds = {"<": LT, ">": GT, "[": LBRACKET, "]": RBRACKET, "{": LBRACE, "}": RBRACE,
+                ":": COLON, "/": SLASH, "=": EQUALS, "@": AT, ".": DOT, ";": SEMICOLON}
+type_kinds = {"EOF": EOF, "null": NULL, "bool": BOOL, "int": INT, "float": FLOAT,
+              "string": STRING, "rawstring": RAWSTRING, "ident": IDENT}
+# maps kinds back to lex's type names
+kind_types = dict((kind, type) for type, kind in type_kinds.items())
+kind_types.update((kind, "sym") for kind in symbol_kinds.values())
+kind_types[NUMBERS] = "numbers"
+
+whitespace_chars = ", \t\n\r\f\v"
+
+# matches whitespace followed by one well-formed token, if there is one. The
+# group that matched tells us what sort of token it was. Anything these don't
+# cover exactly the way lex does (mostly malformed input) is left to lex itself
+json_string_pattern = r"""%(d)s[^%(d)s\\\x08\x0c\n\r\t]*(?:\\(?:[bfnrt\\/"']|u[0-9a-fA-F]{4})[^%(d)s\\\x08\x0c\n\r\t]*)*%(d)s"""
+token_regex = re.compile(r"""[%s]*(?:
+	(<)|(>)|(\[)|(\])|(\{)|(\})|(:)|(/)|(=)|(@)|(\.)|(;)|    # 1-12 symbols, in kind order
+	([a-zA-Z][a-zA-Z0-9_]*)|                             # 13 ident, null or bool
+	(-?[0-9]+(?![0-9.eE]))|                              # 14 int
+	(-?[0-9]+(?![0-9])(?:                                # 15 float
+		\.[0-9]+(?![0-9])(?:[eE][+-]?[0-9]+|(?![eE]))|
+		[eE][+-]?[0-9]+))|
+	(%s|%s)|                                             # 16 json string
+	(`[^`\\]*(?:(?:\\`|\\(?!`))[^`\\]*)*`)               # 17 raw string
+)?""" % (re.escape(whitespace_chars), json_string_pattern % {"d": '"'},
+         json_string_pattern % {"d": "'"}), re.VERBOSE)
+
+# matches two or more numbers with nothing but whitespace between them. A
+# number followed by ':' is a dict key, which ends the run before it
+number_pattern = r"-?[0-9]+(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?"
+number_run = re.compile(r"(?:%s[%s]+)+%s(?![0-9.eE]|[%s]*:)" % (number_pattern, re.escape(whitespace_chars),
+	number_pattern, re.escape(whitespace_chars))).match
+
+# symbol groups are numbered so that group + SYM_OFFSET is the symbol's kind
+SYM_OFFSET = LT - 1
+IDENT_GROUP, INT_GROUP, FLOAT_GROUP, STRING_GROUP, RAWSTRING_GROUP = range(13, 18)
+
+# for decoding string literals the regex has already checked
+escape_regex = re.compile(r"\\(?:u([0-9a-fA-F]{4})|(.))")
+escape_chars = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t",
+                "\\": "\\", "/": "/", '"': '"', "'": "'"}
+
+def unescape_bytes(m):
+	if m.group(1):
+		return unichr(int(m.group(1), 16)).encode("utf-8")
+	return escape_chars[m.group(2)]
+
+def unescape_unicode(m):
+	if m.group(1):
+		return unichr(int(m.group(1), 16))
+	return escape_chars[m.group(2)]
+
+class TokenBuffer(object):
+	"""
+lexes a whole text in one go into parallel arrays, instead of yielding a tuple
+per token.
+Syntax:
+	TokenBuffer(text [, decimals=False, lazy_numbers=False])
+decimals and lazy_numbers are as for lex, except that with lazy_numbers runs of
+numbers are lexed together into NUMBERS tokens. For the token at index i:
+	kinds[i]    its kind, one of the small ints above
+	starts[i]   the index of its first char in text
+	ends[i]     the index just past its last char
+	values[i]   its value, as lex would give it. values is a dict holding only
+	            tokens which have one, so symbols take up no room
+lines is a LineIndex for text.
+The last token is always EOF, so a parser can look ahead by one from anything
+else without checking the length. Lexical errors are raised up front, just
+like lex would raise them."""
+	def __init__(self, text, decimals=False, lazy_numbers=False):
+		self.text = text
+		self.decimals = decimals
+		self.lazy_numbers = lazy_numbers
+		self.kinds = array("B")
+		self.starts = array("l")
+		self.ends = array("l")
+		self.values = {}
+		self.lines = LineIndex(text)
+
+		add_kind = self.kinds.append
+		add_start = self.starts.append
+		add_end = self.ends.append
+		values = self.values
+		tokens = token_regex.finditer
+		reserved = {"null": NULL, "true": BOOL, "false": BOOL}
+		is_unicode = isinstance(text, unicode)
+		unescape = unescape_unicode if is_unicode else unescape_bytes
+		int_type, float_type = number_types(decimals, lazy_numbers)
+		size = len(text)
+
+		index = 0
+		pos = 0
+		while True:
+			for m in tokens(text, pos):
+				group = m.lastindex
+				if group is None:
+					break
+				elif group < IDENT_GROUP:
+					# symbols are only ever one char long
+					end = m.end()
+					start = end - 1
+					add_kind(group + SYM_OFFSET)
+				else:
+					start, end = m.span(group)
+					if group == IDENT_GROUP:
+						value = text[start:end]
+						add_kind(reserved.get(value, IDENT))
+					elif lazy_numbers and group <= FLOAT_GROUP and number_run(text, start):
+						# numbers which are only going to be decoded later can
+						# be lexed a whole run at a time
+						end = number_run(text, start).end()
+						values[index] = map(int_type, text[start:end].replace(",", " ").split())
+						add_kind(NUMBERS)
+						add_start(start)
+						add_end(end)
+						index += 1
+						pos = end
+						break
+					elif group == INT_GROUP:
+						value = int_type(text[start:end])
+						add_kind(INT)
+					elif group == FLOAT_GROUP:
+						value = float_type(text[start:end])
+						add_kind(FLOAT)
+					else:
+						value = text[start+1:end-1]
+						if group == STRING_GROUP:
+							if "\\" in value:
+								value = escape_regex.sub(unescape, value)
+							if is_unicode:
+								value = value.encode("utf-8")
+							add_kind(STRING)
+						else:
+							if "\\" in value:
+								value = value.replace("\\`", "`")
+							if is_unicode:
+								value = value.encode("utf-8")
+							value = RawString(value)
+							add_kind(RAWSTRING)
+					values[index] = value
+
+				add_start(start)
+				add_end(end)
+				index += 1
+
+			if pos > m.start():
+				# stopped after a run of numbers
+				continue
+			# no token matched. either we're done or there's something here
+			# the regex doesn't cover, which usually means an error
+			start = m.end()
+			if start == size:
+				break
+			kind, value, end = self._slow_token(start)
+			add_kind(kind)
+			add_start(start)
+			add_end(end)
+			if kind < LT:
+				values[index] = value
+			index += 1
+			pos = end
+
+		add_kind(EOF)
+		add_start(size)
+		add_end(size)
+
+	# lexes a single token at start with lex, which raises the proper error if
+	# it's malformed
+	def _slow_token(self, start):
+		tokens = lex(self.text, start, decimals=self.decimals, lazy_numbers=self.lazy_numbers)
+		type, value = tokens.next()
+		# the token ends where the whitespace before the next one starts
+		try:
+			tokens.next()
+		except JXIParseError:
+			pass
+		end = start + len(self.text[start:token_start].rstrip(whitespace_chars))
+		kind = symbol_kinds[value] if type == "sym" else type_kinds[type]
+		return kind, value, end
+
+	def __len__(self):
+		return len(self.kinds)
+
+	def token(self, i):
+		"""returns token i as a (type, value) tuple like the ones lex yields"""
+		kind = self.kinds[i]
+		if kind == EOF:
+			return ("EOF", "EOF")
+		elif i in self.values:
+			return (kind_types[kind], self.values[i])
+		return ("sym", self.text[self.starts[i]])
+
+	def position(self, i):
+		"""returns the line number of token i and the index its line starts at"""
+		return self.lines.position(self.starts[i])
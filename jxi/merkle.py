@@ -0,0 +1,271 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# Content hashes for parsed trees, and diffs built on them.
+#
+# Every tag, list and dict gets a sha1 digest of what's in it, with the things
+# inside it that are containers themselves standing in as their own digests. So
+# two subtrees with the same digest are the same, and a diff can skip them
+# without looking inside. Links are hashed by their path rather than by what
+# they point at, so a change is put down to where it happened, not to every
+# place that links there.
+#
+# parse(text, hashes=True) works the digests out bottom-up as it goes, before
+# links are resolved, and keeps them on the tags, lists and dicts themselves.
+# Anything without a digest (e.g. trees parsed without hashes) gets one worked
+# out when it's asked for, which means looking at everything in it. Digests
+# aren't kept up to date, so don't change a tree and then diff it.
+
+import hashlib
+from entity import Entity, FrozenDict, RawString, NumberText, DecimalText, format_step, format_path
+from parse import SymbolicLink, LazyList, LazyDict, HashedList, HashedDict
+
+list_types = set([list, tuple, LazyList, HashedList])
+dict_types = set([dict, FrozenDict, LazyDict, HashedDict])
+
+# things which are never containers, to save looking any closer
+scalar_types = set([str, int, long, float, RawString, NumberText, DecimalText, unicode, bool, type(None), SymbolicLink])
+
+def is_container(obj):
+	t = type(obj)
+	return t in list_types or t in dict_types or isinstance(obj, Entity)
+
+# the digest a container was given, or None
+def cached(obj):
+	if isinstance(obj, Entity):
+		return obj.__dict__.get("_digest")
+	return getattr(obj, "_digest", None)
+
+def store(obj, digest):
+	if isinstance(obj, Entity):
+		obj.__dict__["_digest"] = digest
+	elif type(obj) in (HashedList, HashedDict):
+		obj._digest = digest
+
+###################
+##### HASHING #####
+###################
+
+# a typed, self-delimiting encoding for anything which isn't a container
+def encode(value):
+	t = type(value)
+	if t == str:
+		return "s%d:%s" % (len(value), value)
+	elif t in (int, long):
+		return "i%d;" % value
+	elif t == float:
+		return "f%r;" % value
+	elif t == RawString:
+		return "r%d:%s" % (len(value), value)
+	elif t == unicode:
+		value = value.encode("utf-8")
+		return "u%d:%s" % (len(value), value)
+	elif t == NumberText or t == DecimalText:
+		# numbers hash the same whether or not they've been read yet
+		return encode(value.decode())
+	elif t == SymbolicLink:
+		path = format_path(value.args)
+		return "@%d:%s" % (len(path), path)
+	elif value is None:
+		return "n"
+	elif t == bool:
+		return "T" if value else "F"
+	data = repr(value)
+	return "o%d:%s" % (len(data), data)
+
+# the items of a list, or a tag's children, with lazy links left as they are
+def items(obj):
+	return list.__iter__(obj) if isinstance(obj, list) else iter(obj)
+
+# a tag's attributes, with lazy links as their SymbolicLinks
+def attributes(tag):
+	attrs = dict((k, v) for k, v in tag.__dict__.items() if not k.startswith("_"))
+	for name, evaluator in (tag.__dict__.get("_lazy_links") or {}).items():
+		attrs[name] = evaluator.link
+	return attrs
+
+# what's in a container, as (key, value) pairs in a fixed order
+def contents(obj):
+	t = type(obj)
+	if t in list_types:
+		return enumerate(items(obj))
+	elif t in dict_types:
+		return sorted(dict.iteritems(obj), key=lambda pair: encode(pair[0]))
+	pairs = sorted(attributes(obj).items())
+	pairs.extend(enumerate(items(obj._children)))
+	return pairs
+
+# works out the digest of obj from pairs, its contents, given a way of getting
+# the digests of the containers in it
+def compute(obj, pairs, digest_of):
+	t = type(obj)
+	if t in list_types:
+		parts = ["l%d;" % len(obj)]
+	elif t in dict_types:
+		parts = ["d%d;" % len(obj)]
+	else:
+		parts = ["t", encode(obj._tag_name), "%d;" % len(obj._children)]
+	append = parts.append
+	for key, value in pairs:
+		append(encode(key))
+		t = type(value)
+		# the usual suspects first
+		if t == str:
+			append("s%d:%s" % (len(value), value))
+		elif t == int:
+			append("i%d;" % value)
+		elif t in scalar_types or not is_container(value):
+			append(encode(value))
+		else:
+			append("h")
+			append(digest_of(value))
+	return hashlib.sha1("".join(parts)).digest()
+
+# works out digests for root and everything in it which doesn't have one yet,
+# children first, without recursing. With keep, they're stored on the nodes
+# which can take them
+def work_out(root, keep):
+	digests = {}
+	on_stack = set()
+
+	def digest_of(obj):
+		d = cached(obj)
+		if d is None:
+			# a container which is one of its own ancestors, through a link
+			d = digests.get(id(obj), "cycle")
+		return d
+
+	stack = [(root, None)]
+	while stack:
+		obj, pairs = stack.pop()
+		if pairs is not None:
+			d = digests[id(obj)] = compute(obj, pairs, digest_of)
+			on_stack.discard(id(obj))
+			if keep:
+				store(obj, d)
+			continue
+		if id(obj) in digests or cached(obj) is not None:
+			continue
+		on_stack.add(id(obj))
+		pairs = list(contents(obj))
+		stack.append((obj, pairs))
+		for key, value in pairs:
+			if type(value) not in scalar_types and is_container(value) and cached(value) is None and \
+					id(value) not in digests and id(value) not in on_stack:
+				stack.append((value, None))
+	return digest_of(root)
+
+def seal(document):
+	"""gives document and everything in it a digest. The parser does this
+when asked for hashes"""
+	work_out(document, True)
+
+def digest(obj):
+	"""
+returns obj's digest: 20 bytes of sha1 of its contents. If obj wasn't given one
+when it was parsed, it's worked out from scratch."""
+	if not is_container(obj):
+		return hashlib.sha1(encode(obj)).digest()
+	d = cached(obj)
+	if d is not None:
+		return d
+	return work_out(obj, False)
+
+###################
+##### DIFFING #####
+###################
+
+# stands in for one side of something added or removed
+missing = object()
+
+def same(a, b):
+	if a is b:
+		return True
+	container = is_container(a)
+	if container != is_container(b):
+		return False
+	if container:
+		return digest(a) == digest(b)
+	return encode(a) == encode(b)
+
+# pairs up two lists of items, skipping over the same ones at either end
+def align(path, old, new):
+	old, new = list(items(old)), list(items(new))
+	start = 0
+	while start < len(old) and start < len(new) and same(old[start], new[start]):
+		start += 1
+	old_end, new_end = len(old), len(new)
+	while old_end > start and new_end > start and same(old[old_end-1], new[new_end-1]):
+		old_end -= 1
+		new_end -= 1
+
+	pairs = []
+	for i in xrange(start, max(old_end, new_end)):
+		pairs.append(("%s[%d]" % (path, i),
+		              old[i] if i < old_end else missing,
+		              new[i] if i < new_end else missing))
+	return pairs
+
+def pair_up(path, operator, old, new):
+	keys = sorted(set(old) | set(new), key=encode)
+	return [(path + format_step(operator, key), old.get(key, missing), new.get(key, missing))
+	        for key in keys]
+
+def diff(old, new):
+	"""
+returns what changed between two parsed documents, or any two bits of them.
+Syntax:
+	diff(old, new)
+Changes come back as a list of (change, path), where change is "added",
+"removed" or "modified" and path is in link syntax without the @ and ;, e.g.
+"[0][2].port". Tags with different names, and things of different types, count
+as modified as a whole.
+Anything with the same digest on both sides is skipped, so for trees parsed
+with hashes=True the time it takes goes with how much changed, not with how big
+the trees are."""
+	changes = []
+	# links can lead back round to somewhere we've already been
+	seen = set()
+	stack = [("", old, new)]
+	while stack:
+		path, a, b = stack.pop()
+		if a is missing:
+			changes.append(("added", path))
+			continue
+		elif b is missing:
+			changes.append(("removed", path))
+			continue
+		elif same(a, b) or (id(a), id(b)) in seen:
+			continue
+		seen.add((id(a), id(b)))
+
+		if isinstance(a, Entity) and isinstance(b, Entity) and a._tag_name == b._tag_name:
+			pairs = pair_up(path, ".", attributes(a), attributes(b))
+			pairs.extend(align(path, a._children, b._children))
+		elif type(a) in list_types and type(b) in list_types:
+			pairs = align(path, a, b)
+		elif type(a) in dict_types and type(b) in dict_types:
+			pairs = pair_up(path, "[", dict(dict.iteritems(a)), dict(dict.iteritems(b)))
+		else:
+			changes.append(("modified", path))
+			continue
+		stack.extend(reversed(pairs))
+	return changes
@@ -0,0 +1,231 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import copy
+from entity import Entity, FrozenEntity, FrozenDict, freeze
+
+missing = object()
+
+# tags are merged with tags of the same name and dicts with dicts. Anything
+# else in a higher layer just hides what's below it
+def mergeable(top, other):
+	if isinstance(top, Entity):
+		return isinstance(other, Entity) and other._tag_name == top._tag_name
+	return isinstance(top, dict) and isinstance(other, dict)
+
+# values are given top first. A value which can't be merged with the one above
+# hides everything below it, the same as merging the layers one after another
+def stack(values):
+	top = values[0]
+	if not isinstance(top, (Entity, dict)):
+		return top
+	layers = [top]
+	for value in values[1:]:
+		if not mergeable(top, value):
+			break
+		layers.append(value)
+	if len(layers) == 1:
+		return top
+	layers.reverse()
+	return Overlay(*layers) if isinstance(top, Entity) else DictOverlay(*layers)
+
+def check_layers(layers, kind):
+	if not layers:
+		raise ValueError("an overlay needs at least one layer")
+	top = layers[-1]
+	if not isinstance(top, kind):
+		raise TypeError("can't overlay %s" % type(top).__name__)
+	for layer in layers[:-1]:
+		if not mergeable(top, layer):
+			raise TypeError("can't overlay %s on %s" % (type(top).__name__, type(layer).__name__))
+
+def overlay(*layers):
+	"""
+stacks parsed trees on top of each other without merging them, the later ones
+overriding the earlier ones.
+Syntax:
+	overlay(base, override1 [, override2 ...])
+The layers must all be tags with the same name, or all dicts, and you get back
+an Overlay or a DictOverlay respectively. Overlay(*layers) and
+DictOverlay(*layers) do the same."""
+	check_layers(layers, (Entity, dict))
+	return Overlay(*layers) if isinstance(layers[-1], Entity) else DictOverlay(*layers)
+
+class Overlay(object):
+	"""
+a read only view of several tags stacked on top of each other, as if they'd
+been deep merged, but without copying anything.
+Syntax:
+	Overlay(base, override1 [, override2 ...])
+Attributes come from the highest layer which has them. Where that's a tag or a
+dict and the layers below have one too (a tag with the same name, or a dict),
+you get another overlay of those. Lists, strings and numbers just replace what's
+below them.
+Children can't be merged item by item, so they come from the highest layer which
+has any. Looking children up by tag name is the exception:
+	view["server"]     overlays the first <server> of every layer that has one
+	view[".server"]    all the <server>s of the highest layer that has any
+Lookups cost O(number of layers) on top of the usual Entity lookup cost, however
+big the layers are. Call _flatten() (or flatten()) for a real tree, e.g. to
+change it or write it out."""
+	__slots__ = ("_layers",)
+
+	def __init__(self, *layers):
+		check_layers(layers, Entity)
+		# kept top first, which is the order they're searched in
+		object.__setattr__(self, "_layers", list(reversed(layers)))
+
+	@property
+	def _tag_name(self):
+		return self._layers[0]._tag_name
+
+	@property
+	def _children(self):
+		for layer in self._layers:
+			if len(layer._children):
+				return layer._children
+		return self._layers[0]._children
+
+	def _attrs(self):
+		attrs = set()
+		for layer in self._layers:
+			attrs.update(layer._attrs())
+		return sorted(attrs)
+
+	def __getattr__(self, name):
+		if not name.startswith("_"):
+			values = [value for value in (getattr(layer, name, missing) for layer in self._layers)
+			          if value is not missing]
+			if values:
+				return stack(values)
+		raise AttributeError("'Overlay' object has no attribute '%s'" % name)
+
+	def __setattr__(self, name, value):
+		raise TypeError("Overlay objects are read only")
+
+	def __getitem__(self, key):
+		if isinstance(key, basestring) and not key.startswith("."):
+			found = []
+			for layer in self._layers:
+				try:
+					found.append(layer[key])
+				except KeyError:
+					pass
+			if not found:
+				raise KeyError("No tag with name '%s'" % key)
+			return stack(found)
+		elif isinstance(key, basestring):
+			for layer in self._layers:
+				found = layer[key]
+				if found:
+					return found
+			return found
+		return self._children[key]
+
+	def __iter__(self):
+		return iter(self._children)
+
+	def __len__(self):
+		return len(self._children)
+
+	def _flatten(self, memo=None):
+		"""returns a real tag with the layers merged into it"""
+		return flatten(self, memo)
+
+	def __repr__(self):
+		return "<Overlay of %d <%s> tags>" % (len(self._layers), self._tag_name)
+
+class DictOverlay(object):
+	"""
+a read only view of several dicts stacked on top of each other. Keys come from
+the highest dict which has them, and dict or tag values are overlaid the same
+way as in an Overlay. Get these from overlay()."""
+	__slots__ = ("_layers",)
+
+	def __init__(self, *layers):
+		check_layers(layers, dict)
+		self._layers = list(reversed(layers))
+
+	def __getitem__(self, key):
+		values = [layer[key] for layer in self._layers if key in layer]
+		if not values:
+			raise KeyError(key)
+		return stack(values)
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	def __contains__(self, key):
+		return any(key in layer for layer in self._layers)
+
+	has_key = __contains__
+
+	# bottom layer's keys first, then whatever the layers above add
+	def keys(self):
+		seen = set()
+		keys = []
+		for layer in reversed(self._layers):
+			for key in layer:
+				if key not in seen:
+					seen.add(key)
+					keys.append(key)
+		return keys
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def __len__(self):
+		return len(self.keys())
+
+	def values(self):
+		return [self[key] for key in self.keys()]
+
+	def items(self):
+		return [(key, self[key]) for key in self.keys()]
+
+	def _flatten(self, memo=None):
+		"""returns a real dict with the layers merged into it"""
+		return flatten(self, memo)
+
+	def __repr__(self):
+		return "<DictOverlay of %d dicts>" % len(self._layers)
+
+def flatten(obj, memo=None):
+	"""
+turns an overlay into a real tree, which is a deep copy of whatever the overlay
+shows. Anything else is just deep copied. The result is frozen if the top layer
+was. Things referenced more than once in the layers stay shared in the result,
+as long as they weren't merged."""
+	if memo is None:
+		memo = {}
+	t = type(obj)
+	if t == Overlay:
+		attrs = dict((name, flatten(getattr(obj, name), memo)) for name in obj._attrs())
+		children = [copy.deepcopy(child, memo) for child in obj._children]
+		result = Entity(obj._tag_name, attrs, children)
+		return freeze(result) if type(obj._layers[0]) == FrozenEntity else result
+	elif t == DictOverlay:
+		result = dict((key, flatten(value, memo)) for key, value in obj.items())
+		return freeze(result) if type(obj._layers[0]) == FrozenDict else result
+	return copy.deepcopy(obj, memo)
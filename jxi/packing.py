@@ -0,0 +1,226 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# Pickling and deep copying for whole parsed trees, done without recursion, so
+# deep trees don't hit the recursion limit and anything shared by links stays
+# shared.
+#
+# pack() turns a tree into a table with a row for every container in it (tags,
+# lists and dicts), in the order they're first reached. A row is the container's
+# class and a shallow copy of its contents (a tag's __dict__, a list's items, a
+# dict's items) with None wherever another container goes. Where they go is
+# kept in a flat list of (row, key, target row) triples. Each container gets one
+# row however many times it's referenced, cycles and all. unpack() builds the
+# tree back up from the table.
+
+import copy, cPickle
+from entity import Entity, FrozenEntity, FrozenDict, RawString
+from chunked import ChunkedList
+import parse
+
+# things which can't be changed, so copies can share them
+atomic_types = set([type(None), bool, int, long, float, complex, str, unicode, RawString])
+
+list_types = set([list, tuple, parse.LazyList, parse.HashedList, ChunkedList])
+dict_types = set([dict, FrozenDict, parse.LazyDict, parse.HashedDict])
+# which have to be built from their contents rather than filled in afterwards
+immutable_types = set([tuple, FrozenDict])
+# what copy_tree copies itself. Frozen things are shared rather than copied
+copy_types = set([list, dict, parse.LazyList, parse.LazyDict, parse.HashedList, parse.HashedDict,
+                  ChunkedList])
+
+def is_container(obj):
+	t = type(obj)
+	return t in list_types or t in dict_types or isinstance(obj, Entity)
+
+def is_copyable(obj):
+	return type(obj) in copy_types or (isinstance(obj, Entity) and not isinstance(obj, FrozenEntity))
+
+# returns a shallow copy of obj's contents, and a list of (key, value) for the
+# values in it which aren't atomic
+def shallow(obj):
+	t = type(obj)
+	if t in list_types:
+		# iterating resolves any lazy links
+		data = list(obj)
+		keys = xrange(len(data))
+	elif t in dict_types:
+		data = dict(obj.iteritems())
+		keys = data.keys()
+	else:
+		# lazy attribute links are resolved too, which moves them out of
+		# _lazy_links and into __dict__
+		for name in list(obj.__dict__.get("_lazy_links") or ()):
+			getattr(obj, name)
+		data = dict(obj.__dict__)
+		data.pop("_lazy_links", None)
+		keys = data.keys()
+
+	others = []
+	for key in keys:
+		value = data[key]
+		if type(value) not in atomic_types:
+			others.append((key, value))
+	return data, others
+
+####################
+##### PICKLING #####
+####################
+
+def pack(obj):
+	"""
+returns a table representing obj, which can be anything from a parsed tree or
+a whole document. Pickle the table and unpack() it the other side. Lazy links
+get resolved on the way."""
+	classes = []
+	datas = []
+	# triples for tuples and frozen dicts, which have to be built children
+	# first. (row, None, -1) says row is ready to build
+	frozen_links = []
+	links = []
+	rows = {}
+
+	def add_row(obj):
+		n = rows[id(obj)] = len(classes)
+		data, others = shallow(obj)
+		classes.append(type(obj))
+		datas.append(data)
+		return n, data, iter(others)
+
+	# the root is wrapped in a list so it's always a container
+	stack = [add_row([obj]) + ([],)]
+	while stack:
+		n, data, others, row_links = stack[-1]
+		for key, value in others:
+			if not is_container(value):
+				continue
+			data[key] = None
+			target = rows.get(id(value))
+			row_links.extend((n, key, target))
+			if target is None:
+				frame = add_row(value)
+				row_links[-1] = frame[0]
+				stack.append(frame + ([],))
+				break
+		else:
+			stack.pop()
+			if classes[n] in immutable_types:
+				frozen_links.extend(row_links)
+				frozen_links.extend((n, None, -1))
+			else:
+				links.extend(row_links)
+
+	# frozen tags' hashes might not survive a trip to another process
+	for n, cls in enumerate(classes):
+		if cls == FrozenEntity:
+			datas[n]["_hash"] = None
+	return classes, datas, frozen_links, links
+
+def unpack(table):
+	"""the opposite of pack"""
+	classes, datas, frozen_links, links = table
+
+	# empty containers first, so there's something to point at
+	# packed ChunkedLists come back with the default load
+	objs = [None if cls in immutable_types else ChunkedList() if cls == ChunkedList else cls.__new__(cls)
+	        for cls in classes]
+
+	for i in xrange(0, len(frozen_links), 3):
+		n, key, target = frozen_links[i:i+3]
+		if target == -1:
+			objs[n] = tuple(datas[n]) if classes[n] == tuple else FrozenDict(datas[n])
+		else:
+			datas[n][key] = objs[target]
+
+	for i in xrange(0, len(links), 3):
+		n, key, target = links[i:i+3]
+		datas[n][key] = objs[target]
+
+	for cls, data, obj in zip(classes, datas, objs):
+		if cls not in immutable_types:
+			fill(obj, data)
+	return objs[0][0]
+
+def dumps(obj, protocol=cPickle.HIGHEST_PROTOCOL):
+	"""
+pickles obj by way of pack. Plain pickling is about twice as quick, but it
+recurses, so this is for trees too deep for it (cPickle gives up at about
+200 levels of tags). Objects are only kept shared within obj, so pickle
+everything that links to each other in one go."""
+	return cPickle.dumps(pack(obj), protocol)
+
+def loads(data):
+	"""the opposite of dumps"""
+	return unpack(cPickle.loads(data))
+
+###################
+##### COPYING #####
+###################
+
+def shell(obj):
+	if type(obj) == ChunkedList:
+		return ChunkedList((), obj._load)
+	return type(obj).__new__(type(obj))
+
+def fill(obj, data):
+	t = type(obj)
+	if t == ChunkedList:
+		obj.extend(data)
+	elif t in list_types:
+		list.extend(obj, data)
+	elif t in dict_types:
+		dict.update(obj, data)
+	else:
+		obj.__dict__.update(data)
+
+def copy_tree(obj, memo=None):
+	"""
+returns a deep copy of obj, like copy.deepcopy but a lot quicker on big trees.
+Shared objects stay shared in the copy. Frozen tags and dicts are shared rather
+than copied, as they can't change. memo works as it does for copy.deepcopy,
+which is how Entity.__deepcopy__ uses this."""
+	if memo is None:
+		memo = {}
+	if id(obj) in memo:
+		return memo[id(obj)]
+	if not is_copyable(obj):
+		return copy.deepcopy(obj, memo)
+
+	# deepcopy keeps the originals alive, so their ids aren't reused
+	keep = memo.setdefault(id(memo), [])
+	result = memo[id(obj)] = shell(obj)
+	keep.append(obj)
+	root = result
+	stack = [(obj, result)]
+	while stack:
+		obj, result = stack.pop()
+		data, others = shallow(obj)
+		for key, value in others:
+			if id(value) in memo:
+				data[key] = memo[id(value)]
+			elif is_copyable(value):
+				data[key] = memo[id(value)] = shell(value)
+				keep.append(value)
+				stack.append((value, data[key]))
+			else:
+				data[key] = copy.deepcopy(value, memo)
+		fill(result, data)
+	return root
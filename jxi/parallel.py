@@ -0,0 +1,201 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# Encoding big documents on several cores at once.
+#
+# The worker processes are forked with the document already in memory, so it
+# never gets pickled, and ids mean the same thing in every process. Each worker
+# encodes a run of top-level elements (or of the children of one big tag) on its
+# own, and hands back the text and the ids of the containers it wrote out.
+#
+# Something written out in an earlier run should have been a link, so any run
+# which saw one of those is done again. The object's path is worked out by
+# encoding the earlier run it was first written in, and the run is encoded
+# with that already in seen_objects. Nothing under an object can have been
+# written any earlier than the object itself, so the earlier run got the path
+# right even if it was redone too. The result is exactly what dumps would have
+# written in one go.
+
+import sys, StringIO, multiprocessing
+from array import array
+import entity
+from entity import Entity, EncodeTag, list_items, frozen_types
+
+# what's being encoded, for the workers to pick up when they're forked
+job = None
+
+class Job(object):
+	def __init__(self, items, base, depth, leading, trailing, known, options):
+		# the elements and the path of the thing they're in
+		self.items = items
+		self.base = base
+		self.depth = depth
+		# whether runs are separated like tag children or lines of a document
+		self.leading = leading
+		self.trailing = trailing
+		# maps id -> path for what was written before the items, i.e. the tag
+		# they're the children of and its attributes
+		self.known = known
+		self.options = options
+
+	def runs(self, size):
+		return [(start, min(start + size, len(self.items))) for start in xrange(0, len(self.items), size)]
+
+# encodes items[start:stop] of the job with the paths in known already seen.
+# Returns the text, the ids of the containers written out and the paths of
+# those in wanted
+def encode_run(start, stop, known=None, wanted=()):
+	entity.set_options(**job.options)
+	seen = entity.seen_objects = dict((key, (None, path)) for key, path in job.known.items())
+	if known:
+		seen.update((key, (None, path)) for key, path in known.items())
+	before = set(seen)
+	entity.out = out = StringIO.StringIO()
+	leading = entity.separator if job.leading else ""
+	try:
+		for i in xrange(start, stop):
+			if i > 0:
+				out.write(leading)
+			entity.path = job.base + [("[", i)]
+			entity.encode_element(job.items[i], job.depth)
+			out.write(job.trailing)
+		paths = dict((key, seen[key][1]) for key in wanted)
+		ids = array("l", (key for key in seen if key not in before))
+		return out.getvalue(), ids.tostring(), paths
+	finally:
+		entity.seen_objects = dict()
+		entity.encoding_cache = None
+
+def first_pass(run):
+	return encode_run(*run)
+
+# redoes run k, once it's been found to share things with earlier runs. sources
+# maps earlier runs to the ids of what was first written in them
+def second_pass(runs, k, sources):
+	known = {}
+	for j, ids in sources.items():
+		known.update(encode_run(runs[j][0], runs[j][1], None, ids)[2])
+	return encode_run(runs[k][0], runs[k][1], known)[0]
+
+def dumps(elem, buffer=None, processes=None, run_size=None, **options):
+	"""
+encodes elem like entity.dumps, but with a pool of worker processes. The
+top-level elements of a document are shared out between them, or the children
+of the tag if it's a single big one. The text is exactly what entity.dumps
+would give, links and all, and is written to buffer a run at a time, in order.
+Syntax:
+	dumps(elem [, buffer=None, processes=None, run_size=None, <dumps options>])
+processes defaults to the number of cores, and run_size is how many elements
+each worker encodes at a time. This needs fork, so anywhere without it
+(windows) everything's done in this process, as it is for small documents.
+With canonical=True the cache (see EncodingCache) isn't added to by the
+workers."""
+	global job
+	if processes is None:
+		processes = multiprocessing.cpu_count()
+	out = buffer or StringIO.StringIO()
+
+	job, head, tail = make_job(elem, options)
+	if job is None or processes < 2 or len(job.items) < 2 or sys.platform == "win32":
+		job = None
+		entity.dumps(elem, out, **options)
+	else:
+		if run_size is None:
+			# a few runs a worker keeps them all busy till the end
+			run_size = max(1, -(-len(job.items) // (processes * 4)))
+		out.write(head)
+		try:
+			write_runs(out, job.runs(run_size), processes)
+		finally:
+			job = None
+		out.write(tail)
+
+	if not buffer:
+		text = out.getvalue()
+		out.close()
+		return text
+
+# works out how elem should be split up, returning the job, and the text to go
+# before and after what the workers write
+def make_job(elem, options):
+	if isinstance(elem, (list, tuple)):
+		if len(elem) != 1 or not is_big_tag(elem[0], options):
+			return Job(list(elem), [], 0, False, "\n", {}, options), "", ""
+		tag, tail = elem[0], ">\n"
+	elif is_big_tag(elem, options):
+		tag, tail = elem, ">"
+	else:
+		return None, "", ""
+
+	# the tag itself and its attributes are written here, and the workers start
+	# with them already seen
+	entity.set_options(**options)
+	entity.seen_objects = {id(tag): (tag, [("[", 0)])}
+	entity.path = [("[", 0)]
+	entity.out = head = StringIO.StringIO()
+	try:
+		EncodeTag().encode_open(tag, 0)
+		known = dict((key, path) for key, (obj, path) in entity.seen_objects.items())
+	finally:
+		entity.seen_objects = dict()
+		entity.encoding_cache = None
+	head.write(">")
+	items = list(list_items(tag._children))
+	return Job(items, [("[", 0)], 1, True, "", known, options), head.getvalue(), "</%s%s" % (tag._tag_name, tail)
+
+def is_big_tag(elem, options):
+	# frozen tags are written out whole in canonical mode, maybe from a cache
+	return isinstance(elem, Entity) and len(elem._children) > 1 and \
+		not (options.get("canonical") and type(elem) in frozen_types)
+
+def write_runs(out, runs, processes):
+	pool = multiprocessing.Pool(processes)
+	try:
+		# maps id -> the run it was first written out in
+		first_run = {}
+		written = set()
+		pending = []
+		for k, (text, ids, paths) in enumerate(pool.imap(first_pass, runs)):
+			ids = set(array("l", ids))
+			shared = ids & written
+			if shared:
+				sources = {}
+				for key in shared:
+					sources.setdefault(first_run[key], []).append(key)
+				pending.append(pool.apply_async(second_pass, (runs, k, sources)))
+			else:
+				pending.append(text)
+			new = ids - written
+			written |= new
+			first_run.update(dict.fromkeys(new, k))
+
+			# write out as much as is ready, in order
+			while pending and (isinstance(pending[0], str) or pending[0].ready()):
+				done = pending.pop(0)
+				out.write(done if isinstance(done, str) else done.get())
+		for done in pending:
+			out.write(done if isinstance(done, str) else done.get())
+		pool.close()
+	except:
+		pool.terminate()
+		raise
+	finally:
+		pool.join()
@@ -18,17 +18,68 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-import lex
+import sys, threading, functools
+import lex, registry
+from entity import Entity, FrozenDict, NumberText, DecimalText, freeze
+
+# the parser keeps its state in module globals, so only one thread at a time
+# can be using it, whichever front end it comes in through. It's reentrant, as
+# parsing can set off more parsing (see parse_limited and include)
+lock = threading.RLock()
+
+def locked(f):
+	@functools.wraps(f)
+	def call(*args, **kwargs):
+		with lock:
+			return f(*args, **kwargs)
+	return call
 
 ######################
 ##### LINK STUFF #####
 ######################
 
 class SymbolicLink(object):
-	"""an absolute path to some element or attribute in the document"""
-	def __init__(self, args, line):
+	"""
+	an absolute path to some element or attribute in the document. index is
+	where the link starts in the text and lines is a lex.LineIndex for it. The
+	line and char are only worked out if someone asks for them. Links left in
+	the document by parse(text, lazy_links=True) have an evaluator which will
+	resolve them.
+	"""
+	def __init__(self, args, index=None, lines=None):
 		self.args = args
-		self.line = line
+		self.index = index
+		self._lines = lines
+		self._position = None
+		self.evaluator = None
+
+	# works out (line, line start index) and lets go of the text
+	def locate(self):
+		if self._position is None:
+			if self._lines is None:
+				self._position = (None, None)
+			else:
+				self._position = self._lines.position(self.index)
+				self._lines = None
+		return self._position
+
+	@property
+	def line(self):
+		return self.locate()[0]
+
+	@property
+	def char(self):
+		line_start = self.locate()[1]
+		return self.index - line_start + 1 if line_start is not None else None
+
+	# builds an error about this link, saying exactly where it is
+	def error(self, msg):
+		line, line_start = self.locate()
+		return lex.JXIParseError(msg, line_start, self.index, line)
+
+	def limit_error(self, limit, maximum):
+		line, line_start = self.locate()
+		return lex.JXILimitError(limit, maximum, self.index, line_start, line)
 
 class LinkEvaluator(object):
 	"""
@@ -36,6 +87,13 @@ class LinkEvaluator(object):
 	symbolic link, pushes itself to the end of the link evaluation queue. If no 
 	target is found, a JXIParseError is raised.
 	"""
+	# how many times it's been sent to the back of the queue
+	delays = 0
+	# how long a chain of lazy links it can resolve through (see defer_links)
+	max_chain = sys.maxint
+	# the tag class and registry of the parse it came from (see use_tagclasses)
+	tagclasses = (Entity, None)
+
 	def __init__(self, link):
 		self.link = link
 
@@ -50,14 +108,14 @@ class LinkEvaluator(object):
 			### TAG NAME & POSSIBLE INDEX ###
 			if operator == ">":
 				# tag names are only considered for list-like elements
-				if type(target) not in (list, tagclass):
+				if type(target) not in link_list_types and not is_tag(target):
 					msg = "Link not found. Unable to find tag name '%s'. Parent cannot contain tags." % operand
-					raise lex.JXIParseError(msg, lineoverride=self.link.line)
+					raise self.link.error(msg)
 				
 				tagname = operand
 
 				# check if we've been given an index
-				if i < len(args) and args[i+1][0] == "[":
+				if i+1 < len(args) and args[i+1][0] == "[":
 					# search by group index
 					i += 1
 					target_index = args[i][1]
@@ -65,14 +123,14 @@ class LinkEvaluator(object):
 					# tags can only be indexed by integers
 					if type(target_index) != int:
 						msg = "Link not found. Tag indices in symbolic links must be integers!"
-						raise lex.JXIParseError(msg, lineoverride=self.link.line)
+						raise self.link.error(msg)
 
 					count = -1 # we use this to match against the target index
 
 					# iterate over elements in current target
-					for elem in target:
+					for elem in raw_children(target):
 						# only consider eliments with the specified tag name
-						if type(elem) == tagclass and elem._tag_name == tagname:
+						if is_tag(elem) and tag_name(elem) == tagname:
 							count += 1
 							if count == target_index:
 								target = elem
@@ -80,47 +138,54 @@ class LinkEvaluator(object):
 
 					if count != target_index:
 						msg = "Link not found. No tag with name '%s' and group index '%s'" % (tagname,target_index)
-						raise lex.JXIParseError(msg, lineoverride=self.link.line)
+						raise self.link.error(msg)
 
 				else:
 					# just fine the first element with that tag name
-					for elem in target:
-						if type(elem) == tagclass and elem._tag_name == tagname:
+					for elem in raw_children(target):
+						if is_tag(elem) and tag_name(elem) == tagname:
 							target = elem
 							break
+					else:
+						msg = "Link not found. No tag with name '%s'" % tagname
+						raise self.link.error(msg)
 
 			### TAG ATTRIBUTE ###
 			elif operator == ".":
-				if type(target) != tagclass:
+				if not is_tag(target):
 					msg = "Link not found. Non-tag element cannot have attribute '%s'" % operand
+					raise self.link.error(msg)
 				elif not hasattr(target, operand):
 					msg = "Link not found. No attribute '%s'" % operand
-					raise lex.JXIParseError(msg, lineoverride=self.link.line)
+					raise self.link.error(msg)
 
 				target = getattr(target, operand)
 
 			### INDEX OF SOME KIND ###
 			elif operator == "[":
 				# lists and tags can only be indexed by integers
-				if type(target) in (list, tagclass):
+				if type(target) in link_list_types or is_tag(target):
+					if type(target) not in link_list_types and type(target) != tagclass:
+						# registered tag classes are indexed through their children
+						target = tag_children(target)
 					# ensure int
 					if not type(operand) == int:
 						msg = "Link not found. Lists and tags must be indexed by integers"
-						raise lex.JXIParseError(msg, lineoverride=self.link.line)
+						raise self.link.error(msg)
 					# ensure valid index
 					elif operand < 0 or operand >= len(target):
 						msg = "Link not found. Invalid index '%s'" % operand
-						raise lex.JXIParseError(msg, lineoverride=self.link.line)
+						raise self.link.error(msg)
 
 				# only other indexable type is dict
-				elif type(target) == dict:
+				elif type(target) in link_dict_types:
 					# just check that the key exists (can be int, string, ident)
 					if operand not in target:
 						msg = "Link not found. Invalid index '%s'" % operand
-						raise lex.JXIParseError(msg, lineoverride=self.link.line)
+						raise self.link.error(msg)
 				else:
 					msg = "Link not found. Invalid index '%s'. Parent unsubscriptable." % operand
-					raise lex.JXIParseError(msg, lineoverride=self.link.line)
+					raise self.link.error(msg)
 
 				target = target[operand]
 
@@ -140,9 +205,38 @@ class LinkEvaluator(object):
 	def remove(self):
 		scheduled_links.remove(self)
 
+	# resolves a lazy link (see defer_links) right now, following any other
+	# links on the way, and puts the target where the link was
+	@locked
+	def resolve(self):
+		global resolving_links
+		if self.resolving:
+			msg = "Infinite symbolic link cycle detected. What is this i don't even"
+			raise self.link.error(msg)
+		if resolving_links >= self.max_chain:
+			raise self.link.limit_error("link_chain", self.max_chain)
+		self.resolving = True
+		resolving_links += 1
+		# tags are recognised the way they were when the document was parsed
+		previous = use_tagclasses(*self.tagclasses)
+		try:
+			target = self.find_target(self.document)
+			# links in the attributes of registered tag classes have nowhere
+			# to wait, so they're left in place until they're resolved
+			if type(target) == SymbolicLink and target.evaluator is not None:
+				target = target.evaluator.resolve()
+		finally:
+			use_tagclasses(*previous)
+			self.resolving = False
+			resolving_links -= 1
+		self.set_target(target)
+		self.link.evaluator = None
+		return target
+
 	def delay(self):
 		self.remove()
 		scheduled_links.append(self)
+		self.delays += 1
 
 # evaluate a link which was declared in a list-like element
 class ListLinkEvaluator(LinkEvaluator):
@@ -162,7 +256,14 @@ class TagLinkEvaluator(LinkEvaluator):
 		self.attr = attr
 
 	def set_target(self, target):
-		setattr(self.obj, self.attr, target)
+		try:
+			setattr(self.obj, self.attr, target)
+		except AttributeError:
+			msg = "Can't link attribute '%s' of %s" % (self.attr, type(self.obj).__name__)
+			raise self.link.error(msg)
+		lazy = getattr(self.obj, "__dict__", {}).get("_lazy_links")
+		if lazy:
+			lazy.pop(self.attr, None)
 
 # evaluate a link which was declared in a set literal
 class SetLinkEvaluator(LinkEvaluator):
@@ -187,6 +288,230 @@ class DictLinkEvaluator(LinkEvaluator):
 
 # the link evaluation queue
 scheduled_links = []
+# how many lazy links are being resolved one inside another right now, as
+# following one link can mean resolving the links on its way
+resolving_links = 0
+
+# iterates over the elements of a list or tag without resolving any lazy links
+def raw_children(target):
+	children = target if isinstance(target, list) else tag_children(target)
+	return list.__iter__(children) if isinstance(children, list) else iter(children)
+
+# tags are tagclass objects, Entities of any sort (frozen ones can be linked to
+# from outside, see include) or anything built by a registry.TagRegistry
+def is_tag(obj):
+	return type(obj) == tagclass or isinstance(obj, Entity) or type(obj) in tagspecs
+
+def tag_name(obj):
+	if type(obj) == tagclass:
+		return obj._tag_name
+	return registry.tag_name(obj, tagspecs)
+
+def tag_children(obj):
+	if type(obj) == tagclass:
+		return obj._children
+	children = registry.tag_children(obj, tagspecs)
+	return children if children is not None else []
+
+###########################
+##### LAZY CONTAINERS #####
+###########################
+
+# with parse(text, lazy_links=True) or lazy_numbers=True every list and dict
+# in the document is one of these. Links and the text of numbers are left where
+# they are, and resolved the first time they're got at
+
+number_texts = (NumberText, DecimalText)
+
+class LazyList(list):
+	"""a list which resolves any lazy links or numbers in it when they're accessed"""
+	__slots__ = ()
+
+	def __getitem__(self, i):
+		if type(i) == slice:
+			return [self[j] for j in xrange(*i.indices(len(self)))]
+		elem = list.__getitem__(self, i)
+		t = type(elem)
+		if t == SymbolicLink and elem.evaluator is not None:
+			return elem.evaluator.resolve()
+		elif t in number_texts:
+			elem = elem.decode()
+			list.__setitem__(self, i, elem)
+		return elem
+
+	def __getslice__(self, i, j):
+		return self[slice(i, j)]
+
+	def __iter__(self):
+		for i in xrange(len(self)):
+			yield self[i]
+
+	# resolves everything, for the things which look at every item anyway
+	def _resolve(self):
+		for i in xrange(len(self)):
+			self[i]
+		return self
+
+	def __eq__(self, other):
+		return list.__eq__(self._resolve(), other._resolve() if type(other) == LazyList else other)
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __contains__(self, elem):
+		return list.__contains__(self._resolve(), elem)
+
+	def index(self, elem, *args):
+		return list.index(self._resolve(), elem, *args)
+
+	def count(self, elem):
+		return list.count(self._resolve(), elem)
+
+	def remove(self, elem):
+		list.remove(self._resolve(), elem)
+
+	def sort(self, *args, **kwargs):
+		list.sort(self._resolve(), *args, **kwargs)
+
+	def pop(self, i=-1):
+		elem = self[i]
+		list.pop(self, i)
+		return elem
+
+	def __reversed__(self):
+		for i in xrange(len(self) - 1, -1, -1):
+			yield self[i]
+
+	# these make plain lists, like slicing does
+	def __add__(self, other):
+		if not isinstance(other, list):
+			return NotImplemented
+		return list(self) + list(other)
+
+	def __mul__(self, n):
+		return list(self) * n
+
+	__rmul__ = __mul__
+
+	# shows numbers as numbers, without decoding them for good or following links
+	def __repr__(self):
+		return repr([decode_number(elem) for elem in list.__iter__(self)])
+
+	# the items, with links followed but numbers left as they are, for dumps
+	def _written(self):
+		for elem in list.__iter__(self):
+			if type(elem) == SymbolicLink and elem.evaluator is not None:
+				elem = elem.evaluator.resolve()
+			yield elem
+
+	# lists and dicts with __slots__ can't be pickled with protocols 0 and 1
+	# otherwise. Iterating resolves any lazy links
+	def __reduce_ex__(self, protocol):
+		return object.__reduce_ex__(self, 2)
+
+	def __deepcopy__(self, memo):
+		import packing
+		return packing.copy_tree(self, memo)
+
+class LazyDict(dict):
+	"""a dict which resolves any lazy links or numbers in it when they're accessed"""
+	__slots__ = ()
+
+	def __getitem__(self, key):
+		elem = dict.__getitem__(self, key)
+		t = type(elem)
+		if t == SymbolicLink and elem.evaluator is not None:
+			return elem.evaluator.resolve()
+		elif t in number_texts:
+			elem = elem.decode()
+			dict.__setitem__(self, key, elem)
+		return elem
+
+	def _resolve(self):
+		for key in self.iterkeys():
+			self[key]
+		return self
+
+	def __repr__(self):
+		return repr(dict((key, decode_number(elem)) for key, elem in dict.iteritems(self)))
+
+	def _written(self):
+		items = []
+		for key, elem in dict.iteritems(self):
+			if type(elem) == SymbolicLink and elem.evaluator is not None:
+				elem = elem.evaluator.resolve()
+			items.append((key, elem))
+		return items
+
+	def __eq__(self, other):
+		return dict.__eq__(self._resolve(), other._resolve() if type(other) == LazyDict else other)
+
+	def __ne__(self, other):
+		return not self == other
+
+	def get(self, key, default=None):
+		return self[key] if key in self else default
+
+	def pop(self, key, *default):
+		if key not in self:
+			return dict.pop(self, key, *default)
+		elem = self[key]
+		dict.__delitem__(self, key)
+		return elem
+
+	def popitem(self):
+		for key in self.iterkeys():
+			return key, self.pop(key)
+		raise KeyError("popitem(): dictionary is empty")
+
+	def setdefault(self, key, default=None):
+		if key in self:
+			return self[key]
+		self[key] = default
+		return default
+
+	# a plain dict, like dict.copy gives. dict(d) and {}.update(d) copy what's
+	# stored, links and all, as python never asks a dict subclass for its items
+	def copy(self):
+		return dict(self.iteritems())
+
+	def itervalues(self):
+		for key in self.iterkeys():
+			yield self[key]
+
+	def iteritems(self):
+		for key in self.iterkeys():
+			yield key, self[key]
+
+	def values(self):
+		return list(self.itervalues())
+
+	def items(self):
+		return list(self.iteritems())
+
+	# see LazyList
+	def __reduce_ex__(self, protocol):
+		return object.__reduce_ex__(self, 2)
+
+	def __deepcopy__(self, memo):
+		import packing
+		return packing.copy_tree(self, memo)
+
+class HashedList(list):
+	"""a list with room for a digest, for parse(text, hashes=True). See merkle"""
+	__slots__ = ("_digest",)
+
+class HashedDict(dict):
+	"""a dict with room for a digest, for parse(text, hashes=True). See merkle"""
+	__slots__ = ("_digest",)
+
+# what links can index into. Frozen ones come from outside, e.g. frozen includes
+link_list_types = (list, LazyList, HashedList, tuple)
+link_dict_types = (dict, LazyDict, HashedDict, FrozenDict)
+
+# what the parser makes lists and dicts out of
+list_class = list
+dict_class = dict
 
 
 ######################################
@@ -194,38 +519,222 @@ scheduled_links = []
 ######################################
 
 # this is the only publicly visible function
-def parse(text, tagclass=Entity):
+@locked
+def parse(text, tagclass=Entity, frozen=False, buffered=False, lazy_links=False, hashes=False, tagclasses=None,
+          decimals=False, lazy_numbers=False, as_json=None, index=None, limits=None):
 	"""
 this function will parse you some jxi and return a list of all the top-level elements
 in the given text.
 Synatx: 
-	parse(text [, tagclass=Entity])
+	parse(text [, tagclass=Entity, frozen=False, buffered=False, lazy_links=False, hashes=False, tagclasses=None,
+	      decimals=False, lazy_numbers=False, as_json=None, index=None, limits=None])
 text is some string of (hopefully legal) jxi markup
-tagclass can be used if you've implemented you own tag class or extended Entity"""
-	global lexer, scheduled_links
+tagclass can be used if you've implemented you own tag class or extended Entity
+tagclasses picks a class for tags by name instead: a registry.TagRegistry, or a
+dict of tag name -> class. Tags are built straight out of the parsed attributes
+and children, which don't have to go through an Entity first
+frozen=True gives you a tuple of immutable, hashable elements instead (see entity.freeze)
+buffered=True lexes the whole text up front into a lex.TokenBuffer (see parse_tokens)
+lazy_links=True leaves symbolic links unresolved until they're first accessed
+through a tag attribute or by indexing or iterating over a list or dict, so
+links nobody looks at cost nothing. Lists and dicts come back as LazyList and
+LazyDict, and a bad link raises its JXIParseError when it's accessed. Copy a
+LazyDict with d.copy(), as dict(d) takes its links as they are.
+hashes=True gives every tag, list and dict a digest of its contents, for
+merkle.diff. Lists and dicts come back as HashedList and HashedDict, and links
+are resolved up front.
+decimals=True reads floats as decimal.Decimals, so they keep every digit. Ints
+are exact either way.
+lazy_numbers=True leaves the numbers in lists, dicts and tags' children as their
+text (entity.NumberText) until they're first accessed, like lazy_links. Numbers
+which are never looked at are never decoded, and are written back out by dumps
+just as they were. Lists and dicts come back as LazyList and LazyDict. Numbers
+anywhere else are decoded straight away, as are all of them in frozen or hashed
+trees. With buffered=True as well, runs of numbers are lexed in one go, which
+makes documents full of them a lot quicker to parse.
+Texts which are plain JSON are read with the json module's C decoder instead
+(see fastjson), unless lazy_links, lazy_numbers or hashes is on. as_json=None
+tries that for anything starting with '{' or '['. as_json=True tries it whatever
+the text looks like, and as_json=False never does. Either way the result is the
+same, and anything that turns out not to be JSON is parsed as jxi.
+index is an attrindex.AttrIndex to add the parsed tags to. They come back as
+attrindex.IndexedEntities, which keep the index up to date as they change.
+limits is a lex.Limits, for text you don't trust (lex.untrusted is a good
+start). Going over one raises a lex.JXILimitError. The limits are enforced by
+the lexer and the streaming parser, so buffered and as_json are ignored."""
+	global lexer, scheduled_links, list_class, dict_class, numbers_deferred
+	check_options(frozen, hashes, tagclasses)
+	if index is not None:
+		if frozen or hashes or tagclasses or tagclass is not Entity:
+			raise ValueError("only plain Entity trees can be indexed")
+		from attrindex import IndexedEntity
+		result = parse(text, IndexedEntity, buffered=buffered, lazy_links=lazy_links,
+		               decimals=decimals, lazy_numbers=lazy_numbers, as_json=as_json, limits=limits)
+		index.add(result)
+		return result
+	if limits is not None:
+		return parse_limited(text, limits, tagclass, frozen, lazy_links, hashes, tagclasses, decimals, lazy_numbers)
+	lazy = lazy_links and not frozen and not hashes
+	lazy_numbers = lazy_numbers and not frozen and not hashes
+	if as_json is not False and not (lazy or lazy_numbers or hashes):
+		import fastjson
+		if as_json or fastjson.looks_like_json(text):
+			result = fastjson.loads(text, decimals)
+			if result is not None:
+				return freeze(result) if frozen else result
+	if buffered:
+		tokens = lex.TokenBuffer(text, decimals, lazy_numbers)
+		return parse_tokens(tokens, tagclass, frozen, lazy, hashes, tagclasses)
 	scheduled_links = []
-	lexer = lex.lex(text)
-	next()
-	result = parse_file()
+	lexer = lex.lex(text, decimals=decimals, lazy_numbers=lazy_numbers, limits=budget)
+	numbers_deferred = lazy_numbers
+	if lazy or lazy_numbers:
+		list_class, dict_class = LazyList, LazyDict
+	elif hashes:
+		list_class, dict_class = HashedList, HashedDict
+	previous = use_tagclasses(tagclass, tagclasses)
+	try:
+		next()
+		result = parse_file()
+		if hashes:
+			import merkle
+			merkle.seal(result)
+		if lazy:
+			defer_links(result)
+			return result
+		resolve_links(result)
+	finally:
+		list_class, dict_class = list, dict
+		numbers_deferred = False
+		use_tagclasses(*previous)
+	if frozen:
+		return freeze(result)
+	return result
 
+# parses with the limits in force. They're kept in module globals like the rest
+# of the parser's state, and put back to no limits at all afterwards
+def parse_limited(text, limits, tagclass, frozen, lazy_links, hashes, tagclasses, decimals, lazy_numbers):
+	global budget, depth, max_depth, max_chain
+	budget = limits.start()
+	depth = 0
+	max_depth = limits.depth if limits.depth is not None else sys.maxint
+	max_chain = limits.link_chain if limits.link_chain is not None else sys.maxint
+	try:
+		return parse(text, tagclass, frozen, False, lazy_links, hashes, tagclasses, decimals, lazy_numbers, False)
+	except RuntimeError, e:
+		# python's own recursion limit got there first
+		if "recursion" not in str(e):
+			raise
+		# reported against the configured limit, or if there isn't one, the
+		# depth python could manage
+		raise lex.JXILimitError("depth", limits.depth if limits.depth is not None else depth)
+	finally:
+		budget = None
+		depth = 0
+		max_depth = max_chain = sys.maxint
+
+# numbers where nothing would decode them later on (attributes, dict keys and
+# link indices) are decoded as soon as they're parsed
+def decode_number(value):
+	return value.decode() if type(value) in number_texts else value
+
+def decode_attrs(attrs):
+	for name, value in attrs.items():
+		if type(value) in number_texts:
+			attrs[name] = value.decode()
+
+def check_options(frozen, hashes, tagclasses):
+	if hashes and frozen:
+		raise ValueError("frozen trees can't carry digests")
+	if tagclasses and (frozen or hashes):
+		raise ValueError("registered tag classes can't be frozen or carry digests")
+
+# sets the tag classes the parser builds, returning the old ones
+def use_tagclasses(cls, tagclasses):
+	global tagclass, tag_registry, tagbuilders, tagspecs
+	previous = tagclass, tag_registry
+	tagclass = cls
+	tag_registry = registry.registry(tagclasses) if tagclasses else None
+	tagbuilders = tag_registry.builders if tag_registry else {}
+	tagspecs = tag_registry.specs if tag_registry else {}
+	return previous
+
+# builds a tag with a registered class, turning complaints about the attributes
+# or children it's been given into parse errors
+def build_tag(build, name, attrs, children, index=None, lines=None):
+	try:
+		return build(name, attrs, children)
+	except (TypeError, AttributeError, ValueError), e:
+		msg = "Can't build tag '%s': %s" % (name, e)
+		if lines is None:
+			raise lex.JXIParseError(msg)
+		line, line_start = lines.position(index)
+		raise lex.JXIParseError(msg, line_start, index, lineoverride=line)
+
+# evaluates everything in the link queue against the parsed document
+def resolve_links(document):
 	# in the worst case, only one link gets evaluated per iteration, so we
 	# have n*(n+1)/2 possible evaluations. set safety counter to (n*(n+1)/2) + 1
 	# so that we can tell for definites if an infinite loop has been encountered
 	safety_counter = (len(scheduled_links)*(len(scheduled_links) + 1))//2 + 1
+	countdown = budget.tick() if budget is not None else -1
 	while len(scheduled_links) > 0 and safety_counter > 0:
-		scheduled_links[0].evaluate(result)
+		evaluator = scheduled_links[0]
+		evaluator.evaluate(document)
 		safety_counter -= 1
+		if evaluator.delays > max_chain:
+			raise evaluator.link.limit_error("link_chain", max_chain)
+		countdown -= 1
+		if countdown == 0:
+			countdown = budget.tick()
 
 	if safety_counter == 0:
 		msg = "Infinite symbolic link cycle detected. What is this i don't even"
-		raise lex.JXIParseError(msg, lineoverride=scheduled_links[0].link.line)
-
-	return result
+		raise scheduled_links[0].link.error(msg)
+
+# hands the links in the queue to the links themselves, to be resolved when
+# they're first accessed. Links in tag attributes are moved out of the way
+# into _lazy_links, where Entity.__getattr__ looks for them. Other tag classes
+# have no way of doing that, so links in their attributes are resolved now
+def defer_links(document):
+	global scheduled_links
+	eager = []
+	for evaluator in scheduled_links:
+		evaluator.document = document
+		evaluator.tagclasses = (tagclass, tag_registry)
+		evaluator.resolving = False
+		if max_chain != sys.maxint:
+			evaluator.max_chain = max_chain
+		evaluator.link.evaluator = evaluator
+		if type(evaluator) == TagLinkEvaluator:
+			obj = evaluator.obj
+			if not isinstance(obj, Entity):
+				eager.append(evaluator)
+				continue
+			delattr(obj, evaluator.attr)
+			obj.__dict__.setdefault("_lazy_links", {})[evaluator.attr] = evaluator
+	scheduled_links = []
+	for evaluator in eager:
+		if evaluator.link.evaluator is not None:
+			evaluator.resolve()
 
 
 token = None
 lexer = None
 tagclass = Entity
+# whether the lexer's leaving numbers as text, for parse(text, lazy_numbers=True)
+numbers_deferred = False
+# the registry.TagRegistry in use, its tag name -> function building tags of
+# that name, and its class -> registry.TagSpec
+tag_registry = None
+tagbuilders = {}
+tagspecs = {}
+# the lex.Budget of a parse with limits, how deeply nested the parser is, and
+# the limits on that and on chains of links (see parse_limited)
+budget = None
+depth = 0
+max_depth = sys.maxint
+max_chain = sys.maxint
 
 # retrieves the next token from the lexer
 def next():
@@ -243,7 +752,7 @@ def recognise(type, sym):
 
 # used at the top level of the document
 def parse_file():
-	elems = []
+	elems = list_class()
 	while not token[0] == "EOF":
 		elem = parse_element()
 		elems.append(elem)
@@ -260,8 +769,12 @@ def parse_element():
 		return parse_attribute()
 
 def parse_tag():
+	global depth
+	depth += 1
+	if depth > max_depth:
+		raise lex.JXILimitError("depth", max_depth)
 	attrs = {}
-	children = []
+	children = list_class()
 
 	# require tag name
 	if not token[0] == "ident":
@@ -306,7 +819,18 @@ def parse_tag():
 		recognise("ident", name)
 		recognise("sym", ">")
 
-	return tagclass(name, attrs, children)
+	if numbers_deferred:
+		decode_attrs(attrs)
+	build = tagbuilders.get(name)
+	if build is None:
+		tag = tagclass(name, attrs, children)
+	else:
+		tag = build_tag(build, name, attrs, children)
+	for attrname, elem in attrs.items():
+		if type(elem) == SymbolicLink:
+			scheduled_links.append(TagLinkEvaluator(elem, tag, attrname))
+	depth -= 1
+	return tag
 
 
 def parse_attribute():
@@ -326,7 +850,11 @@ def parse_attribute():
 		raise lex.JXIParseError("expecting attribute literal, got '%s'" % token[1])
 
 def parse_list():
-	thelist = []
+	global depth
+	depth += 1
+	if depth > max_depth:
+		raise lex.JXILimitError("depth", max_depth)
+	thelist = list_class()
 	recognise("sym","[")
 	while token != ("sym", "]"):
 		elem = parse_element()
@@ -334,14 +862,19 @@ def parse_list():
 		if type(elem) == SymbolicLink:
 			scheduled_links.append(ListLinkEvaluator(elem, thelist, len(thelist)-1))
 	recognise("sym", "]")
+	depth -= 1
 	return thelist
 
 def parse_dict():
-	thedict = {}
+	global depth
+	depth += 1
+	if depth > max_depth:
+		raise lex.JXILimitError("depth", max_depth)
+	thedict = dict_class()
 	recognise("sym","{")
 	while token != ("sym", "}"):
 		if token[0] in ("string", "rawstring", "int", "ident"):
-			name = token[1]
+			name = decode_number(token[1])
 			next()
 			recognise("sym", ":")
 			elem = parse_element()
@@ -351,6 +884,7 @@ def parse_dict():
 		else:
 			raise lex.JXIParseError("expecting attribute literal")
 	recognise("sym","}")
+	depth -= 1
 	return thedict
 
 def parse_set():
@@ -364,8 +898,8 @@ def parse_set():
 	recognise("sym", "(")
 
 def parse_link():
+	index = lex.token_start
 	recognise("sym", "@")
-	line = lex.line
 
 	if token[0] != "sym" or token[1] not in (">", "["):
 		raise lex.JXIParseError("Bad symbolic link syntax. Expecting ':' or index")
@@ -394,12 +928,236 @@ def parse_link():
 			next()
 			if token[0] not in ("ident", "int", "string", "rawstring"): 
 				raise lex.JXIParseError("'.' should be followed by an attribute name")
-			link.append(("[", token[1]))
+			link.append(("[", decode_number(token[1])))
 			next()
 			recognise("sym", "]")
 
 	recognise("sym", ";")
+	if budget is not None:
+		budget.link(index)
+
+	return SymbolicLink(link, index, lex.line_index)
+
+#############################
+### TOKEN BUFFER PARSING ####
+#############################
+
+def parse_tokens(tokens, tagclass=Entity, frozen=False, lazy_links=False, hashes=False, tagclasses=None):
+	"""
+parses a lex.TokenBuffer, giving the same result as parse would for its text.
+Syntax:
+	parse_tokens(tokens [, tagclass=Entity, frozen=False, lazy_links=False, hashes=False, tagclasses=None])
+Tokens are read straight out of the buffer's arrays by index, so there are no
+tuples to build or compare. Each bit of the parser takes the index to start at
+and returns the value it read along with the index after it, which makes
+looking ahead or going back just a matter of using a different index. Numbers
+are left as text if tokens was made with lazy_numbers=True (see parse)."""
+	global scheduled_links
+	scheduled_links = []
+	links = scheduled_links
+
+	kinds = tokens.kinds
+	values = tokens.values
+	check_options(frozen, hashes, tagclasses)
+	lazy_numbers = tokens.lazy_numbers
+	if lazy_numbers and (frozen or hashes):
+		raise ValueError("frozen and hashed trees can't have lazy numbers")
+	builders = registry.registry(tagclasses).builders if tagclasses else {}
+	lazy = lazy_links and not frozen and not hashes
+	list_class = LazyList if lazy or lazy_numbers else HashedList if hashes else list
+	dict_class = LazyDict if lazy or lazy_numbers else HashedDict if hashes else dict
+
+	# local copies of the kinds, for speed
+	EOF, NULL, INT, STRING, RAWSTRING, IDENT = lex.EOF, lex.NULL, lex.INT, lex.STRING, lex.RAWSTRING, lex.IDENT
+	LT, GT, LBRACKET, RBRACKET, LBRACE, RBRACE = lex.LT, lex.GT, lex.LBRACKET, lex.RBRACKET, lex.LBRACE, lex.RBRACE
+	COLON, SLASH, EQUALS, AT, DOT, SEMICOLON = lex.COLON, lex.SLASH, lex.EQUALS, lex.AT, lex.DOT, lex.SEMICOLON
+	NUMBERS = lex.NUMBERS
+	key_kinds = (STRING, RAWSTRING, INT, IDENT)
+
+	def error(msg, i):
+		line, line_start = tokens.position(i)
+		return lex.JXIParseError(msg, line_start, tokens.starts[i], lineoverride=line)
+
+	def got(i):
+		return tokens.token(i)[1]
+
+	def expect(i, kind, sym):
+		if kinds[i] != kind:
+			raise error("expecting '%s', got '%s'" % (sym, got(i)), i)
+		return i + 1
+
+	def element(i):
+		if kinds[i] == LT:
+			return tag(i + 1)
+		return attribute(i)
+
+	def tag(i):
+		if kinds[i] != IDENT:
+			raise error("expecting tag name, got '%s'" % got(i), i)
+		name = values[i]
+		start = i
+		i += 1
+		attrs = {}
+
+		# optional value for tag name
+		if kinds[i] == EQUALS:
+			attrs[name], i = element(i + 1)
+
+		# get proper attributes
+		while kinds[i] == IDENT:
+			attrname = values[i]
+			i = expect(i + 1, EQUALS, "=")
+			if NULL <= kinds[i] <= RAWSTRING:
+				attrs[attrname] = values[i]
+				i += 1
+			else:
+				attrs[attrname], i = element(i)
 
-	return SymbolicLink(link, line)
+		children = list_class()
+		# check whether childless tag
+		if kinds[i] == SLASH:
+			i = expect(i + 1, GT, ">")
+		else:
+			i = expect(i, GT, ">")
+			while True:
+				kind = kinds[i]
+				if NULL <= kind <= RAWSTRING:
+					children.append(values[i])
+					i += 1
+				elif kind == LT:
+					# a closing tag is '<' followed by '/'
+					if kinds[i+1] == SLASH:
+						break
+					child, i = tag(i + 1)
+					children.append(child)
+				elif kind == NUMBERS:
+					children.extend(values[i])
+					i += 1
+				else:
+					elem, i = attribute(i)
+					children.append(elem)
+					if type(elem) == SymbolicLink:
+						links.append(ListLinkEvaluator(elem, children, len(children)-1))
+
+			i += 2
+			if kinds[i] != IDENT or values[i] != name:
+				raise error("expecting '%s', got '%s'" % (name, got(i)), i)
+			i = expect(i + 1, GT, ">")
+
+		if lazy_numbers:
+			decode_attrs(attrs)
+		build = builders.get(name)
+		if build is None:
+			node = tagclass(name, attrs, children)
+		else:
+			node = build_tag(build, name, attrs, children, tokens.starts[start], tokens.lines)
+		for attrname, elem in attrs.items():
+			if type(elem) == SymbolicLink:
+				links.append(TagLinkEvaluator(elem, node, attrname))
+		return node, i
+
+	def attribute(i):
+		kind = kinds[i]
+		if NULL <= kind <= RAWSTRING:
+			return values[i], i + 1
+		elif kind == LBRACKET:
+			return list_(i + 1)
+		elif kind == LBRACE:
+			return dict_(i + 1)
+		elif kind == AT:
+			return link(i)
+		raise error("expecting attribute literal, got '%s'" % got(i), i)
+
+	def list_(i):
+		thelist = list_class()
+		while True:
+			kind = kinds[i]
+			if NULL <= kind <= RAWSTRING:
+				thelist.append(values[i])
+				i += 1
+			elif kind == RBRACKET:
+				return thelist, i + 1
+			elif kind == NUMBERS:
+				thelist.extend(values[i])
+				i += 1
+			else:
+				elem, i = element(i)
+				thelist.append(elem)
+				if type(elem) == SymbolicLink:
+					links.append(ListLinkEvaluator(elem, thelist, len(thelist)-1))
+
+	def dict_(i):
+		thedict = dict_class()
+		while kinds[i] != RBRACE:
+			if kinds[i] not in key_kinds:
+				raise error("expecting attribute literal", i)
+			name = values[i]
+			if kinds[i] == INT:
+				name = decode_number(name)
+			i = expect(i + 1, COLON, ":")
+			if NULL <= kinds[i] <= RAWSTRING:
+				thedict[name] = values[i]
+				i += 1
+				continue
+			elem, i = element(i)
+			thedict[name] = elem
+			if type(elem) == SymbolicLink:
+				links.append(DictLinkEvaluator(elem, thedict, name))
+		return thedict, i + 1
+
+	def link(i):
+		index = tokens.starts[i]
+		i += 1
+		if kinds[i] != GT and kinds[i] != LBRACKET:
+			raise error("Bad symbolic link syntax. Expecting ':' or index", i)
+
+		args = []
+		while True:
+			kind = kinds[i]
+			if kind == GT or kind == DOT:
+				# tag name or tag attribute
+				if kinds[i+1] != IDENT:
+					if kind == GT:
+						raise error("'>' should be followed by a tag name", i + 1)
+					raise error("'.' should be followed by an attribute name", i + 1)
+				args.append((">" if kind == GT else ".", values[i+1]))
+				i += 2
+			elif kind == LBRACKET:
+				# index of something
+				if kinds[i+1] not in key_kinds:
+					raise error("'[' should be followed by an index", i + 1)
+				args.append(("[", decode_number(values[i+1])))
+				i = expect(i + 2, RBRACKET, "]")
+			else:
+				break
 
-print parse("`Bananas on parade bitch yeah!!`")
\ No newline at end of file
+		i = expect(i, SEMICOLON, ";")
+		return SymbolicLink(args, index, tokens.lines), i
+
+	elems = list_class()
+	i = 0
+	while kinds[i] != EOF:
+		if kinds[i] == NUMBERS:
+			elems.extend(values[i])
+			i += 1
+			continue
+		elem, i = element(i)
+		elems.append(elem)
+		if type(elem) == SymbolicLink:
+			links.append(ListLinkEvaluator(elem, elems, len(elems)-1))
+
+	if hashes:
+		import merkle
+		merkle.seal(elems)
+	# links look for tags by class
+	previous = use_tagclasses(tagclass, tagclasses)
+	try:
+		if lazy:
+			defer_links(elems)
+			return elems
+		resolve_links(elems)
+	finally:
+		use_tagclasses(*previous)
+	if frozen:
+		return freeze(elems)
+	return elems
@@ -0,0 +1,159 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+# Tags can be built as classes of your own instead of Entity, chosen by tag
+# name. The parser hands each tag's attributes and children straight to the
+# class, so there's no Entity to build and convert afterwards.
+
+from entity import Entity
+
+class TagSpec(object):
+	def __init__(self, name, cls, children, build):
+		self.name = name
+		self.cls = cls
+		self.children = children
+		self.build = build
+
+def entity_builder(cls):
+	def build(name, attrs, children):
+		return cls(name, attrs, children)
+	return build
+
+def tuple_builder(cls, children_field):
+	fields = cls._fields
+	known = set(fields)
+	def build(name, attrs, children):
+		for attr in attrs:
+			if attr not in known:
+				raise TypeError("%s has no field '%s'" % (cls.__name__, attr))
+		if children and children_field not in known:
+			raise TypeError("%s can't have children" % cls.__name__)
+		return cls(*[children if field == children_field else attrs.get(field) for field in fields])
+	return build
+
+def slots_builder(cls, children_field):
+	def build(name, attrs, children):
+		obj = cls.__new__(cls)
+		for attr, value in attrs.iteritems():
+			setattr(obj, attr, value)
+		if children_field is not None:
+			setattr(obj, children_field, children)
+		elif children:
+			raise TypeError("%s can't have children" % cls.__name__)
+		return obj
+	return build
+
+def keyword_builder(cls, children_field):
+	def build(name, attrs, children):
+		if children_field is not None:
+			attrs = dict(attrs)
+			attrs[children_field] = children
+		elif children:
+			raise TypeError("%s can't have children" % cls.__name__)
+		return cls(**attrs)
+	return build
+
+class TagRegistry(object):
+	"""
+says which class to build tags as, by tag name, for parse(text, tagclasses=...).
+Tags whose names aren't registered are built with parse's tagclass as usual.
+Syntax:
+	TagRegistry([classes])
+	registry.register(name, cls [, children="children", build=None])
+classes is a dict of tag name -> class, registered with the defaults.
+How a tag gets built depends on cls:
+	Entity subclasses       cls(name, attrs, children)
+	named tuples            cls(<field>...), with each field taken from the
+	                        attribute of the same name (None if missing)
+	classes with no         made without calling __init__, then each
+	__init__ (e.g. ones     attribute is set with setattr
+	with __slots__)
+	anything else           cls(**attrs)
+children is the field, attribute or keyword argument the list of children goes
+in. With children=None the tag may not have any. Or give build, a function
+taking (name, attrs, children), to do it your own way. Tags which can't be built
+(say, because of an attribute with no field to go in) raise a JXIParseError.
+A class can only be registered under one name in each registry, as that's how
+links find the name of a tag it built. Links can reach into registered tags
+through their attributes and children,
+but links in their attributes can only be filled in if they can be set after
+construction, which rules out named tuples."""
+	def __init__(self, classes=None):
+		self.builders = {}
+		# what's known about each registered class, by class, for links to
+		# find tag names and children with
+		self.specs = {}
+		for name, cls in (classes or {}).items():
+			self.register(name, cls)
+
+	def register(self, name, cls, children="children", build=None):
+		if build is None:
+			if issubclass(cls, Entity):
+				build = entity_builder(cls)
+				children = "_children"
+			elif issubclass(cls, tuple) and hasattr(cls, "_fields"):
+				build = tuple_builder(cls, children)
+			elif cls.__init__ is object.__init__:
+				build = slots_builder(cls, children)
+			else:
+				build = keyword_builder(cls, children)
+		# a tag built by the class has to say which name it had
+		spec = self.specs.get(cls)
+		if spec is not None and spec.name != name:
+			raise ValueError("%s is already registered as '%s'" % (cls.__name__, spec.name))
+		for other in [c for c, spec in self.specs.items() if spec.name == name]:
+			del self.specs[other]
+		self.specs[cls] = TagSpec(name, cls, children, build)
+		self.builders[name] = build
+
+	def __contains__(self, name):
+		return name in self.builders
+
+def registry(tagclasses):
+	"""returns tagclasses as a TagRegistry, which it might be already"""
+	if tagclasses is None or isinstance(tagclasses, TagRegistry):
+		return tagclasses
+	return TagRegistry(tagclasses)
+
+#################################
+##### LOOKING AT TAGS LATER #####
+#################################
+
+# specs are the TagRegistry.specs of the registry obj was built by
+
+def is_tag(obj, specs):
+	return isinstance(obj, Entity) or type(obj) in specs
+
+def tag_name(obj, specs):
+	"""returns obj's tag name, or None if it isn't a tag"""
+	if isinstance(obj, Entity):
+		return obj._tag_name
+	spec = specs.get(type(obj))
+	return spec.name if spec is not None else None
+
+def tag_children(obj, specs):
+	"""returns the list of obj's children, or None if it can't have any"""
+	if isinstance(obj, Entity):
+		return obj._children
+	spec = specs.get(type(obj))
+	if spec is None or spec.children is None:
+		return None
+	return getattr(obj, spec.children, None)
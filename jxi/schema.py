@@ -0,0 +1,305 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import lex, parse
+from entity import Entity, RawString
+
+class JXISchemaError(lex.JXIParseError):
+	"""raised when a document is well-formed jxi but doesn't fit the schema"""
+	pass
+
+# use this in a type spec to accept any value at all
+ANY = object
+
+# which tokens satisfy which python types
+scalar_token_types = {
+	int: ("int",),
+	float: ("float",),
+	str: ("string", "rawstring"),
+	RawString: ("rawstring",),
+	bool: ("bool",),
+	None: ("null",)
+}
+
+type_names = {
+	int: "int",
+	float: "float",
+	str: "string",
+	RawString: "raw string",
+	bool: "bool",
+	None: "null",
+	list: "list",
+	dict: "dict",
+	ANY: "anything"
+}
+
+LT = ("sym", "<")
+SLASH = ("sym", "/")
+EQUALS = ("sym", "=")
+GT = ("sym", ">")
+
+##########################
+#### SCHEMA OBJECTS ######
+##########################
+
+class Tag(object):
+	"""
+describes one kind of tag.
+Syntax:
+	Tag(name [, attrs={}, required=(), children=(), content=()])
+attrs maps attribute names to type specs. A type spec is one of int, float,
+str, RawString, bool, None (for null), list, dict or ANY, or a tuple of those
+meaning any one of them. The value given with the tag name (as in <a=5>) is
+checked against attrs[name].
+required lists the attributes that must be present.
+children lists the tag names allowed as child tags.
+content is the type spec for non-tag children. The default () allows none.
+Symbolic links are accepted wherever a value is, and aren't type checked."""
+	def __init__(self, name, attrs={}, required=(), children=(), content=()):
+		self.name = name
+		self.attrs = dict(attrs)
+		self.required = frozenset(required)
+		self.children = tuple(children)
+		self.content = content
+
+		for attr in self.required:
+			if attr not in self.attrs:
+				raise ValueError("required attribute '%s' of <%s> has no type" % (attr, name))
+
+class Schema(object):
+	"""
+a set of Tags describing a whole document.
+Syntax:
+	Schema(tags [, root=None, content=()])
+root lists the tag names allowed at the top level, defaulting to all of them.
+content is the type spec for top-level non-tag elements."""
+	def __init__(self, tags, root=None, content=()):
+		self.tags = dict((tag.name, tag) for tag in tags)
+		self.root = tuple(root) if root is not None else tuple(self.tags)
+		self.content = content
+
+		for tag in self.tags.values():
+			for child in tag.children:
+				if child not in self.tags:
+					raise ValueError("<%s> allows undeclared child tag <%s>" % (tag.name, child))
+		for name in self.root:
+			if name not in self.tags:
+				raise ValueError("undeclared root tag <%s>" % name)
+
+	def compile(self, tagclass=Entity):
+		"""returns a CompiledParser for documents matching this schema"""
+		return CompiledParser(self, tagclass)
+
+##########################
+#### COMPILATION BITS ####
+##########################
+
+# builds a function which reads one value off the token stream, making sure it
+# matches the given type spec
+def value_reader(spec, what):
+	specs = spec if type(spec) == tuple else (spec,)
+	scalars = set()
+	compound = {"@": parse.parse_link}
+	for s in specs:
+		if s is ANY:
+			for types in scalar_token_types.values():
+				scalars.update(types)
+			compound["["] = parse.parse_list
+			compound["{"] = parse.parse_dict
+			compound["<"] = parse.parse_element
+		elif s is list:
+			compound["["] = parse.parse_list
+		elif s is dict:
+			compound["{"] = parse.parse_dict
+		elif s in scalar_token_types:
+			scalars.update(scalar_token_types[s])
+		else:
+			raise TypeError("unsupported type in schema: %s" % repr(s))
+
+	expected = " or ".join(type_names[s] for s in specs)
+
+	def read():
+		token = parse.token
+		if token[0] in scalars:
+			parse.next()
+			return token[1]
+		elif token[0] == "sym" and token[1] in compound:
+			return compound[token[1]]()
+		else:
+			raise JXISchemaError("%s should be %s, got '%s'" % (what, expected, token[1]))
+
+	return read
+
+# builds the parser function for a single kind of tag. child_parsers gets
+# filled in later on, once every tag has been compiled
+def tag_parser(tag, child_parsers, tagclass):
+	name = tag.name
+	readers = {}
+	for attr, spec in tag.attrs.items():
+		readers[attr] = value_reader(spec, "attribute '%s' of <%s>" % (attr, name))
+	required = tag.required
+	end_name = ("ident", name)
+	read_content = value_reader(tag.content, "content of <%s>" % name) if tag.content != () else None
+
+	# skip the generic attribute loop in Entity.__init__ if we can
+	fast_init = tagclass.__init__ == Entity.__init__
+
+	SymbolicLink = parse.SymbolicLink
+	next = parse.next
+	# recognise is only called on a mismatch, to raise the usual error
+	recognise = parse.recognise
+
+	def parse_tag():
+		# the tag name has been checked by whoever called us
+		next()
+		attrs = {}
+		links = []
+
+		# optional value for tag name
+		if parse.token == EQUALS:
+			if name not in readers:
+				raise JXISchemaError("<%s> can't have a value" % name)
+			next()
+			attrs[name] = readers[name]()
+
+		# get proper attributes
+		while parse.token[0] == "ident":
+			attrname = parse.token[1]
+			if attrname not in readers:
+				raise JXISchemaError("<%s> has no attribute '%s'" % (name, attrname))
+			next()
+			if parse.token != EQUALS:
+				recognise("sym", "=")
+			next()
+			attrs[attrname] = readers[attrname]()
+			if type(attrs[attrname]) == SymbolicLink:
+				links.append(attrname)
+
+		if required and not required.issubset(attrs):
+			missing = ", ".join(sorted(required.difference(attrs)))
+			raise JXISchemaError("<%s> is missing required attributes: %s" % (name, missing))
+
+		children = []
+
+		# check whether childless tag
+		if parse.token == SLASH:
+			next()
+			recognise("sym", ">")
+		else:
+			# if not, get children
+			if parse.token != GT:
+				recognise("sym", ">")
+			next()
+
+			while True:
+				if parse.token == LT:
+					next()
+					if parse.token == SLASH:
+						break
+					child = child_parsers.get(parse.token[1]) if parse.token[0] == "ident" else None
+					if child is None:
+						raise JXISchemaError("<%s> not allowed in <%s>" % (parse.token[1], name))
+					children.append(child())
+				elif read_content is None:
+					raise JXISchemaError("<%s> can only contain tags, got '%s'" % (name, parse.token[1]))
+				else:
+					elem = read_content()
+					children.append(elem)
+					if type(elem) == SymbolicLink:
+						parse.scheduled_links.append(parse.ListLinkEvaluator(elem, children, len(children)-1))
+
+			next()
+			if parse.token != end_name:
+				recognise("ident", name)
+			next()
+			recognise("sym", ">")
+
+		if fast_init:
+			node = tagclass.__new__(tagclass)
+			node.__dict__.update(attrs)
+			node._children = children
+			node._tag_name = name
+			node._parent = None
+		else:
+			node = tagclass(name, attrs, children)
+
+		for attrname in links:
+			parse.scheduled_links.append(parse.TagLinkEvaluator(attrs[attrname], node, attrname))
+
+		return node
+
+	return parse_tag
+
+class CompiledParser(object):
+	"""
+a parser specialised for one schema. Made by Schema.compile. Documents are
+validated as they are read, and JXISchemaError is raised at the first thing
+that doesn't fit. Tags inside list, dict or ANY values aren't validated."""
+	def __init__(self, schema, tagclass=Entity):
+		self.schema = schema
+		self.tagclass = tagclass
+
+		parsers = {}
+		child_parsers = {}
+		for tag in schema.tags.values():
+			child_parsers[tag.name] = {}
+			parsers[tag.name] = tag_parser(tag, child_parsers[tag.name], tagclass)
+
+		# now that everything exists, wire up the children
+		for tag in schema.tags.values():
+			for child in tag.children:
+				child_parsers[tag.name][child] = parsers[child]
+
+		self.root_parsers = dict((name, parsers[name]) for name in schema.root)
+		if schema.content != ():
+			self.read_content = value_reader(schema.content, "top-level element")
+		else:
+			self.read_content = None
+
+	@parse.locked
+	def parse(self, text):
+		"""parses and validates text, returning a list of the top-level elements"""
+		previous_tagclass = parse.tagclass
+		parse.tagclass = self.tagclass
+		try:
+			parse.scheduled_links = []
+			parse.lexer = lex.lex(text)
+			parse.next()
+
+			elems = []
+			while parse.token[0] != "EOF":
+				if parse.token == LT:
+					parse.next()
+					root = self.root_parsers.get(parse.token[1]) if parse.token[0] == "ident" else None
+					if root is None:
+						raise JXISchemaError("<%s> not allowed at the top level" % parse.token[1])
+					elems.append(root())
+				elif self.read_content is None:
+					raise JXISchemaError("only tags are allowed at the top level, got '%s'" % parse.token[1])
+				else:
+					elem = self.read_content()
+					elems.append(elem)
+					if type(elem) == parse.SymbolicLink:
+						parse.scheduled_links.append(parse.ListLinkEvaluator(elem, elems, len(elems)-1))
+
+			parse.resolve_links(elems)
+			return elems
+		finally:
+			parse.tagclass = previous_tagclass
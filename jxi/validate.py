@@ -0,0 +1,627 @@
+# Copyright (C) 2012 David Sheldrick
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+# THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import lex
+from collections import deque
+
+# this is the only publicly visible function
+def validate(text):
+	"""
+checks that text is well-formed jxi and that all of its symbolic links resolve,
+without building the document. Returns a list of JXIParseErrors, one for each
+problem found, in order of position. An empty list means the text is valid.
+Syntax errors are recovered from by skipping to the next closing tag that
+matches an open one (or the next tag, at the top level), and lexical errors by
+skipping to the next line. Links are only checked if there are no other errors."""
+	# well-formed documents are the common case, so try the fast scanner first
+	# and only bother recovering from errors if it finds any
+	scanned = scan(text)
+	if scanned is not None:
+		errors = check_links(text, *scanned)
+	else:
+		validator = Validator(text)
+		root = validator.validate_file()
+		errors = validator.errors
+		if not errors:
+			errors = check_links(text, root, validator.links)
+	errors.sort(key=lambda e: (e.line, e.char))
+	return errors
+
+def error_at(text, msg, index):
+	line, line_start_char = lex.position(text, index)
+	return lex.JXIParseError(msg, line_start_char, index, line)
+
+############################
+#### DOCUMENT SKELETONS ####
+############################
+
+# Links need to know the shape of the document but none of its values, so when
+# the text has links in it we keep track of tags, lists and dicts, and stand
+# SCALAR in for everything else.
+SCALAR = object()
+
+class TagSkeleton(object):
+	__slots__ = ("name", "attrs", "children")
+	def __init__(self, name, attrs, children):
+		self.name = name
+		self.attrs = attrs
+		self.children = children
+
+class LinkSkeleton(object):
+	__slots__ = ("args", "index")
+	def __init__(self, args, index):
+		self.args = args
+		self.index = index
+
+class LinkError(Exception):
+	pass
+
+# raised to unwind the grammar after an error has been recorded
+class Resync(Exception):
+	pass
+
+LT = ("sym", "<")
+SLASH = ("sym", "/")
+EQUALS = ("sym", "=")
+
+scalar_types = set(["int", "float", "string", "rawstring", "bool", "null"])
+key_types = set(["string", "rawstring", "int", "ident"])
+
+##########################
+#### THE FAST SCANNER ####
+##########################
+
+# states for the scanner's pushdown automaton
+(TOP, ELEMENT, TAG_NAME, TAG_VALUE, TAG_ATTRS, ATTR_EQ, SELF_CLOSE, CHILDREN,
+ CHILD_LT, CLOSE_NAME, CLOSE_GT, LIST, DICT_KEY, DICT_COLON, LINK_FIRST, LINK,
+ LINK_NAME, LINK_INDEX, LINK_CLOSE) = range(19)
+
+def scan(text):
+	"""
+runs the grammar over text as a flat state machine, with no recursion and
+nothing built except skeletons for links. Returns (root skeleton, links) for
+well-formed text, or None as soon as anything is wrong."""
+	track = "@" in text
+	links = []
+	root = cur = [] if track else None
+	key = None
+	# states to go back to when the current element is finished, along with
+	# the container and key that element belongs to
+	stack = []
+	state = TOP
+
+	try:
+		for kind, value in lex.lex(text):
+			while True:
+				done = False
+
+				### ELEMENTS ###
+				if state == ELEMENT:
+					if kind in scalar_types:
+						elem = SCALAR
+						done = True
+					elif kind != "sym":
+						return None
+					elif value == "<":
+						state = TAG_NAME
+					elif value == "[":
+						cur = [] if track else None
+						state = LIST
+					elif value == "{":
+						cur = {} if track else None
+						state = DICT_KEY
+					elif value == "@":
+						link_start = lex.token_start
+						args = []
+						state = LINK_FIRST
+					else:
+						return None
+
+				elif state == TOP:
+					if kind == "EOF":
+						return root, links
+					stack.append((TOP, cur, None))
+					state = ELEMENT
+					continue
+
+				### TAGS ###
+				elif state == TAG_NAME:
+					if kind != "ident":
+						return None
+					cur = TagSkeleton(value, {}, []) if track else value
+					state = TAG_VALUE
+				elif state == TAG_VALUE or state == TAG_ATTRS:
+					if kind == "ident":
+						key = value
+						state = ATTR_EQ
+					elif kind != "sym":
+						return None
+					elif value == "=" and state == TAG_VALUE:
+						stack.append((TAG_ATTRS, cur, cur.name if track else cur))
+						state = ELEMENT
+					elif value == "/":
+						state = SELF_CLOSE
+					elif value == ">":
+						state = CHILDREN
+					else:
+						return None
+				elif state == ATTR_EQ:
+					if kind != "sym" or value != "=":
+						return None
+					stack.append((TAG_ATTRS, cur, key))
+					state = ELEMENT
+				elif state == SELF_CLOSE or state == CLOSE_GT:
+					if kind != "sym" or value != ">":
+						return None
+					elem = cur
+					done = True
+				elif state == CHILDREN:
+					if kind == "sym" and value == "<":
+						state = CHILD_LT
+					else:
+						stack.append((CHILDREN, cur, None))
+						state = ELEMENT
+						continue
+				elif state == CHILD_LT:
+					if kind == "sym" and value == "/":
+						state = CLOSE_NAME
+					else:
+						stack.append((CHILDREN, cur, None))
+						state = TAG_NAME
+						continue
+				elif state == CLOSE_NAME:
+					if kind != "ident" or value != (cur.name if track else cur):
+						return None
+					state = CLOSE_GT
+
+				### LISTS & DICTS ###
+				elif state == LIST:
+					if kind == "sym" and value == "]":
+						elem = cur
+						done = True
+					else:
+						stack.append((LIST, cur, None))
+						state = ELEMENT
+						continue
+				elif state == DICT_KEY:
+					if kind == "sym" and value == "}":
+						elem = cur
+						done = True
+					elif kind in key_types:
+						key = value
+						state = DICT_COLON
+					else:
+						return None
+				elif state == DICT_COLON:
+					if kind != "sym" or value != ":":
+						return None
+					stack.append((DICT_KEY, cur, key))
+					state = ELEMENT
+
+				### LINKS ###
+				elif state == LINK_FIRST:
+					if kind != "sym" or value not in (">", "["):
+						return None
+					state = LINK
+					continue
+				elif state == LINK:
+					if kind != "sym":
+						return None
+					elif value == ">" or value == ".":
+						operator = value
+						state = LINK_NAME
+					elif value == "[":
+						state = LINK_INDEX
+					elif value == ";":
+						elem = LinkSkeleton(args, link_start) if track else SCALAR
+						if track:
+							links.append(elem)
+						done = True
+					else:
+						return None
+				elif state == LINK_NAME:
+					if kind != "ident":
+						return None
+					args.append((operator, value))
+					state = LINK
+				elif state == LINK_INDEX:
+					if kind not in key_types:
+						return None
+					args.append(("[", value))
+					state = LINK_CLOSE
+				elif state == LINK_CLOSE:
+					if kind != "sym" or value != "]":
+						return None
+					state = LINK
+
+				# hand the finished element to whatever it's a part of
+				if done:
+					state, cur, key = stack.pop()
+					if track:
+						if state == TAG_ATTRS:
+							cur.attrs[key] = elem
+						elif state == CHILDREN:
+							cur.children.append(elem)
+						elif state == DICT_KEY:
+							cur[key] = elem
+						else:
+							cur.append(elem)
+				break
+	except lex.JXIParseError:
+		return None
+
+	return None
+
+############################
+#### THE SLOW VALIDATOR ####
+############################
+
+# This one is a recursive descent parser like the real thing, which records
+# errors and skips past them so that they can all be reported.
+
+class Validator(object):
+	def __init__(self, text):
+		self.text = text
+		self.errors = []
+		self.links = []
+		# no @ means no links, so there's nothing to build skeletons for
+		self.track = "@" in text
+		self.lexer = lex.lex(text)
+		# names of the currently open tags, innermost last
+		self.stack = []
+		# set when skipping has landed just after '</' of an open tag
+		self.closing = None
+		self.token = None
+		self.next()
+
+	# after a lexical error the error is recorded, the current token becomes
+	# ("error", None) and lexing picks up again on the next line
+	def next(self):
+		try:
+			self.token = self.lexer.next()
+		except lex.JXIParseError, e:
+			index = e.index if e.index is not None else lex.token_start
+			self.errors.append(error_at(self.text, e.reason, index))
+			start = self.text.find("\n", index) + 1
+			if start == 0:
+				start = len(self.text)
+			self.lexer = lex.lex(self.text, start)
+			self.token = ("error", None)
+		except StopIteration:
+			self.token = ("EOF", "EOF")
+
+	def fail(self, msg):
+		# lexical errors have been recorded already
+		if self.token[0] != "error":
+			self.errors.append(error_at(self.text, msg, lex.token_start))
+		raise Resync()
+
+	def expect(self, sym):
+		if self.token == ("sym", sym):
+			self.next()
+		else:
+			self.fail("expecting '%s', got '%s'" % (sym, self.token[1]))
+
+	### RECOVERY ###
+
+	# skips to the start of the next tag, for recovering at the top level
+	def skip_to_tag(self):
+		self.closing = None
+		self.next()
+		while self.token[0] != "EOF" and self.token != LT:
+			self.next()
+
+	# skips to just after the '</' of a closing tag for one of the open tags
+	def skip_to_closing(self):
+		if self.closing is not None:
+			return
+		while self.token[0] != "EOF":
+			if self.token == LT:
+				self.next()
+				if self.token == SLASH:
+					self.next()
+					if self.token[0] == "ident" and self.token[1] in self.stack:
+						self.closing = self.token[1]
+						return
+				# look at whatever came after the '<' again
+				continue
+			self.next()
+
+	### GRAMMAR ###
+
+	def validate_file(self):
+		elems = [] if self.track else None
+		while self.token[0] != "EOF":
+			try:
+				elem = self.element()
+			except Resync:
+				elem = SCALAR
+				self.skip_to_tag()
+			if self.track:
+				elems.append(elem)
+		return elems
+
+	def element(self):
+		if self.token == LT:
+			self.next()
+			return self.tag()
+		else:
+			return self.attribute()
+
+	def tag(self):
+		if self.token[0] != "ident":
+			self.fail("expecting tag name, got '%s'" % str(self.token[1]))
+		name = self.token[1]
+		self.next()
+		track = self.track
+		attrs = {} if track else None
+		children = [] if track else None
+
+		self.stack.append(name)
+		try:
+			try:
+				# optional value for tag name
+				if self.token == EQUALS:
+					self.next()
+					elem = self.element()
+					if track:
+						attrs[name] = elem
+
+				# proper attributes
+				while self.token[0] == "ident":
+					attrname = self.token[1]
+					self.next()
+					self.expect("=")
+					elem = self.element()
+					if track:
+						attrs[attrname] = elem
+
+				if self.token == SLASH:
+					self.next()
+					self.expect(">")
+				else:
+					self.expect(">")
+					while True:
+						if self.token == LT:
+							self.next()
+							if self.token == SLASH:
+								break
+							elem = self.tag()
+						else:
+							elem = self.attribute()
+						if track:
+							children.append(elem)
+
+					self.next()
+					if self.token != ("ident", name):
+						if self.token[0] == "ident" and self.token[1] in self.stack:
+							# probably the end of an outer tag we're missing
+							# the end of, so let that tag pick up from here
+							self.errors.append(error_at(self.text, "expecting '%s', got '%s'" % (name, self.token[1]), lex.token_start))
+							self.closing = self.token[1]
+							raise Resync()
+						self.fail("expecting '%s', got '%s'" % (name, self.token[1]))
+					self.next()
+					self.expect(">")
+
+			except Resync:
+				self.skip_to_closing()
+				if self.closing != name:
+					raise
+				self.closing = None
+				self.next()
+				self.expect(">")
+		finally:
+			self.stack.pop()
+
+		return TagSkeleton(name, attrs, children) if track else SCALAR
+
+	def attribute(self):
+		token = self.token
+		if token[0] in scalar_types:
+			self.next()
+			return SCALAR
+		elif token == ("sym", "["):
+			return self.list()
+		elif token == ("sym", "{"):
+			return self.dict()
+		elif token == ("sym", "@"):
+			return self.link()
+		else:
+			self.fail("expecting attribute literal, got '%s'" % token[1])
+
+	def list(self):
+		self.next()
+		elems = [] if self.track else SCALAR
+		while self.token != ("sym", "]"):
+			elem = self.element()
+			if self.track:
+				elems.append(elem)
+		self.next()
+		return elems
+
+	def dict(self):
+		self.next()
+		elems = {} if self.track else SCALAR
+		while self.token != ("sym", "}"):
+			if self.token[0] in key_types:
+				key = self.token[1]
+				self.next()
+				self.expect(":")
+				elem = self.element()
+				if self.track:
+					elems[key] = elem
+			else:
+				self.fail("expecting attribute literal")
+		self.next()
+		return elems
+
+	def link(self):
+		start = lex.token_start
+		self.next()
+		if self.token[0] != "sym" or self.token[1] not in (">", "["):
+			self.fail("Bad symbolic link syntax. Expecting ':' or index")
+
+		args = []
+		while self.token[0] == "sym" and self.token[1] in (">", ".", "["):
+			operator = self.token[1]
+			self.next()
+			if operator == ">":
+				if self.token[0] != "ident":
+					self.fail("'>' should be followed by a tag name")
+				args.append((">", self.token[1]))
+				self.next()
+			elif operator == ".":
+				if self.token[0] != "ident":
+					self.fail("'.' should be followed by an attribute name")
+				args.append((".", self.token[1]))
+				self.next()
+			else:
+				if self.token[0] not in key_types:
+					self.fail("'[' should be followed by an index")
+				args.append(("[", self.token[1]))
+				self.next()
+				self.expect("]")
+
+		self.expect(";")
+
+		if not self.track:
+			return SCALAR
+		link = LinkSkeleton(args, start)
+		self.links.append(link)
+		return link
+
+###############
+#### LINKS ####
+###############
+
+# returns a JXIParseError for each link which doesn't resolve. Links are
+# resolved the way parse.resolve_links does it: one at a time in the order they
+# appear, with any whose target is a link still waiting its turn sent to the
+# back of the queue. Links in the middle of a path aren't followed, since the
+# parser won't have replaced them by then either
+def check_links(text, root, links):
+	errors = []
+	# maps each resolved link to its target, standing in for the parser
+	# putting the target where the link was
+	resolved = {}
+	failed = set()
+	queue = deque(links)
+	safety_counter = (len(queue)*(len(queue) + 1))//2 + 1
+	while queue and safety_counter > 0:
+		link = queue.popleft()
+		safety_counter -= 1
+		try:
+			target = find_target(link.args, root, resolved)
+		except LinkError, e:
+			errors.append(error_at(text, str(e), link.index))
+			failed.add(link)
+			continue
+		if type(target) == LinkSkeleton:
+			queue.append(link)
+		else:
+			resolved[link] = target
+
+	# anything left is in a cycle, or waiting on a link that's already been
+	# reported as broken
+	waiting = dict((link, waiting_on(link, root, resolved)) for link in queue)
+	while True:
+		blocked = [link for link, target in waiting.items() if target in failed]
+		if not blocked:
+			break
+		for link in blocked:
+			failed.add(link)
+			del waiting[link]
+	msg = "Infinite symbolic link cycle detected. What is this i don't even"
+	errors.extend(error_at(text, msg, link.index) for link in waiting)
+	return errors
+
+# the link a link in the queue is waiting for
+def waiting_on(link, root, resolved):
+	try:
+		target = find_target(link.args, root, resolved)
+	except LinkError:
+		return None
+	return target if type(target) == LinkSkeleton else None
+
+# what's at target once the links before it have been resolved
+def current(target, resolved):
+	if type(target) == LinkSkeleton:
+		return resolved.get(target, target)
+	return target
+
+# same rules as parse.LinkEvaluator.find_target
+def find_target(args, root, resolved):
+	target = root
+	i = 0
+	while i < len(args):
+		operator, operand = args[i]
+
+		### TAG NAME & POSSIBLE INDEX ###
+		if operator == ">":
+			if type(target) == TagSkeleton:
+				children = target.children
+			elif type(target) == list:
+				children = target
+			else:
+				raise LinkError("Link not found. Unable to find tag name '%s'. Parent cannot contain tags." % operand)
+			matches = [c for c in (current(c, resolved) for c in children) if type(c) == TagSkeleton and c.name == operand]
+
+			if i+1 < len(args) and args[i+1][0] == "[":
+				i += 1
+				index = args[i][1]
+				if type(index) != int:
+					raise LinkError("Link not found. Tag indices in symbolic links must be integers!")
+				if index < 0 or index >= len(matches):
+					raise LinkError("Link not found. No tag with name '%s' and group index '%s'" % (operand, index))
+				target = matches[index]
+			elif matches:
+				target = matches[0]
+			else:
+				raise LinkError("Link not found. No tag with name '%s'" % operand)
+
+		### TAG ATTRIBUTE ###
+		elif operator == ".":
+			if type(target) != TagSkeleton:
+				raise LinkError("Link not found. Non-tag element cannot have attribute '%s'" % operand)
+			elif operand not in target.attrs:
+				raise LinkError("Link not found. No attribute '%s'" % operand)
+			target = target.attrs[operand]
+
+		### INDEX OF SOME KIND ###
+		elif operator == "[":
+			if type(target) in (list, TagSkeleton):
+				elems = target.children if type(target) == TagSkeleton else target
+				if type(operand) != int:
+					raise LinkError("Link not found. Lists and tags must be indexed by integers")
+				elif operand < 0 or operand >= len(elems):
+					raise LinkError("Link not found. Invalid index '%s'" % operand)
+				target = elems[operand]
+			elif type(target) == dict:
+				if operand not in target:
+					raise LinkError("Link not found. Invalid index '%s'" % operand)
+				target = target[operand]
+			else:
+				raise LinkError("Link not found. Invalid index '%s'. Parent unsubscriptable." % operand)
+
+		target = current(target, resolved)
+		i += 1
+
+	return target
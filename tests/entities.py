@@ -0,0 +1,323 @@
+# coding=utf-8
+import unittest, sys, os, copy, pickle
+sys.path.append(os.path.abspath("../jxi/"))
+from parse import parse
+from entity import Entity, FrozenEntity, FrozenDict, freeze, thaw, dumps, EncodingCache
+from overlay import overlay, flatten, Overlay, DictOverlay
+from chunked import ChunkedList
+import parallel
+
+doc = """
+<config name="main">
+	<server="alpha" port=80 opts={a:[1 2]}/>
+	<server="beta" port=81/>
+	[@>config>server[1]; "text"]
+</config>
+"""
+
+class TestEncoding(unittest.TestCase):
+	def test_round_trip(self):
+		tree = parse(doc + "{x:1.1 'y z':[`raw` null] 3:@[0][0];} [1e+30 -2 \"\\n\"]")
+		text = dumps(tree)
+		again = parse(text)
+		self.assertEqual(freeze(again), freeze(tree))
+		self.assertEqual(dumps(again), text)
+		# links are written for anything seen before, and stay shared
+		self.assertTrue(again[0][2][0] is again[0][1])
+		self.assertTrue(again[1][3] is again[0][0])
+		self.assertEqual(dumps(parse("<a x=[1 @[0].x;]/>")), "<a x=[1 @[0].x;]/>\n")
+		self.assertEqual(dumps(Entity("a", {"a": 1, "b": "c"}, [])), '<a=1 b="c"/>')
+		self.assertEqual(dumps({"a": 0.1}, separators=(", ", " = ")), "{a = 0.1}")
+		with self.assertRaises(ValueError):
+			dumps(float("nan"))
+		with self.assertRaises(TypeError):
+			dumps({1.5: 1})
+		# attributes that couldn't be read back aren't left out
+		for attr in ("b c", "null", "1"):
+			with self.assertRaises(ValueError) as cm:
+				dumps(Entity("a", {attr: 1}, []))
+			self.assertTrue("'%s'" % attr in str(cm.exception))
+		self.assertEqual(dumps(Entity("a", {"b": 1}, [])), "<a b=1/>")
+		self.assertEqual(dumps({1.5: 1, "b": 2}, skip_keys=True, string_keys=True), '{"b":2}')
+
+	def test_canonical(self):
+		keys = ["k%d" % i for i in range(50)]
+		forwards = dict((k, i) for i, k in enumerate(keys))
+		backwards = dict(reversed(forwards.items()))
+		self.assertEqual(dumps(forwards, canonical=True), dumps(backwards, canonical=True))
+		self.assertEqual(dumps([-0.0, 0.0, 2**70], canonical=True), "0.0\n0.0\n%d\n" % 2**70)
+		self.assertEqual(dumps([1], separators=(",", "="), canonical=True), "1\n")
+
+		# frozen values are written in full, so their text is the same wherever
+		# they are, and can be cached
+		frozen = parse(doc, frozen=True)
+		text = dumps(frozen, canonical=True)
+		self.assertEqual(text.count("<server=\"beta\""), 2)
+		self.assertEqual(freeze(parse(text)), frozen)
+
+		cache = EncodingCache()
+		self.assertEqual(dumps(frozen, canonical=True, cache=cache), text)
+		changed = (frozen[0]._set_in([0, "port"], 8080),)
+		expected = dumps(changed, canonical=True)
+		hits = cache.hits
+		self.assertEqual(dumps(changed, canonical=True, cache=cache), expected)
+		self.assertTrue(cache.hits > hits)
+
+		cache = EncodingCache(max_entries=1)
+		dumps(frozen, canonical=True, cache=cache)
+		self.assertEqual(len(cache), 1)
+
+		# the options canonical mode leaves open are part of what's cached
+		cache = EncodingCache()
+		tag = FrozenEntity("a", {"d": FrozenDict(b=1)}, [])
+		self.assertEqual(dumps(tag, canonical=True, cache=cache), "<a d={b:1}/>")
+		self.assertEqual(dumps(tag, canonical=True, cache=cache, string_keys=True), '<a d={"b":1}/>')
+
+		# equal decimals are written alike
+		from decimal import Decimal
+		numbers = [Decimal("1.10"), Decimal("1.1"), Decimal("1E+2"), Decimal("-0.00"), Decimal("2.50E-10")]
+		self.assertEqual(dumps(numbers, canonical=True), "1.1\n1.1\n100\n0\n2.5E-10\n")
+		self.assertEqual(dumps(Decimal("1.10")), "1.10")
+
+	def test_lazy_links(self):
+		# links still waiting in attributes are written out like any others
+		text = "<a x=1/> <b y=@>a.x; z=@[0];/>"
+		self.assertEqual(dumps(parse(text, lazy_links=True)), dumps(parse(text)))
+		self.assertEqual(dumps(parse(text, lazy_links=True)), "<a x=1/>\n<b y=1 z=@[0];/>\n")
+
+class TestFrozen(unittest.TestCase):
+	def test_parse_frozen(self):
+		result = parse(doc, frozen=True)
+		self.assertEqual(type(result), tuple)
+		config = result[0]
+		self.assertEqual(type(config), FrozenEntity)
+		self.assertEqual(type(config._children), tuple)
+		alpha, beta, links = config._children
+		self.assertEqual(type(alpha.opts), FrozenDict)
+		self.assertEqual(alpha.opts["a"], (1, 2))
+		# link targets stay shared
+		self.assertTrue(links[0] is beta)
+		# tag name lookups still work
+		self.assertTrue(config["server"] is alpha)
+
+	def test_immutable(self):
+		config = parse(doc, frozen=True)[0]
+		with self.assertRaises(TypeError):
+			config.name = "other"
+		with self.assertRaises(TypeError):
+			del config.name
+		with self.assertRaises(TypeError):
+			config._append(5)
+		with self.assertRaises(TypeError):
+			del config[0]
+		with self.assertRaises(TypeError):
+			config[0].opts["b"] = 2
+
+	def test_hash_and_equality(self):
+		first = parse(doc, frozen=True)
+		second = parse(doc, frozen=True)
+		self.assertEqual(first, second)
+		self.assertEqual(hash(first), hash(second))
+		self.assertEqual(len(set([first[0], second[0]])), 1)
+		self.assertNotEqual(first[0], first[0]._set_attr("name", "other"))
+		self.assertNotEqual(first[0], parse(doc)[0])
+
+	def test_modified_copies(self):
+		config = parse(doc, frozen=True)[0]
+		alpha, beta, links = config._children
+
+		changed = config._set_in([0, "port"], 8080)
+		self.assertEqual(changed[0].port, 8080)
+		self.assertEqual(config[0].port, 80)
+		# everything off the path is shared
+		self.assertTrue(changed[1] is beta)
+		self.assertTrue(changed[2] is links)
+		self.assertTrue(changed[0].opts is alpha.opts)
+
+		deeper = config._set_in([0, "opts", "a", 1], [3])
+		self.assertEqual(deeper[0].opts["a"], (1, (3,)))
+		added = config._set_in([1, "weight"], 5)
+		self.assertEqual(added[1].weight, 5)
+
+		self.assertEqual(config._del_attr("name")._attrs(), [])
+		self.assertEqual(len(config._with_children([])), 0)
+		self.assertEqual(config._set_child(2, None)[2], None)
+
+	def test_freeze_and_thaw(self):
+		tree = parse(doc)
+		frozen = freeze(tree)
+		self.assertTrue(freeze(frozen) is frozen)
+		thawed = thaw(frozen)
+		self.assertEqual(type(thawed[0]), Entity)
+		thawed[0]._append(5)
+		self.assertEqual(thawed[0][2][0], thawed[0][1])
+		self.assertTrue(thawed[0][2][0] is thawed[0][1])
+
+		# empty lists all freeze to the one empty tuple, but thaw separately
+		a = thaw(parse("<a x=[] y=[]>[] []</a>", frozen=True))[0]
+		a.x.append(1)
+		self.assertEqual((a.y, a[0], a[1]), ([], [], []))
+		self.assertEqual(dumps(a), "<a x=[1] y=[]>[] []</a>")
+
+		# cycles can't be frozen
+		cyclic = parse("<a/> <b> @>b; </b>")
+		with self.assertRaises(ValueError):
+			freeze(cyclic)
+
+	def test_copy_and_pickle(self):
+		frozen = parse(doc, frozen=True)
+		self.assertTrue(copy.deepcopy(frozen[0]) is frozen[0])
+		for protocol in range(3):
+			loaded = pickle.loads(pickle.dumps(frozen, protocol))
+			self.assertEqual(loaded, frozen)
+			self.assertTrue(loaded[0][2][0] is loaded[0][1])
+
+class TestOverlay(unittest.TestCase):
+	base = """<config name="main" debug=false opts={a:1 b:{c:2 d:3}}>
+		<server="alpha" port=80 tags=["x"]/> <db host="localhost"/>
+	</config>"""
+	override = """<config debug=true opts={b:{d:4} e:5}>
+		<server port=8080 tags=["y"]/>
+	</config>"""
+
+	def test_lookups(self):
+		base, override = parse(self.base)[0], parse(self.override)[0]
+		view = overlay(base, override)
+		self.assertEqual(type(view), Overlay)
+		self.assertEqual((view.name, view.debug), ("main", "true"))
+		self.assertEqual(view._attrs(), ["debug", "name", "opts"])
+		opts = view.opts
+		self.assertEqual(type(opts), DictOverlay)
+		self.assertEqual((opts["a"], opts["b"]["c"], opts["b"]["d"], opts["e"]), (1, 2, 4, 5))
+		self.assertEqual(opts.keys(), ["a", "b", "e"])
+		self.assertFalse("f" in opts)
+
+		# named children merge, other children come from the top layer with some
+		server = view["server"]
+		self.assertEqual((server.server, server.port, server.tags), ("alpha", 8080, ["y"]))
+		self.assertEqual(view["db"].host, "localhost")
+		self.assertEqual(len(view), 1)
+		self.assertTrue(view[0] is override[0])
+		with self.assertRaises(KeyError):
+			view["nope"]
+		with self.assertRaises(AttributeError):
+			view.nope
+		with self.assertRaises(TypeError):
+			view.name = "other"
+		with self.assertRaises(TypeError):
+			overlay(base, parse("<other/>")[0])
+
+	def test_flatten(self):
+		base, override = parse(self.base)[0], parse(self.override)[0]
+		before = dumps(base)
+		tree = flatten(overlay(base, override))
+		self.assertEqual(type(tree), Entity)
+		self.assertEqual(tree.opts, {"a": 1, "b": {"c": 2, "d": 4}, "e": 5})
+		self.assertEqual(tree[0].port, 8080)
+		tree[0].port = 1
+		self.assertEqual(override[0].port, 8080)
+		self.assertEqual(dumps(base), before)
+
+		frozen = overlay(freeze(base), freeze(override))._flatten()
+		self.assertEqual(type(frozen), FrozenEntity)
+		self.assertEqual(type(frozen.opts), FrozenDict)
+		self.assertEqual(thaw(frozen).opts, tree.opts)
+		self.assertEqual(flatten(overlay({"a": 1}, {"b": 2})), {"a": 1, "b": 2})
+
+class TestChunkedList(unittest.TestCase):
+	def test_acts_like_a_list(self):
+		import random
+		rand = random.Random(46)
+		items = range(300)
+		chunked = ChunkedList(items, load=8)
+		for n in range(2000):
+			op = rand.randrange(6)
+			i = rand.randrange(-len(items) - 2, len(items) + 2) if items else 0
+			if op == 0:
+				items.insert(i, n)
+				chunked.insert(i, n)
+			elif op == 1 and items:
+				i %= len(items)
+				self.assertEqual(chunked.pop(i), items.pop(i))
+			elif op == 2 and items:
+				i %= len(items)
+				del items[i]
+				del chunked[i]
+			elif op == 3:
+				items.append(n)
+				chunked.append(n)
+			elif op == 4 and items:
+				i %= len(items)
+				items[i] = -n
+				chunked[i] = -n
+			elif op == 5 and items:
+				value = items[i % len(items)]
+				self.assertEqual(chunked.index(value), items.index(value))
+			self.assertEqual(len(chunked), len(items))
+		self.assertEqual(list(chunked), items)
+		self.assertEqual([chunked[i] for i in range(-len(items), len(items))], items + items)
+		self.assertEqual(list(reversed(chunked)), items[::-1])
+		self.assertEqual(chunked[5:50:3], items[5:50:3])
+		self.assertEqual(chunked, items)
+		with self.assertRaises(IndexError):
+			chunked[len(items)]
+
+		chunked.extend(range(40))
+		chunked.sort()
+		self.assertEqual(chunked, sorted(items + range(40)))
+		odd = len([x for x in chunked if x % 2])
+		self.assertEqual(chunked.remove_if(lambda x: x % 2), odd)
+		self.assertFalse(any(x % 2 for x in chunked))
+		self.assertEqual(pickle.loads(pickle.dumps(chunked)), chunked)
+
+	def test_wide_tags(self):
+		tag = parse("<a>" + "<bb/> <cc/> 1 " * 100 + "</a>")[0]
+		tag._children = ChunkedList(tag._children, load=16)
+		del tag[".bb"]
+		self.assertEqual(len(tag), 200)
+		del tag["cc"]
+		tag._insert(50, Entity("dd", {}, []))
+		self.assertEqual(tag["dd"], tag[50])
+		self.assertEqual(len(tag[".cc"]), 99)
+		self.assertEqual(dumps(tag), dumps(parse(dumps(tag))[0]))
+		copied = copy.deepcopy(tag)
+		self.assertEqual(type(copied._children), ChunkedList)
+		self.assertEqual(len(copied), len(tag))
+
+		# plain lists get the one pass removal too
+		tag = parse("<a><bb/> 1 <bb/> <cc/></a>")[0]
+		del tag[".bb"]
+		self.assertEqual(tag._children, [1, Entity("cc", {}, [])])
+
+		# one letter names included
+		tag = parse("<a><b/> 1 <b/> <c/></a>")[0]
+		self.assertEqual(len(tag[".b"]), 2)
+		del tag[".b"]
+		del tag["c"]
+		self.assertEqual(tag._children, [1])
+
+class TestParallel(unittest.TestCase):
+	def test_documents(self):
+		shared = {"x": [1, 2]}
+		elems = [Entity("item", {"n": i}, [[i, "s"]]) for i in range(50)]
+		elems[3]._children.append(shared)
+		elems[40]._children.append(shared)
+		elems[41]._children.append(shared["x"])
+		elems[45]._children.append(elems[2])
+		elems[30].me = elems[30]
+		for options in [{}, {"use_commas": True}, {"canonical": True}]:
+			self.assertEqual(parallel.dumps(elems, processes=3, run_size=4, **options), dumps(elems, **options))
+		# small ones are just encoded here
+		self.assertEqual(parallel.dumps([1, {"a": 2}], processes=2), dumps([1, {"a": 2}]))
+
+	def test_wide_tag(self):
+		tag = parse("<root id=1 opts={a:[1]}>" + "<bb n=1/> [2] " * 40 + "</root>")[0]
+		tag._children[5].append(tag.opts["a"])
+		tag._children.append(tag["bb"])
+		self.assertEqual(parallel.dumps(tag, processes=2, run_size=7), dumps(tag))
+		self.assertEqual(parallel.dumps([tag], processes=2, run_size=7), dumps([tag]))
+		self.assertEqual(dumps([tag], processes=2), dumps([tag]))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -1,7 +1,10 @@
 # coding=utf-8
 import unittest, sys, os, random, string
 sys.path.append(os.path.abspath("../jxi/"))
-from lex import lex, JXIParseError
+from lex import lex, JXIParseError, TokenBuffer, LineIndex, position, Limits, JXILimitError
+import lex as lexmodule
+from entity import NumberText
+from decimal import Decimal
 
 # We're gonna do some proper white box testing here and attempt to get
 # full statement coverage
@@ -113,6 +116,29 @@ class TestSkipWhitespace(unittest.TestCase):
 		self.assertEqual(cm.exception.line, 2)
 		self.assertEqual(cm.exception.char, 1)
 
+		# newlines inside tokens count too
+		string = "`raw\nstring` 'x'\n  &"
+		with self.assertRaises(JXIParseError) as cm:
+			for token in lex(string):
+				pass
+		self.assertEqual(cm.exception.line, 3)
+		self.assertEqual(cm.exception.char, 3)
+
+		# starting part way through a text
+		string = "<a>\n <b>\n  &"
+		with self.assertRaises(JXIParseError) as cm:
+			for token in lex(string, 9, 10):
+				pass
+		self.assertEqual(cm.exception.line, 12)
+		self.assertEqual(cm.exception.char, 3)
+
+	def test_line_index(self):
+		text = "ab\n\ncd\nef\n"
+		lines = LineIndex(text)
+		for i in range(len(text) + 1):
+			self.assertEqual(lines.position(i), position(text, i))
+		self.assertEqual(LineIndex(text, 5).position(6), (7, 4))
+
 # 2. symbols
 class TestSymbols(unittest.TestCase):
 	def test_symbols(self):
@@ -203,6 +229,16 @@ class TestJsonStrings(unittest.TestCase):
 			lex('"blahblahblah').next()
 
 
+	def test_byte_string_input(self):
+		# utf-8 encoded input should come straight back out, with or without
+		# escapes in the literal
+		text = u"主要提供网页 ཏ ཐདནཤ".encode("utf-8")
+		self.assertEqual(lex("'%s'" % text).next(), ("string", text))
+		self.assertEqual(lex("'%s\\n'" % text).next(), ("string", text + "\n"))
+		self.assertEqual(lex("'\\u4e3b%s'" % text).next(), ("string", u"主".encode("utf-8") + text))
+		self.assertEqual(type(lex(u"'abc'").next()[1]), str)
+		self.assertEqual(type(lex(u"'ab\\tc'").next()[1]), str)
+
 # 			4.1.2.2 unicode literals
 	def test_unicode_literals(self):
 # 				4.1.2.2.1 get 4 hex chars
@@ -297,6 +333,107 @@ class TestRawStrings(unittest.TestCase):
 # 			6.1.2 delimiter needs escaping
 		self.assertEqual(lex("`%s`" % escape).next(), ("rawstring", escape_expected))
 
+	def test_unterminated(self):
+		for text in ["`blah", "`blah\\`", "`blah\\"]:
+			with self.assertRaises(JXIParseError):
+				lex(text).next()
+
+
+# 7. token buffers, which should always agree with lex
+def lex_all(text, **options):
+	try:
+		return list(lex(text, **options))
+	except JXIParseError, e:
+		return e.index
+
+# runs of numbers are split back up into the tokens lex would give
+def buffer_all(text, **options):
+	try:
+		tokens = TokenBuffer(text, **options)
+	except JXIParseError, e:
+		return e.index
+	result = []
+	for i in xrange(len(tokens)):
+		kind, value = tokens.token(i)
+		if kind == "numbers":
+			for number in value:
+				result.append(("int" if type(number.decode()) == int else "float", number))
+		else:
+			result.append((kind, value))
+	return result
+
+class TestTokenBuffer(unittest.TestCase):
+	def test_matches_lex(self):
+		texts = ["<a b=5 c=[1 2.5 -3e4]>\n'x\\ny' \"\\u00e9\\\"\" `r\\`aw\\` null true </a>",
+		         u"'\u00e9' `\u00e9`", "1.5e5e 1.5.3 1e5. 00012 0.5E+2", "@>a>b[0].c['d'];",
+		         "{a:1, b:2}", "", "  \n ", "'\\u0x1f'"]
+		for text in texts:
+			self.assertEqual(buffer_all(text), lex_all(text))
+
+		# and some random junk, which is mostly errors
+		alphabet = list("<>[]{}:/=@.;, \n\"'`\\-+eE0123456789abnu_") + ["true", "\\u12ab"]
+		for i in xrange(2000):
+			text = "".join(random.choice(alphabet) for j in xrange(random.randint(1, 12)))
+			self.assertEqual(buffer_all(text), lex_all(text), text)
+			self.assertEqual(buffer_all(text, lazy_numbers=True), lex_all(text, lazy_numbers=True), text)
+
+	def test_arrays(self):
+		text = "<a x=12>\n  'str' </a>"
+		tokens = TokenBuffer(text)
+		self.assertEqual(list(tokens.kinds), [lexmodule.LT, lexmodule.IDENT, lexmodule.IDENT,
+			lexmodule.EQUALS, lexmodule.INT, lexmodule.GT, lexmodule.STRING, lexmodule.LT,
+			lexmodule.SLASH, lexmodule.IDENT, lexmodule.GT, lexmodule.EOF])
+		spans = [text[s:e] for s, e in zip(tokens.starts, tokens.ends)]
+		self.assertEqual(spans, ["<", "a", "x", "=", "12", ">", "'str'", "<", "/", "a", ">", ""])
+		# only tokens with a value take up room in the side table
+		self.assertEqual(sorted(tokens.values), [1, 2, 4, 6, 9])
+		self.assertEqual(tokens.position(6), (2, 9))
+
+	def test_numbers(self):
+		text = "[1 2.50,-3e4] x=1.10 y=7"
+		floats = [value for kind, value in lex(text, decimals=True) if kind == "float"]
+		self.assertEqual(map(str, floats), ["2.50", "-3E+4", "1.10"])
+		self.assertEqual(type(floats[0]), Decimal)
+
+		tokens = TokenBuffer(text, lazy_numbers=True)
+		self.assertEqual(tokens.kinds[1], lexmodule.NUMBERS)
+		self.assertEqual(tokens.values[1], ["1", "2.50", "-3e4"])
+		self.assertEqual(text[tokens.starts[1]:tokens.ends[1]], "1 2.50,-3e4")
+		self.assertEqual(tokens.token(5), ("float", "1.10"))
+		self.assertEqual(type(tokens.values[5]), NumberText)
+		self.assertEqual([tokens.values[1][2].decode(), tokens.values[8].decode()], [-3e4, 7])
+
+	def test_errors(self):
+		for text in ["<a & b>", "'unterminated", "1.", "`raw", "'\\q'"]:
+			with self.assertRaises(JXIParseError):
+				TokenBuffer(text)
+
+class TestLimits(unittest.TestCase):
+	def lex_all(self, text, limits):
+		return list(lex(text, limits=limits))
+
+	def test_strings(self):
+		limits = Limits(string=5)
+		self.assertEqual(len(self.lex_all('"abcde" `a\\`cd` 12345 abcde', limits)), 5)
+		for text in ['"abcdef"', '"ab\\ncdef"', "`abcdef`", "`a\\`bcdef`", "123456", "1.2345", "abcdef"]:
+			with self.assertRaises(JXILimitError) as cm:
+				self.lex_all("[ " + text, limits)
+			self.assertEqual(cm.exception.limit, "string")
+			self.assertTrue(isinstance(cm.exception, JXIParseError))
+			self.assertEqual(cm.exception.char, 3)
+
+	def test_tokens(self):
+		limits = Limits(tokens=7)
+		self.assertEqual(len(self.lex_all("<a b=1/>", limits)), 8)
+		with self.assertRaises(JXILimitError) as cm:
+			self.lex_all("<a b=1 />c", limits)
+		self.assertEqual((cm.exception.limit, cm.exception.maximum), ("tokens", 7))
+		self.assertEqual(len(self.lex_all("1 " * 5000, Limits(tokens=5000))), 5001)
+		with self.assertRaises(JXILimitError):
+			self.lex_all("1 " * 5001, Limits(tokens=5000))
+		with self.assertRaises(JXILimitError) as cm:
+			self.lex_all("1 " * 5000, Limits(seconds=-1))
+		self.assertEqual(cm.exception.limit, "seconds")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,1060 @@
+# coding=utf-8
+import unittest, sys, os, subprocess
+sys.path.append(os.path.abspath("../jxi/"))
+from lex import JXIParseError, Limits, JXILimitError, untrusted
+from parse import parse, SymbolicLink
+import parse as parse_module
+from entity import Entity, freeze
+from schema import Schema, Tag, JXISchemaError, ANY
+from cache import Parser
+from incremental import IncrementalParser, iterparse
+from validate import validate, scan, Validator
+from archive import ArchiveIndex
+import compress, flat, packing, merkle, fastjson, include, cache
+from registry import TagRegistry
+from attrindex import AttrIndex, IndexedEntity
+from collections import namedtuple
+from entity import RawString, NumberText, dumps
+from decimal import Decimal
+
+config_schema = Schema([
+	Tag("config", attrs={"name": str, "version": int}, required=["name"],
+	    children=["server"]),
+	Tag("server", attrs={"server": str, "port": int, "ratio": (int, float),
+	                     "opts": dict, "backup": ANY},
+	    content=(str, list))
+], root=["config"])
+
+config_text = """
+<config name="main" version=2>
+	<server="alpha" port=80 ratio=0.5 opts={a:1}>
+		"some text" [1 2 3]
+	</server>
+	<server="beta" port=81 ratio=1 backup=@>config>server;/>
+</config>
+"""
+
+class TestSchema(unittest.TestCase):
+	def test_matches_generic_parse(self):
+		parser = config_schema.compile()
+		fast = parser.parse(config_text)
+		slow = parse(config_text)
+		self.assertEqual(len(fast), len(slow))
+		config, expected = fast[0], slow[0]
+		self.assertEqual(config._attrs(), expected._attrs())
+		self.assertEqual(config.name, "main")
+		self.assertEqual(config.version, 2)
+		self.assertEqual(len(config), 2)
+		alpha, beta = config._children
+		self.assertEqual(alpha.server, "alpha")
+		self.assertEqual(alpha.opts, {"a": 1})
+		self.assertEqual(alpha._children, ["some text", [1, 2, 3]])
+		self.assertEqual(beta.ratio, 1)
+		self.assertEqual(beta._children, [])
+		# links in attributes get resolved
+		self.assertTrue(beta.backup is alpha)
+
+	def test_type_errors(self):
+		parser = config_schema.compile()
+		bad = [
+			'<config name=5/>',                        # wrong attr type
+			'<config version=1/>',                     # missing required attr
+			'<config name="a" colour="red"/>',         # undeclared attr
+			'<config name="a"> <config name="b"/> </config>', # undeclared child
+			'<config name="a"> 5 </config>',           # content not allowed
+			'<config name="a"> <server port=80> 5 </server> </config>',
+			'<server="a"/>',                           # not allowed at the root
+			'"top level string"',
+			'<config="a"/>'                            # tag name value not declared
+		]
+		for text in bad:
+			with self.assertRaises(JXISchemaError):
+				parser.parse(text)
+
+		# schema errors are still parse errors
+		with self.assertRaises(JXIParseError):
+			parser.parse('<config name="a" version=1.5/>')
+		# and syntax errors still come through
+		with self.assertRaises(JXIParseError):
+			parser.parse('<config name="a">')
+
+	def test_bad_schemas(self):
+		with self.assertRaises(ValueError):
+			Schema([Tag("a", children=["b"])])
+		with self.assertRaises(ValueError):
+			Tag("a", required=["b"])
+		with self.assertRaises(TypeError):
+			Schema([Tag("a", attrs={"b": complex})]).compile()
+
+	def test_custom_tagclass(self):
+		class MyTag(Entity):
+			def __init__(self, name, attrs, children):
+				Entity.__init__(self, name, attrs, children)
+				self._custom = True
+		result = config_schema.compile(MyTag).parse(config_text)
+		self.assertEqual(type(result[0]), MyTag)
+		self.assertTrue(result[0]._custom)
+
+class TestParserCache(unittest.TestCase):
+	def test_hits_and_copies(self):
+		parser = Parser(cache_size=2)
+		first = parser.parse(config_text)
+		second = parser.parse(config_text)
+		self.assertEqual((parser.hits, parser.misses), (1, 1))
+		# each caller gets their own tree, with shared references intact
+		self.assertFalse(first[0] is second[0])
+		first[0]._append("mutated")
+		self.assertEqual(len(parser.parse(config_text)[0]), 2)
+
+		linked = parser.parse("<a/> [@>a;]")
+		linked = parser.parse("<a/> [@>a;]")
+		self.assertTrue(linked[1][0] is linked[0])
+
+	def test_shared(self):
+		parser = Parser(copy=False)
+		self.assertTrue(parser.parse("[1 2]") is parser.parse(u"[1 2]"))
+
+	def test_frozen(self):
+		parser = Parser(frozen=True)
+		self.assertTrue(parser.parse(config_text) is parser.parse(config_text))
+		with self.assertRaises(TypeError):
+			parser.parse(config_text)[0]._append(5)
+
+	def test_eviction(self):
+		parser = Parser(cache_size=2)
+		parser.parse("1")
+		parser.parse("2")
+		parser.parse("1")
+		parser.parse("3") # evicts "2", the least recently used
+		self.assertEqual(len(parser), 2)
+		parser.parse("1")
+		self.assertEqual(parser.hits, 2)
+		parser.parse("2")
+		self.assertEqual(parser.misses, 4)
+
+	def test_threads(self):
+		# separate parsers still share the parser's globals, so they take turns
+		import threading
+		texts = [config_text.replace("80", str(i)) for i in range(40)]
+		expected = [freeze(parse(text)) for text in texts]
+		failures = []
+		def run(parser, order):
+			try:
+				for n in order:
+					if freeze(parser.parse(texts[n])) != expected[n]:
+						failures.append(n)
+			except Exception, e:
+				failures.append(e)
+		threads = [threading.Thread(target=run, args=(Parser(cache_size=0), order))
+		           for order in (range(40) * 5, range(39, -1, -1) * 5)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(failures, [])
+
+	def test_byte_budget(self):
+		# the budget is for the trees, which are a lot bigger than their text
+		small = cache.tree_size(parse("[5 6]"))
+		self.assertTrue(small > len("[5 6]") * 10)
+		self.assertTrue(cache.tree_size(parse(config_text)) > cache.tree_size(parse("[1 2]")))
+
+		parser = Parser(max_bytes=small * 3 // 2)
+		parser.parse("[1 2 3 4]")
+		parser.parse("[5 6]")
+		self.assertEqual(len(parser), 1)
+		self.assertEqual(parser.size_bytes, small)
+		parser.parse(config_text) # too big to cache at all
+		self.assertEqual(len(parser), 1)
+		parser.clear()
+		self.assertEqual((len(parser), parser.size_bytes), (0, 0))
+
+stream_text = """
+<config name="main" version=2>
+	<server="alpha" port=80 ratio=0.5 opts={a:1}>
+		"some text" [1 2 3]
+	</server>
+	<server="beta" port=81/>
+</config>
+	[1 2 @>config>server[1];] 1234 -5.5e3 true 'str\\ning' `raw\\`` {a:@[1];}
+	<empty/>
+	<b = 77 c="x">
+		<d/> 12
+	</b> 99"""
+
+class TestIncremental(unittest.TestCase):
+	def test_threads(self):
+		# feeding takes turns with any other parsing going on
+		import threading
+		expected = freeze(parse(stream_text))
+		results = []
+		def run():
+			parser = IncrementalParser()
+			for i in range(0, len(stream_text), 3):
+				parser.feed(stream_text[i:i+3])
+				parse("[1 2 @[0][0];]")
+			parser.close()
+			results.append(freeze(parser.result))
+		threads = [threading.Thread(target=run) for i in range(3)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(results, [expected] * 3)
+
+	def test_chunk_sizes(self):
+		expected = freeze(parse(stream_text))
+		for size in [1, 2, 3, 7, 64, len(stream_text)]:
+			parser = IncrementalParser()
+			elements = []
+			for i in range(0, len(stream_text), size):
+				for event, elem in parser.feed(stream_text[i:i+size]):
+					self.assertEqual(event, "element")
+					elements.append(elem)
+			events = parser.close()
+			self.assertEqual(events[-1][0], "document")
+			elements.extend(elem for event, elem in events[:-1])
+			self.assertTrue(parser.result is events[-1][1])
+			self.assertEqual(elements, parser.result)
+			self.assertEqual(freeze(parser.result), expected)
+			# the link in the second element points into the first
+			self.assertTrue(parser.result[1][2] is parser.result[0][1])
+
+	def test_elements_arrive_early(self):
+		parser = IncrementalParser()
+		self.assertEqual(parser.feed("<a/> 12"), [("element", parser.elems[0])])
+		# 12 could still turn into 123
+		self.assertEqual(len(parser.elems), 1)
+		parser.feed("3 ")
+		self.assertEqual(parser.elems[1], 123)
+
+	def test_errors(self):
+		parser = IncrementalParser()
+		parser.feed("<a> 1 2")
+		with self.assertRaises(JXIParseError):
+			parser.close()
+
+		parser = IncrementalParser()
+		with self.assertRaises(JXIParseError) as cm:
+			parser.feed("<a/>\n<b/>\n  <c> & 5 </c>")
+		self.assertEqual(cm.exception.line, 3)
+		self.assertEqual(cm.exception.char, 7)
+
+		parser = IncrementalParser()
+		parser.close()
+		with self.assertRaises(ValueError):
+			parser.feed("1")
+
+	def test_iterparse(self):
+		import StringIO
+		events = list(iterparse(StringIO.StringIO(stream_text), chunk_size=5))
+		self.assertEqual(freeze(events[-1][1]), freeze(parse(stream_text)))
+		self.assertEqual(len(events), len(parse(stream_text)) + 1)
+		events = list(iterparse(["<a/>", " <b", "/>"]))
+		self.assertEqual([e[1]._tag_name for e in events[:-1]], ["a", "b"])
+
+class TestLinks(unittest.TestCase):
+	def test_attribute_links(self):
+		config = parse(config_text)[0]
+		alpha, beta = config._children
+		self.assertTrue(beta.backup is alpha)
+
+	def test_positions(self):
+		result = parse("[1\n  @[0];]")
+		self.assertEqual(result[0], [1, result[0]])
+		for buffered in (False, True):
+			with self.assertRaises(JXIParseError) as cm:
+				parse("<a/>\n [1 @>b;]", buffered=buffered)
+			self.assertEqual((cm.exception.line, cm.exception.char), (2, 5))
+			# parser errors know which token they're about
+			with self.assertRaises(JXIParseError) as cm:
+				parse("<a>\n <b x=1 y> </b>\n</a>", buffered=buffered)
+			self.assertEqual((cm.exception.line, cm.exception.char), (2, 10))
+
+	def test_missing_targets(self):
+		for text in ['<a/> @>b;', '[1] @[0].x;', '<a x=@>a.y;/>']:
+			with self.assertRaises(JXIParseError):
+				parse(text)
+
+class TestBuffered(unittest.TestCase):
+	def test_matches_parse(self):
+		for text in [config_text, stream_text, u"<a='\u00e9'/> [@>a;]", ""]:
+			buffered = parse(text, buffered=True)
+			self.assertEqual(freeze(buffered), freeze(parse(text)))
+		config = parse(config_text, buffered=True)[0]
+		self.assertTrue(config[1].backup is config[0])
+		result = parse(stream_text, buffered=True)
+		self.assertTrue(result[1][2] is result[0][1])
+
+	def test_errors(self):
+		with self.assertRaises(JXIParseError) as cm:
+			parse("<a>\n  <b x=> </b>\n</a>", buffered=True)
+		self.assertEqual((cm.exception.line, cm.exception.char), (2, 8))
+		for text in ["<a>", "<a></b>", "[1 2", "{a 1}", "@.a;", "@>a", "<a/> @>b;", "<a b=/>"]:
+			with self.assertRaises(JXIParseError):
+				parse(text, buffered=True)
+
+class TestLazyLinks(unittest.TestCase):
+	def test_resolved_on_access(self):
+		for buffered in (False, True):
+			config = parse(config_text, lazy_links=True, buffered=buffered)[0]
+			alpha, beta = config._children
+			self.assertTrue("backup" in beta._attrs())
+			self.assertTrue(beta.backup is alpha)
+			self.assertTrue("backup" in beta.__dict__)
+
+			result = parse("<a/> [@>a; @[1][0];] {x:@[1];} [@[2][x];]", lazy_links=True, buffered=buffered)
+			# nothing is resolved until it's asked for
+			self.assertEqual(type(list.__getitem__(result[1], 0)), SymbolicLink)
+			# links to links get followed
+			self.assertTrue(result[1][1] is result[0])
+			self.assertEqual(list(result[2].values()), [result[1]])
+			self.assertEqual(result[3][:], [result[1]])
+			self.assertTrue(result[2].get("x") is result[1])
+			self.assertEqual(len([elem for elem in result[1] if elem is result[0]]), 2)
+
+	def test_lazy_methods(self):
+		# list and dict methods see what links point to, not the links
+		a, l, d = parse("<a/> [@>a; 1] {x:@>a; y:@[1][1];}", lazy_links=True)
+		self.assertEqual(list(reversed(l)), [1, a])
+		self.assertTrue((l + [2])[0] is a)
+		self.assertTrue((l * 2)[2] is a)
+		copy = d.copy()
+		self.assertEqual(type(copy), dict)
+		self.assertTrue(copy["x"] is a)
+		self.assertEqual(copy["y"], 1)
+		self.assertTrue(d.setdefault("x") is a)
+		self.assertEqual(d.pop("y"), 1)
+		self.assertEqual(d.popitem(), ("x", a))
+		self.assertTrue(l.pop(0) is a)
+
+	def test_errors_on_access(self):
+		result = parse("<a/> [1 @>b;]", lazy_links=True)
+		self.assertEqual(result[1][0], 1)
+		with self.assertRaises(JXIParseError) as cm:
+			result[1][1]
+		self.assertEqual(cm.exception.char, 9)
+
+		result = parse("[@[0][1]; @[0][0];]", lazy_links=True)
+		with self.assertRaises(JXIParseError):
+			result[0][0]
+
+		tag = parse("<a x=@>b;/>", lazy_links=True)[0]
+		with self.assertRaises(JXIParseError):
+			tag.x
+		with self.assertRaises(AttributeError):
+			tag.y
+
+	def test_frozen(self):
+		# frozen trees can't hold lazy links, so they're resolved up front
+		result = parse("<a/> [@>a;]", lazy_links=True, frozen=True)
+		self.assertTrue(result[1][0] is result[0])
+		# and so are ones still waiting in attributes when a tree is frozen later
+		frozen = freeze(parse("<a x=1/> <b y=@>a.x;/>", lazy_links=True))
+		self.assertEqual(frozen[1].y, 1)
+		self.assertEqual(frozen, freeze(parse("<a x=1/> <b y=@>a.x;/>")))
+
+class TestNumbers(unittest.TestCase):
+	text = "<a x=1.50 y=[1 2.50 1e3]>3 0.1000000000000000055511151231257827 {7:2.0 k:[-7]}</a> @[0].y[1];"
+
+	def test_lazy(self):
+		for buffered in (False, True):
+			result = parse(self.text, lazy_numbers=True, buffered=buffered)
+			a = result[0]
+			# attributes and dict keys are decoded straight away
+			self.assertEqual(a.x, 1.5)
+			self.assertEqual(dict.__getitem__(a[2], 7), "2.0")
+			self.assertEqual(type(list.__getitem__(a.y, 2)), NumberText)
+			# everything else when it's got at
+			self.assertEqual(a.y[2], 1000)
+			self.assertEqual(type(list.__getitem__(a.y, 2)), float)
+			self.assertEqual(a[2][7], 2.0)
+			self.assertEqual(a.y, [1, 2.5, 1000])
+			self.assertEqual(result[1], 2.5)
+			# numbers nobody's read are written out as they were
+			self.assertEqual(dumps(parse(self.text, lazy_numbers=True, buffered=buffered)),
+			                 dumps(parse(self.text)).replace("0.1 ", "0.1000000000000000055511151231257827 ")
+			                                        .replace("1000.0", "1e3"))
+
+	def test_lazy_methods(self):
+		# list and dict methods see numbers, not their text
+		l, d = parse("[10 9 100 2.5] {a:10 b:9.5}", lazy_numbers=True)
+		self.assertEqual(sorted(l), [2.5, 9, 10, 100])
+		self.assertEqual(list(reversed(l)), [2.5, 100, 9, 10])
+		self.assertEqual(l + [1], [10, 9, 100, 2.5, 1])
+		self.assertEqual(type((l + [1])[0]), int)
+		self.assertEqual(l * 2, [10, 9, 100, 2.5] * 2)
+		self.assertEqual(l.pop(), 2.5)
+		self.assertEqual(l.pop(0), 10)
+		l.remove(100)
+		l.append(3)
+		l.sort()
+		self.assertEqual(list(list.__iter__(l)), [3, 9])
+
+		copy = d.copy()
+		self.assertEqual((type(copy), copy), (dict, {"a": 10, "b": 9.5}))
+		self.assertEqual(type(copy["a"]), int)
+		self.assertEqual(d.setdefault("a"), 10)
+		self.assertEqual(d.pop("b"), 9.5)
+		self.assertEqual(d.pop("b", None), None)
+		self.assertEqual(d.popitem(), ("a", 10))
+		self.assertEqual(type(d.setdefault("c", 1)), int)
+		d.clear()
+		with self.assertRaises(KeyError):
+			d.popitem()
+
+	def test_decimals(self):
+		for buffered in (False, True):
+			for lazy in (False, True):
+				a = parse(self.text, decimals=True, buffered=buffered, lazy_numbers=lazy)[0]
+				self.assertEqual(a.x, Decimal("1.50"))
+				self.assertEqual(a[1], Decimal("0.1000000000000000055511151231257827"))
+				self.assertEqual((a.y[0], type(a.y[0])), (1, int))
+				text = dumps(a)
+				self.assertTrue("0.1000000000000000055511151231257827" in text)
+				self.assertEqual(parse(text, decimals=True)[0][1], a[1])
+
+		with self.assertRaises(ValueError):
+			dumps(Decimal("nan"))
+		# trees that can't be lazy decode their numbers up front
+		self.assertEqual(parse("[1 2]", lazy_numbers=True, frozen=True), ((1, 2),))
+
+	def test_int_keys(self):
+		# a run of numbers stops before a dict key
+		for text in ["{1:2, 3:4}", "{1:2 3 :4 5:6}", "[{1:2 3:[4 5 6]} 7 8]", "{1:2, 3:4, 5:6}"]:
+			expected = dumps(parse(text))
+			for buffered in (False, True):
+				self.assertEqual(dumps(parse(text, lazy_numbers=True, buffered=buffered)), expected)
+		with self.assertRaises(JXIParseError):
+			parse("{1:2 3}", lazy_numbers=True, buffered=True)
+
+class TestJSON(unittest.TestCase):
+	def test_same_result(self):
+		texts = ['{"a": [1, -2.5e3, true, false, null], "b \\u00e9": {"c": "d\\n\\"", "1": []}}',
+		         u'[{"x": "\u00e9\u2603"}, "", 10000000000000000000000]', ' [] ', '{}']
+		for text in texts:
+			self.assertNotEqual(fastjson.loads(text), None)
+			for options in ({}, {"decimals": True}, {"frozen": True}):
+				self.assertEqual(parse(text, **options), parse(text, as_json=False, **options))
+		self.assertEqual(parse('"x"', as_json=True), ["x"])
+
+	def test_fallback(self):
+		# anything that isn't plain JSON goes to the jxi parser
+		texts = ["[1 2]", "{a:1}", "['x']", "[1, 2] [3]", "[01]", '["\\ud83d\\ude00"]',
+		         '[1, <a/>, @[0];]', "[`raw`]", "[1,]", '["\xff"]']
+		for text in texts:
+			self.assertEqual(fastjson.loads(text), None)
+			self.assertEqual(dumps(parse(text)), dumps(parse(text, as_json=False)))
+		with self.assertRaises(JXIParseError):
+			parse("[NaN]")
+
+class TestArchiveIndex(unittest.TestCase):
+	def setUp(self):
+		import tempfile
+		self.dir = tempfile.mkdtemp()
+		self.archive = os.path.join(self.dir, "archive.jxi")
+
+	def tearDown(self):
+		import shutil
+		shutil.rmtree(self.dir)
+
+	def append(self, text):
+		with open(self.archive, "ab") as f:
+			f.write(text)
+
+	def test_incremental(self):
+		self.append('<rec id=3 v="c"/>\n<rec id=1 v="a">\n\t[1 2 @[0];]\n</rec>\n')
+		index = ArchiveIndex(self.archive, key="id")
+		self.assertEqual(len(index), 2)
+		self.assertEqual(index.read(0), '<rec id=3 v="c"/>')
+		self.assertEqual(index[1].v, "a")
+		# links are followed within the element
+		rec = index[1]
+		self.assertTrue(rec[0][2] is rec)
+
+		# half-written elements wait until they're finished
+		self.append('"not a rec" <rec id=2 v="b"> 5 </r')
+		self.assertEqual(index.update(), 1)
+		self.append('ec> 12')
+		self.assertEqual(index.update(), 1)
+		self.append('3 ')
+		self.assertEqual(index.update(), 1)
+		self.assertEqual(index[4], 123)
+
+		# the index file picks up where it left off
+		index.close()
+		index = ArchiveIndex(self.archive, key="id")
+		self.assertEqual(len(index), 5)
+		self.assertEqual(index.update(), 0)
+		self.assertEqual(index.find(2)._children, [5])
+		self.assertEqual([rec.v for rec in index.keyrange(1, 3)], ["a", "b"])
+		self.assertEqual([rec.v for rec in index.keyrange(2)], ["b", "c"])
+		with self.assertRaises(KeyError):
+			index.find(7)
+
+		with self.assertRaises(ValueError):
+			ArchiveIndex(self.archive, key="v")
+		index.close()
+
+	def test_errors(self):
+		self.append("<a/> <b> & </b> <c/>")
+		with self.assertRaises(JXIParseError):
+			ArchiveIndex(self.archive)
+
+class TestCompressed(unittest.TestCase):
+	def compressed(self, text, kind, pieces=1):
+		import StringIO
+		out = StringIO.StringIO()
+		# several streams one after the other should read as one
+		step = len(text) // pieces + 1
+		for i in range(0, len(text), step):
+			with compress.CompressedWriter(out, kind, buffer_size=7) as writer:
+				writer.write(text[i:i+step])
+		out.seek(0)
+		return out
+
+	def test_load(self):
+		expected = freeze(parse(stream_text))
+		kinds = ["gzip", "bz2"] + (["xz"] if compress.lzma is not None else [])
+		for kind in kinds:
+			for pieces in (1, 3):
+				stream = self.compressed(stream_text, kind, pieces)
+				self.assertEqual(compress.sniff(stream.getvalue()), kind)
+				for chunk_size in (5, 65536):
+					stream.seek(0)
+					self.assertEqual(freeze(compress.load(stream, chunk_size=chunk_size)), expected)
+		# uncompressed data comes through as it is
+		import StringIO
+		self.assertEqual(freeze(compress.load(StringIO.StringIO(stream_text))), expected)
+
+	def test_bomb(self):
+		# data that expands enormously still only comes out a chunk at a time
+		zeros = "\0" * (20 * 1024 * 1024)
+		stream = self.compressed(zeros, "gzip", 2)
+		self.assertTrue(len(stream.getvalue()) < 100000)
+		sizes = [len(chunk) for chunk in compress.chunks(stream, chunk_size=4096)]
+		self.assertEqual(max(sizes), 4096)
+		self.assertEqual(sum(sizes), len(zeros))
+
+	def test_dump(self):
+		import tempfile, shutil
+		tmp = tempfile.mkdtemp()
+		try:
+			path = os.path.join(tmp, "out.jxi.gz")
+			compress.dump(RawString("raw"), path)
+			with open(path, "rb") as f:
+				self.assertEqual(compress.sniff(f.read()), "gzip")
+			self.assertEqual(compress.load(path), ["raw"])
+		finally:
+			shutil.rmtree(tmp)
+
+class TestFlat(unittest.TestCase):
+	def test_navigation(self):
+		doc = flat.FlatDocument(flat.flatten(parse(config_text)))
+		self.assertEqual(len(doc), 1)
+		config = doc[0]
+		self.assertEqual((config._tag_name, config.name, config.version), ("config", "main", 2))
+		self.assertEqual(config._attrs(), ["name", "version"])
+		alpha = config["server"]
+		self.assertEqual((alpha.server, alpha.port, alpha.ratio), ("alpha", 80, 0.5))
+		self.assertEqual(alpha.opts["a"], 1)
+		self.assertEqual(alpha.opts.items(), [("a", 1)])
+		self.assertEqual(alpha[0], "some text")
+		self.assertEqual(list(alpha[1]), [1, 2, 3])
+		self.assertEqual(alpha[-1][1:], [2, 3])
+		# links come out as their targets
+		beta = config[".server"][1]
+		self.assertTrue(beta.backup is alpha)
+		with self.assertRaises(AttributeError):
+			alpha.backup
+		with self.assertRaises(KeyError):
+			config["client"]
+		with self.assertRaises(IndexError):
+			alpha[2]
+		# one letter tag names are fine
+		tag = flat.FlatDocument(flat.flatten(parse("<a><b/> 1 <b x=2/></a>")))[0]
+		self.assertEqual(tag[".b"][1].x, 2)
+		self.assertEqual(tag["b"]._tag_name, "b")
+
+	def test_values(self):
+		elems = parse("{b:[1 2] a:`raw` c:-1.5e3} [@[0][b];] 99999999999999999999999")
+		elems.append([None, True, False, u"\u00e9"])
+		# cycles are fine too
+		elems[-1].append(elems[-1])
+		doc = flat.FlatDocument(bytearray(flat.flatten(elems)))
+		d = doc[0]
+		self.assertEqual(d.keys(), ["a", "b", "c"])
+		self.assertEqual(type(d["a"]), RawString)
+		self.assertEqual((d["c"], d.get("z"), "b" in d), (-1500.0, None, True))
+		self.assertTrue(doc[1][0] is d["b"])
+		self.assertEqual(doc[2], 99999999999999999999999)
+		self.assertEqual(doc[3][:4], [None, True, False, "\xc3\xa9"])
+		self.assertTrue(doc[3][4] is doc[3])
+
+		with self.assertRaises(ValueError):
+			flat.FlatDocument("not flat at all")
+
+	def test_shared(self):
+		import tempfile, shutil
+		elems = parse(config_text, lazy_links=True)
+		doc = flat.share(elems)
+		self.assertEqual(doc[0][1].backup._tag_name, "server")
+		doc.close()
+
+		tmp = tempfile.mkdtemp()
+		try:
+			path = os.path.join(tmp, "config.jxif")
+			flat.dump(elems, path)
+			with flat.load(path) as doc:
+				self.assertEqual(doc[0]["server"].port, 80)
+		finally:
+			shutil.rmtree(tmp)
+
+class TestPacking(unittest.TestCase):
+	def deep(self, depth):
+		root = elem = Entity("a", {}, [])
+		for i in xrange(depth):
+			child = Entity("a", {"n": i}, [])
+			elem._append(child)
+			elem = child
+		return root
+
+	def test_pickle(self):
+		import cPickle
+		for lazy in (False, True):
+			elems = parse(config_text + "[@[0][1];]", lazy_links=lazy)
+			for result in (packing.loads(packing.dumps(elems)), cPickle.loads(cPickle.dumps(elems))):
+				config, links = result
+				alpha, beta = config._children
+				self.assertTrue(beta.backup is alpha)
+				self.assertTrue(links[0] is beta)
+				self.assertEqual(alpha.opts, {"a": 1})
+				self.assertEqual(alpha[1], [1, 2, 3])
+
+		frozen = parse(config_text + "{x:@>config;}", frozen=True)
+		copied = packing.loads(packing.dumps(frozen))
+		self.assertEqual(copied, frozen)
+		self.assertTrue(copied[1]["x"] is copied[0])
+		self.assertEqual(hash(copied[0]), hash(frozen[0]))
+
+		# cycles come through too
+		elems = parse("[1 @[0];]")
+		result = packing.loads(packing.dumps(elems))
+		self.assertTrue(result[0][1] is result[0])
+
+		deep = packing.loads(packing.dumps(self.deep(5000)))
+		self.assertEqual(len(deep), 1)
+
+	def test_chunked(self):
+		from chunked import ChunkedList
+		shared = {"k": [1]}
+		tag = Entity("a", {"x": shared}, [])
+		tag._children = ChunkedList([shared, 2, [shared]], load=4)
+		for result in (packing.loads(packing.dumps([tag])), packing.copy_tree([tag])):
+			copied = result[0]
+			self.assertEqual(type(copied._children), ChunkedList)
+			self.assertEqual(list(copied), [shared, 2, [shared]])
+			self.assertTrue(copied[0] is copied.x)
+			self.assertTrue(copied[2][0] is copied.x)
+			self.assertFalse(copied.x is shared)
+		self.assertEqual(copied._children._load, 4)
+
+	def test_deepcopy(self):
+		import copy
+		elems = parse(config_text + "[@[0][1];]", lazy_links=True)
+		config, links = copy.deepcopy(elems)
+		alpha, beta = config._children
+		self.assertTrue(beta.backup is alpha)
+		self.assertTrue(links[0] is beta)
+		self.assertFalse(alpha is elems[0][0])
+		alpha.opts["b"] = 2
+		self.assertEqual(elems[0][0].opts, {"a": 1})
+
+		frozen = parse(config_text, frozen=True)
+		self.assertTrue(copy.deepcopy(frozen)[0] is frozen[0])
+		copied = packing.copy_tree(self.deep(5000))
+		self.assertEqual(copied[0].n, 0)
+
+class TestMerkle(unittest.TestCase):
+	def test_digests(self):
+		for buffered in (False, True):
+			a = parse(config_text, hashes=True, buffered=buffered)
+			b = parse(config_text.replace("\t", "  "), hashes=True, buffered=buffered)
+			self.assertEqual(len(a[0]._digest), 20)
+			self.assertEqual(merkle.digest(a), merkle.digest(b))
+			self.assertEqual(merkle.digest(a[0][0].opts), merkle.digest(b[0][0].opts))
+			# links still work. They're hashed by path, as are lazy ones
+			self.assertTrue(a[0][1].backup is a[0][0])
+			self.assertEqual(merkle.digest(parse(config_text, lazy_links=True)), merkle.digest(a))
+			self.assertNotEqual(merkle.digest(a), merkle.digest(parse(config_text.replace("80", "8080"))))
+			# types count
+			self.assertNotEqual(merkle.digest(parse("[1]")), merkle.digest(parse('["1"]')))
+			self.assertNotEqual(merkle.digest(parse("[`1`]")), merkle.digest(parse('["1"]')))
+
+		with self.assertRaises(ValueError):
+			parse("<a/>", hashes=True, frozen=True)
+
+	def test_diff(self):
+		old = parse(config_text, hashes=True)
+		new = parse(config_text.replace("port=80", "port=8080 weight=3")
+		                       .replace('[1 2 3]', '[1 2 3 4]')
+		                       .replace('version=2', ''), hashes=True)
+		self.assertEqual(merkle.diff(old, old), [])
+		self.assertEqual(merkle.diff(old, new), [
+			("removed", "[0].version"),
+			("modified", "[0][0].port"),
+			("added", "[0][0].weight"),
+			("added", "[0][0][1][3]"),
+		])
+
+		old = parse('{a:1 "b c":[<x/> <y/>] 2:3} <t/>')
+		new = parse('{a:1 "b c":[<z/> <y/>] 2:4} <u/> 5')
+		self.assertEqual(merkle.diff(old, new), [
+			('modified', '[0][2]'),
+			('modified', '[0]["b c"][0]'),
+			('modified', '[1]'),
+			('added', '[2]'),
+		])
+
+		# links are compared by path, and cycles don't go on forever
+		old = parse("[1 @[0];] [@[1];]", hashes=True)
+		new = parse("[2 @[0];] [@[1];]", hashes=True)
+		self.assertEqual(merkle.diff(old, new), [("modified", "[0][0]")])
+
+class Config(Entity):
+	pass
+
+class Server(object):
+	__slots__ = ("server", "port", "ratio", "opts", "backup", "children")
+
+Point = namedtuple("Point", "x y")
+
+class Circle(object):
+	def __init__(self, r, children):
+		self.r = r
+		self.children = children
+
+class TestRegistry(unittest.TestCase):
+	def test_classes(self):
+		tagclasses = TagRegistry({"config": Config, "server": Server})
+		for buffered in (False, True):
+			for lazy in (False, True):
+				elems = parse(config_text, buffered=buffered, lazy_links=lazy, tagclasses=tagclasses)
+				config = elems[0]
+				self.assertEqual(type(config), Config)
+				self.assertEqual(config.version, 2)
+				alpha, beta = config
+				self.assertEqual(type(alpha), Server)
+				self.assertEqual((alpha.server, alpha.port, alpha.opts), ("alpha", 80, {"a": 1}))
+				self.assertEqual(alpha.children, ["some text", [1, 2, 3]])
+				self.assertEqual(beta.children, [])
+				# links find registered tags by name
+				self.assertTrue(beta.backup is alpha)
+
+		elems = parse("<p x=1 y=2/> <c r=@[0].x;>1 <p x=3/></c> @>c[0][1];", tagclasses={"p": Point, "c": Circle})
+		self.assertEqual(elems[0], Point(1, 2))
+		self.assertEqual(elems[1].r, 1)
+		self.assertEqual(elems[1].children, [1, Point(3, None)])
+		self.assertTrue(elems[2] is elems[1].children[1])
+
+		# unregistered tags are left alone
+		self.assertEqual(type(parse("<q/>", tagclasses={"p": Point})[0]), Entity)
+
+	def test_separate_registries(self):
+		# registering a class in one registry doesn't change what it's called
+		# in another
+		servers = TagRegistry({"server": Server})
+		lazy = parse("<server port=1/> @>server.port;", tagclasses=servers, lazy_links=True)
+		TagRegistry({"host": Server})
+		for buffered in (False, True):
+			elems = parse("<server port=1/> @>server.port;", tagclasses=servers, buffered=buffered)
+			self.assertEqual(elems[1], 1)
+		self.assertEqual(lazy[1], 1)
+		with self.assertRaises(ValueError):
+			servers.register("host", Server)
+
+	def test_errors(self):
+		for buffered in (False, True):
+			with self.assertRaises(JXIParseError):
+				parse("<p x=1 z=2/>", buffered=buffered, tagclasses={"p": Point})
+			with self.assertRaises(JXIParseError):
+				parse("<p x=1>2</p>", buffered=buffered, tagclasses={"p": Point})
+			with self.assertRaises(JXIParseError):
+				parse("<server bogus=1/>", buffered=buffered, tagclasses={"server": Server})
+			# named tuples can't have links filled in afterwards
+			with self.assertRaises(JXIParseError):
+				parse("<p x=@[1]; y=2/> 1", buffered=buffered, tagclasses={"p": Point})
+		with self.assertRaises(ValueError):
+			parse("<p/>", frozen=True, tagclasses={"p": Point})
+
+class TestValidate(unittest.TestCase):
+	def test_valid(self):
+		for text in [config_text, stream_text, "", "<a/> [@>a;]", "[1 2 @[0][0];]"]:
+			parse(text)
+			self.assertEqual(validate(text), [])
+
+	def test_scanner_agrees(self):
+		# the fast scanner and the recovering validator should always agree
+		texts = [config_text, stream_text, "<a=1 b=2/>", "<a> <b/> </a>", "{a:1 'b':2 3:[]}",
+		         "@>a>b[0].c[1]['x'];", "<a", "<a b=>", "<a></b>", "[1 2", "{a 1}",
+		         "{a:}", "@.a;", "@>1;", "@[1 ;", "<a/ >", "</a>", "<a>1</a", "&"]
+		for text in texts:
+			validator = Validator(text)
+			validator.validate_file()
+			self.assertEqual(scan(text) is None, len(validator.errors) > 0, text)
+
+	def test_bad_links(self):
+		text = "<a x=@>a>c;/>\n  [@[0].y; @[1][5]; @[2];]"
+		errors = validate(text)
+		self.assertEqual([(e.line, e.char) for e in errors], [(1, 6), (2, 4), (2, 12), (2, 21)])
+		for e in errors:
+			self.assertTrue(isinstance(e, JXIParseError))
+			self.assertTrue(e.reason.startswith("Link not found"))
+		with self.assertRaises(JXIParseError):
+			parse(text)
+
+		# cycles are errors too
+		self.assertEqual(len(validate("[@[0][1]; @[0][0];]")), 2)
+		# even ones which go through a path, rather than from link to link
+		for text in ["@[0][0];", "<a x=@>a.x.y;/>"]:
+			errors = validate(text)
+			self.assertEqual(len(errors), 1)
+			self.assertTrue(isinstance(errors[0], JXIParseError))
+
+	def test_agrees_with_parser(self):
+		# links are resolved in the order they appear, and links in the middle
+		# of a path aren't followed
+		texts = ["@[2].x; <a x=1/> @>a;", "<a x=1/> @>a; @[1].x;", "@[1]; @[2]; 5",
+		         "[@[1][0]; [1]]", "[@[1]; @[0];]", "<a x=@>b; y=@>a.x;/> <b/>",
+		         "<a x=@>b.y;/> <b y=@>a.x;/>", "@>a>b; <a>@>c; <b/></a> <c/>",
+		         "<a>@>c;</a> @>a>c; <c/>", "{k:@[0]['k'];}", "@[0][0];", "<a x=@>a.x.y;/>",
+		         "[@[1]; @[2]; [3]] @[0][1][0];"]
+		for text in texts:
+			try:
+				parse(text)
+				parses = True
+			except JXIParseError:
+				parses = False
+			self.assertEqual(validate(text) == [], parses, text)
+
+	def test_reports_all_errors(self):
+		text = "<a>\n <b x=> </b>\n <c> & </c>\n</a>\n<d>\n 1 2 </e>\n</d> <f/>"
+		errors = validate(text)
+		self.assertEqual([(e.line, e.char) for e in errors], [(2, 7), (3, 6), (6, 8)])
+		self.assertEqual(errors[1].reason, "Illegal character '&'")
+
+		# missing closing tags get picked up by the enclosing one
+		errors = validate("<a> <b> </a> <c x=y/> 'unterminated")
+		self.assertEqual([e.char for e in errors], [11, 19, 36])
+
+class TestInclude(unittest.TestCase):
+	def setUp(self):
+		import tempfile
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		import shutil
+		shutil.rmtree(self.dir)
+
+	def write(self, name, text):
+		path = os.path.join(self.dir, name)
+		with open(path, "wb") as f:
+			f.write(text)
+		# mtimes can be too coarse to see a quick rewrite, so bump it
+		info = os.stat(path)
+		os.utime(path, (info.st_atime, info.st_mtime + 10 * len(text)))
+		return path
+
+	def test_splicing(self):
+		self.write("base.jxi", '<server host="a" port=80/> <server host="b" port=81/>')
+		self.write("one.jxi", '{retries:3}')
+		path = self.write("main.jxi", '<config opts=<include="one.jxi"/>>\n\t<include="base.jxi"/>\n\t@>config>server[1];\n</config>')
+		loader = include.Loader(copy=False)
+		config = loader.load(path)[0]
+		self.assertEqual([s.host for s in config[:2]], ["a", "b"])
+		self.assertTrue(config[2] is config[1])
+		self.assertEqual(config.opts, {"retries": 3})
+		self.assertEqual((loader.hits, loader.misses), (0, 3))
+
+		# a multi-element file can only go where a list of things can
+		bad = self.write("bad.jxi", '<a x=<include="base.jxi"/>/>')
+		with self.assertRaises(JXIParseError):
+			loader.load(bad)
+
+	def test_cache(self):
+		self.write("base.jxi", '<server port=80/>')
+		a = self.write("a.jxi", '[<include="base.jxi"/>]')
+		b = self.write("b.jxi", '[<include="base.jxi"/> 1]')
+		loader = include.Loader(copy=False)
+		self.assertTrue(loader.load(a)[0][0] is loader.load(b)[0][0])
+		self.assertEqual((loader.hits, loader.misses), (1, 3))
+		loader.load(a)
+		self.assertEqual((loader.hits, loader.misses), (2, 3))
+
+		# changing an included file means whatever includes it is redone too
+		self.write("base.jxi", '<server port=8080/>')
+		self.assertEqual(loader.load(a)[0][0].port, 8080)
+		self.assertEqual(loader.misses, 5)
+
+	def test_copies(self):
+		self.write("base.jxi", '<server port=80/>')
+		path = self.write("main.jxi", '<config> <include="base.jxi"/> </config>')
+		loader = include.Loader()
+		first = loader.load(path)[0]
+		first[0].port = 1
+		self.assertEqual(loader.load(path)[0][0].port, 80)
+
+		frozen = include.Loader(frozen=True).load(path)[0]
+		self.assertEqual(frozen[0].port, 80)
+		with self.assertRaises(TypeError):
+			frozen[0].port = 1
+
+		# links can index into the lists and dicts of frozen includes
+		self.write("data.jxi", '<base>[1 [2 3]] {k:[4]}</base>')
+		path = self.write("links.jxi", '<include="data.jxi"/> @>base[0][0][1][0]; @>base[0][1][k][0];')
+		self.assertEqual(include.Loader(frozen=True).load(path)[1:], (2, 4))
+
+	def test_cycles(self):
+		self.write("a.jxi", '[<include="b.jxi"/>]')
+		self.write("b.jxi", '[<include="a.jxi"/>]')
+		with self.assertRaises(JXIParseError) as cm:
+			include.Loader().load(os.path.join(self.dir, "a.jxi"))
+		self.assertTrue("includes itself" in str(cm.exception))
+
+class TestAttrIndex(unittest.TestCase):
+	text = """<doc>
+		<item id=1 kind="a"/> <item id=2 kind="b" ref=@>doc>item[0];/>
+		<group id=3> [<item id=4 kind="a"/>] </group>
+		<item id=5 kind="b" opts={x:<item id=6/>}/>
+	</doc>"""
+
+	def ids(self, tags):
+		return sorted(tag.id for tag in tags)
+
+	def test_lookups(self):
+		index = AttrIndex()
+		doc = parse(self.text, index=index)[0]
+		self.assertEqual(type(doc), IndexedEntity)
+		self.assertEqual(len(index), 7)
+		self.assertTrue(index.get("id", 2) is doc[1])
+		self.assertTrue(index.get("id", 9) is None)
+		self.assertEqual(self.ids(index.find("kind", "a")), [1, 4])
+		self.assertEqual(self.ids(index.having("kind")), [1, 2, 4, 5])
+		self.assertEqual([tag.id for tag in index.valuerange("id", 2, 5)], [2, 3, 4])
+		self.assertEqual(index.values("kind"), ["a", "b"])
+		# links aren't indexed as values, or twice over
+		self.assertEqual(index.having("ref"), [])
+
+		# just some of the attributes
+		index = AttrIndex(["kind"])
+		parse(self.text, index=index, buffered=True)
+		self.assertEqual(index.having("id"), [])
+		self.assertEqual(len(index.find("kind", "b")), 2)
+		with self.assertRaises(ValueError):
+			parse(self.text, frozen=True, index=index)
+
+	def test_changes(self):
+		index = AttrIndex()
+		doc = parse(self.text, index=index)[0]
+		item = index.get("id", 1)
+		item.id = 10
+		self.assertEqual(index.find("id", 1), [])
+		self.assertTrue(index.get("id", 10) is item)
+		del item.kind
+		self.assertEqual(self.ids(index.find("kind", "a")), [4])
+
+		# children coming and going take their subtrees with them
+		del doc[".group"]
+		self.assertTrue(index.get("id", 4) is None)
+		doc._append(parse("<item id=7> <item id=8/> </item>", index=index)[0])
+		self.assertEqual(index.get("id", 8)._tag_name, "item")
+		removed = doc._pop(0)
+		self.assertFalse(removed in index)
+		item = index.get("id", 8)
+		item.id = 11
+		self.assertEqual([tag.id for tag in index.valuerange("id", 10)], [11])
+		index.get("id", 5).opts = {}
+		self.assertTrue(index.get("id", 6) is None)
+		self.assertEqual(self.ids(index.having("id")), [2, 5, 7, 11])
+
+class TestLimits(unittest.TestCase):
+	def limit(self, text, **limits):
+		with self.assertRaises(JXILimitError) as cm:
+			parse(text, limits=Limits(**limits))
+		return cm.exception.limit
+
+	def test_depth(self):
+		text = "<a> [{x:[1]}] </a>"
+		self.assertEqual(parse(text, limits=Limits(depth=4)), parse(text))
+		self.assertEqual(self.limit(text, depth=3), "depth")
+		# even when python's own recursion limit is what stops it
+		with self.assertRaises(JXILimitError) as cm:
+			parse("[" * 100000, limits=Limits(depth=1000000))
+		self.assertEqual((cm.exception.limit, cm.exception.maximum), ("depth", 1000000))
+		self.assertEqual(parse_module.depth, 0)
+		# the json fast path and the buffered parser don't get round them
+		self.assertEqual(self.limit("[[[1]]]", depth=2), "depth")
+		with self.assertRaises(JXILimitError):
+			parse("[[[1]]]", buffered=True, limits=Limits(depth=2))
+		# and everything is back to normal afterwards
+		self.assertEqual(parse("[[[1]]]"), [[[[1]]]])
+
+	def test_links(self):
+		self.assertEqual(self.limit("[1 @[0]; @[0]; @[0];]", links=2), "links")
+		chain = "[1 %s]" % " ".join("@[0][%d];" % i for i in range(50))
+		self.assertEqual(len(parse(chain, limits=Limits(links=50))[0]), 51)
+		# the queue goes front to back, so links to later links wait around
+		backwards = "[%s 1]" % " ".join("@[0][%d];" % (i + 1) for i in range(50))
+		self.assertEqual(parse(backwards, limits=Limits(link_chain=50))[0][0], 1)
+		self.assertEqual(self.limit(backwards, link_chain=10), "link_chain")
+		tree = parse(backwards, lazy_links=True, limits=Limits(link_chain=10))
+		with self.assertRaises(JXILimitError):
+			tree[0][0]
+		self.assertEqual(parse(backwards, lazy_links=True)[0][0], 1)
+
+	def test_untrusted(self):
+		self.assertEqual(parse(config_text, limits=untrusted), parse(config_text))
+		self.assertEqual(self.limit(config_text, seconds=-1), "seconds")
+		with self.assertRaises(JXIParseError):
+			parse('{"a":"' + "x" * 2000000 + '"}', limits=untrusted)
+
+# how long `import jxi` may take, in seconds. It's measured at well under a
+# millisecond, against ~40ms for importing parse and entity up front
+import_budget = 0.01
+
+class TestPackage(unittest.TestCase):
+	def run_python(self, code):
+		root = os.path.dirname(os.path.abspath("../jxi/"))
+		env = dict(os.environ, PYTHONPATH=root)
+		return subprocess.check_output([sys.executable, "-c", code], env=env)
+
+	def test_lazy_import(self):
+		output = self.run_python("""
+import sys, time
+start = time.time()
+import jxi
+took = time.time() - start
+print took, sorted(name for name in sys.modules if name.startswith("jxi.") and sys.modules[name])
+""")
+		took, loaded = output.split(" ", 1)
+		self.assertLess(float(took), import_budget)
+		self.assertEqual(loaded.strip(), "[]")
+
+	def test_exports(self):
+		# nothing gets printed along the way
+		output = self.run_python("""
+import jxi, jxi.incremental
+from jxi.parse import LazyList
+elems = jxi.parse("<a b=1>[1 2]</a>")
+print jxi.dumps(elems),
+print jxi.iterparse.__module__, jxi.Entity.__module__, LazyList.__module__
+try:
+	jxi.parse("<a")
+except jxi.JXIParseError:
+	print "error"
+""")
+		self.assertEqual(output, "<a b=1>[1 2]</a>\njxi.incremental jxi.entity jxi.parse\nerror\n")
+
+
+if __name__ == "__main__":
+	unittest.main()